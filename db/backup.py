@@ -0,0 +1,150 @@
+"""Online backups of the database with verification, compression and rotation.
+
+A backup is a consistent snapshot taken with the SQLite backup API while the
+app keeps working (see Database.backup_to). It is checked with PRAGMA
+quick_check, optionally compressed, and only then appears in the backup
+directory as <db name>_backup_<YYYYmmdd_HHMMSS>.db[.gz|.zst]; older
+backups past the retention policy are deleted.
+"""
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+from datetime import datetime
+from urllib.parse import quote
+
+from utils.files import make_temp_path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Retention: the newest backup of each of the last KEEP_DAILY days that have
+# one, and of each of the last KEEP_WEEKLY (ISO) weeks, is kept (see expired_backups)
+KEEP_DAILY = 7
+KEEP_WEEKLY = 4
+
+COMPRESSION_SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+# Bytes read and written at a time while compressing
+COPY_CHUNK = 1 << 20
+
+TIMESTAMP_FORMAT = '%Y%m%d_%H%M%S'
+
+
+def default_backup_dir(db):
+    return os.path.join(os.path.dirname(os.path.abspath(db.path)), 'backups')
+
+
+def backup_name(db, when, compression=None):
+    stem = os.path.splitext(os.path.basename(db.path))[0]
+    return f'{stem}_backup_{when.strftime(TIMESTAMP_FORMAT)}.db{COMPRESSION_SUFFIXES[compression]}'
+
+
+def backup_database(db, directory=None, progress=None, compression=None,
+                    keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY):
+    """Back db up into directory (default: backups/ next to it) and apply the retention policy.
+
+    compression: None, 'gzip' or 'zstd' (needs the zstandard package).
+    progress(done_pages, total_pages) is reported while copying; an exception
+    it raises aborts the backup. Nothing is left behind by a failed backup.
+    Returns the path of the new backup.
+    """
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f'ضغط غير مدعوم: {compression}')
+    if compression == 'zstd' and zstandard is None:
+        raise RuntimeError('الضغط بصيغة zstd يتطلب تثبيت zstandard')
+    directory = directory or default_backup_dir(db)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, backup_name(db, datetime.now(), compression))
+
+    copy = make_temp_path(directory, '.backup-', '.part')
+    packed = None
+    try:
+        db.backup_to(copy, progress=progress)
+        quick_check(copy)
+        if compression:
+            packed = make_temp_path(directory, '.backup-', '.part')
+            compress_file(copy, packed, compression)
+            os.replace(packed, path)
+        else:
+            os.replace(copy, path)
+    finally:
+        for tmp in (copy, packed):
+            # an aborted copy may still have its journal files
+            for leftover in (tmp, f'{tmp}-wal', f'{tmp}-shm', f'{tmp}-journal'):
+                if tmp and os.path.exists(leftover):
+                    os.remove(leftover)
+    prune_backups(db, directory, keep_daily, keep_weekly, keep=(os.path.basename(path),))
+    return path
+
+
+def quick_check(path):
+    """Raise RuntimeError unless PRAGMA quick_check finds the database file at path intact"""
+    conn = sqlite3.connect(f'file:{quote(os.path.abspath(path))}?mode=ro', uri=True)
+    try:
+        problems = [r[0] for r in conn.execute('PRAGMA quick_check')]
+    finally:
+        conn.close()
+    if problems != ['ok']:
+        raise RuntimeError('النسخة الاحتياطية تالفة: ' + '; '.join(problems[:5]))
+
+
+def compress_file(src, dst, compression):
+    with open(src, 'rb') as fin, open(dst, 'wb') as raw:
+        if compression == 'gzip':
+            with gzip.GzipFile(fileobj=raw, mode='wb') as fout:
+                shutil.copyfileobj(fin, fout, COPY_CHUNK)
+        else:
+            with zstandard.ZstdCompressor().stream_writer(raw) as fout:
+                shutil.copyfileobj(fin, fout, COPY_CHUNK)
+
+
+def list_backups(db, directory):
+    """(timestamp, file name) of db's backups in directory, newest first (same second: by name, descending)"""
+    stem = re.escape(os.path.splitext(os.path.basename(db.path))[0])
+    pattern = re.compile(rf'{stem}_backup_(\d{{8}}_\d{{6}})\.db(\.gz|\.zst)?')
+    backups = []
+    for name in os.listdir(directory):
+        m = pattern.fullmatch(name)
+        if m:
+            backups.append((datetime.strptime(m.group(1), TIMESTAMP_FORMAT), name))
+    return sorted(backups, reverse=True)
+
+
+def expired_backups(backups, keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY, keep=()):
+    """The names of backups ((timestamp, name) pairs, see list_backups) the retention policy drops.
+
+    Only the newest backup of a day is kept, for the keep_daily most recent
+    days that have a backup; likewise per ISO week for keep_weekly weeks. So
+    a second backup on the same day replaces the first. Backups taken in the
+    same second are ordered by name (descending), after any named in keep;
+    those are never dropped (e.g. the backup just written).
+    """
+    ordered = sorted(backups, key=lambda b: (b[0], b[1] in keep, b[1]), reverse=True)
+    days = set()
+    weeks = set()
+    expired = []
+    for when, name in ordered:
+        retained = name in keep
+        if when.date() not in days and len(days) < keep_daily:
+            days.add(when.date())
+            retained = True
+        week = when.isocalendar()[:2]
+        if week not in weeks and len(weeks) < keep_weekly:
+            weeks.add(week)
+            retained = True
+        if not retained:
+            expired.append(name)
+    return expired
+
+
+def prune_backups(db, directory, keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY, keep=()):
+    """Delete db's backups in directory past the retention policy (never those named in keep);
+    returns their names"""
+    expired = expired_backups(list_backups(db, directory), keep_daily, keep_weekly, keep)
+    for name in expired:
+        os.remove(os.path.join(directory, name))
+    return expired
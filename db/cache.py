@@ -0,0 +1,85 @@
+"""Write-invalidated cache for the Database summary queries.
+
+Entries are keyed by tuples such as ('project_summary', project_id) or
+('entity_balance', entity_type, entity_id). The Database mutators drop exactly
+the keys their write affects, so a cached value is never stale and summaries
+of untouched projects/entities are never recomputed.
+"""
+import functools
+import threading
+
+
+class QueryCache:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._epoch = 0
+
+    @property
+    def epoch(self):
+        """Counter bumped by every invalidation"""
+        return self._epoch
+
+    def get(self, key, compute, store=True, since=None):
+        """Return the cached value for key, computing (and optionally storing) it on a miss.
+
+        since: epoch the data compute reads was current at (e.g. when a snapshot
+        was opened); defaults to now. Nothing is stored if it has moved on.
+        """
+        with self._lock:
+            if key in self._data:
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            epoch = self._epoch if since is None else since
+        value = compute()
+        if store:
+            with self._lock:
+                # a write that landed while computing may have made value stale
+                if self._epoch == epoch:
+                    self._data[key] = value
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._epoch += 1
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'entries': len(self._data),
+            }
+
+
+def cached(key_fn):
+    """Cache a Database read method under key_fn(*args, **kwargs).
+
+    key_fn returns None for calls that must bypass the cache (e.g. date-range
+    queries). Cached values are shared between callers and must be treated as
+    read-only.
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = key_fn(*args, **kwargs)
+            if key is None:
+                return method(self, *args, **kwargs)
+            return self._cache.get(key, lambda: method(self, *args, **kwargs),
+                                   store=self._can_cache(), since=self._cache_since())
+        return wrapper
+    return decorate
@@ -1,127 +1,420 @@
+import os
+import queue
 import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from urllib.parse import quote
+
+from utils.validators import to_iso_date
+from .cache import QueryCache, cached
+from .migrations import apply_migrations, rebuild_ledger_totals
+
+
+# How long a connection waits on a lock held by another connection (ms)
+BUSY_TIMEOUT_MS = 5000
+
+# Rows pulled from SQLite per fetchmany() call by the iter_* methods
+STREAM_BATCH = 500
+
+# Pages copied per step by backup_to (with the default 4 KiB pages, 4 MiB)
+BACKUP_PAGES = 1024
+
+# Ledger rows (assignments, entity_balances) of a worker / importer / project that no longer exists
+ORPHANED_LEDGER_SQL = '''
+    (entity_type = 'worker' AND entity_id NOT IN (SELECT id FROM workers))
+    OR (entity_type = 'importer' AND entity_id NOT IN (SELECT id FROM importers))
+    OR (entity_type = 'customer' AND entity_id NOT IN (SELECT id FROM projects))
+'''
+
+# Lightweight records yielded by the iter_* methods (namedtuples have no per-instance dict)
+AssignmentRecord = namedtuple('AssignmentRecord', 'id entity_type entity_id amount date description good paid_total')
+PaymentRecord = namedtuple('PaymentRecord', 'id assignment_id amount date')
+LedgerRecord = namedtuple('LedgerRecord', 'project_id entity_type entity_id entity_name job '
+                                          'assignment_id amount date description good paid_total '
+                                          'payment_id payment_amount payment_date')
+EntityTotalsRecord = namedtuple('EntityTotalsRecord', 'project_id id name job total_assigned total_paid')
+
+# Columns of iter_ledger_export_chunks() rows, with the type each is cast to
+LEDGER_EXPORT_COLUMNS = (
+    ('project_id', 'integer'), ('project_name', 'text'),
+    ('entity_type', 'text'), ('entity_id', 'integer'), ('entity_name', 'text'), ('job', 'text'),
+    ('assignment_id', 'integer'), ('amount', 'real'), ('date', 'text'), ('description', 'text'),
+    ('good', 'text'), ('paid_total', 'real'),
+    ('payment_id', 'integer'), ('payment_amount', 'real'), ('payment_date', 'text'),
+)
 
 
 class Database:
-    def __init__(self, path='data.db'):
+    def __init__(self, path='data.db', readers=4):
+        """
+        path: SQLite file (':memory:' works but has no reader pool)
+        readers: maximum number of pooled read-only connections
+        """
         self.path = path
-        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.readers = readers
+        # The one writer connection; all writes are serialized through transaction()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000)
         self.conn.row_factory = sqlite3.Row
+        self._tx_depth = 0
+        self._write_lock = threading.RLock()
+        # Idle read-only connections, and a cap on how many may be open at once
+        self._idle_readers = queue.LifoQueue()
+        self._reader_slots = threading.BoundedSemaphore(readers)
+        # Reader checked out by the current thread, if any (see reader())
+        self._local = threading.local()
+        # Summary results, dropped key by key by the mutators (see _changed)
+        self._cache = QueryCache()
+        # Change detection (see change_token): a counter bumped by every committed
+        # write of this process, the value it had at each region's last write
+        # (see changes_since), and what the open write unit has touched so far
+        self._generation = 0
+        self._region_generations = {}
+        self._pending_write = False
+        self._pending_keys = set()
+        self._pending_regions = set()
+        self._data_version = None
+        # Background executor, started by the first submit()
+        self._executor = None
+        self._executor_lock = threading.Lock()
         self.init_db()
 
+    @property
+    def is_file_backed(self):
+        return self.path not in ('', ':memory:') and not str(self.path).startswith('file::memory:')
+
     def init_db(self):
-        cur = self.conn.cursor()
-        cur.executescript('''
-        PRAGMA foreign_keys = ON;
-        CREATE TABLE IF NOT EXISTS projects (
-            id INTEGER PRIMARY KEY,
-            name TEXT,
-            total_assigned REAL DEFAULT 0,
-            total_paid REAL DEFAULT 0
-        );
-
-        CREATE TABLE IF NOT EXISTS workers (
-            id INTEGER PRIMARY KEY,
-            project_id INTEGER,
-            name TEXT,
-            FOREIGN KEY(project_id) REFERENCES projects(id) ON DELETE CASCADE
-        );
-
-        CREATE TABLE IF NOT EXISTS importers (
-            id INTEGER PRIMARY KEY,
-            project_id INTEGER,
-            name TEXT,
-            FOREIGN KEY(project_id) REFERENCES projects(id) ON DELETE CASCADE
-        );
-
-        CREATE TABLE IF NOT EXISTS assignments (
-            id INTEGER PRIMARY KEY,
-            entity_type TEXT CHECK(entity_type IN ('worker','importer','customer')),
-            entity_id INTEGER,
-            amount REAL,
-            date TEXT,
-            description TEXT DEFAULT '',
-            good TEXT
-        );
-
-        CREATE TABLE IF NOT EXISTS payments (
-            id INTEGER PRIMARY KEY,
-            assignment_id INTEGER,
-            amount REAL,
-            date TEXT,
-            FOREIGN KEY(assignment_id) REFERENCES assignments(id) ON DELETE CASCADE
-        );
-        ''')
-        self.conn.commit()
-        # Ensure optional columns exist (job for workers only)
-        cur.execute("PRAGMA table_info(workers)")
-        cols = [r[1] for r in cur.fetchall()]
-        if 'job' not in cols:
-            cur.execute('ALTER TABLE workers ADD COLUMN job TEXT')
-        # Add good column to assignments if it doesn't exist
-        cur.execute("PRAGMA table_info(assignments)")
-        cols = [r[1] for r in cur.fetchall()]
-        if 'description' not in cols:
-            cur.execute('ALTER TABLE assignments ADD COLUMN description TEXT DEFAULT ""')
-        if 'good' not in cols:
-            cur.execute('ALTER TABLE assignments ADD COLUMN good TEXT')
-        self.conn.commit()
+        # foreign_keys is per-connection, so it is set on every start
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        if self.is_file_backed:
+            # WAL lets the pooled readers run while the writer commits
+            self.conn.execute('PRAGMA journal_mode = WAL')
+        # Only pending migrations run; a current schema costs a single PRAGMA read
+        apply_migrations(self.conn)
+
+    def close(self):
+        """Stop the background executor, then close the writer and every pooled reader"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        while True:
+            try:
+                self._idle_readers.get_nowait().close()
+            except queue.Empty:
+                break
+        self.conn.close()
+
+    # Connections
+    def _open_reader(self):
+        uri = f'file:{quote(os.path.abspath(self.path))}?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """Check out a pooled read-only connection for the calling thread.
+
+        Every read method called on this thread inside the block uses it and
+        sees one consistent snapshot, so background exports, reports and
+        refreshes neither wait on nor block the writer. Blocks may nest.
+        In-memory databases have no pool and read through the writer.
+        """
+        if getattr(self._local, 'conn', None) is not None:
+            yield self._local.conn
+            return
+        if not self.is_file_backed:
+            self._local.conn = self.conn
+            try:
+                yield self.conn
+            finally:
+                self._local.conn = None
+            return
+        self._reader_slots.acquire()
+        try:
+            try:
+                conn = self._idle_readers.get_nowait()
+            except queue.Empty:
+                conn = self._open_reader()
+            # Cache entries computed from the snapshot may be stored only if no
+            # write committed since it was opened (see _cache_since)
+            self._local.cache_since = self._cache.epoch
+            # Hold one read transaction so every query in the block sees the same snapshot
+            conn.execute('BEGIN')
+            self._local.conn = conn
+            try:
+                yield conn
+            finally:
+                self._local.conn = None
+                self._local.cache_since = None
+                conn.rollback()
+                self._idle_readers.put(conn)
+        finally:
+            self._reader_slots.release()
+
+    def _read_cursor(self):
+        """Cursor for read methods: the thread's pooled reader if it holds one, else the writer"""
+        conn = getattr(self._local, 'conn', None)
+        return (conn or self.conn).cursor()
+
+    @contextmanager
+    def transaction(self):
+        """Unit of work: every write inside the block is committed once, on exit.
+
+        Blocks nest freely (each mutator opens one of its own) and only the
+        outermost block commits. A nested block is a savepoint: an exception
+        leaving it undoes just its writes, so a caller that catches it can
+        carry on with the rest of the unit; one leaving the outermost block
+        rolls the whole unit back. The writer lock is held for the whole
+        block, so writes from different threads never interleave.
+        """
+        with self._write_lock:
+            depth = self._tx_depth
+            savepoint = f'tx_{depth}'
+            if depth:
+                self.conn.execute(f'SAVEPOINT {savepoint}')
+            elif not self.conn.in_transaction:
+                # explicit, or the first nested SAVEPOINT would open (and its RELEASE commit) the unit
+                self.conn.execute('BEGIN')
+            self._tx_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._tx_depth -= 1
+                if depth:
+                    self.conn.execute(f'ROLLBACK TO {savepoint}')
+                    self.conn.execute(f'RELEASE {savepoint}')
+                else:
+                    self.conn.rollback()
+                    # values read inside the aborted unit may be cached
+                    self._cache.clear()
+                    self._pending_write = False
+                    self._pending_keys.clear()
+                    self._pending_regions.clear()
+                raise
+            self._tx_depth -= 1
+            if depth:
+                self.conn.execute(f'RELEASE {savepoint}')
+            else:
+                self.conn.commit()
+                self._publish_changes()
+
+    # Cache
+    def _can_cache(self):
+        """Results read inside a write unit are not shared: it may still be rolled back"""
+        return self._tx_depth == 0
+
+    def _cache_since(self):
+        """Cache epoch of the calling thread's reader snapshot (None: reads are current)"""
+        return getattr(self._local, 'cache_since', None)
+
+    def _changed(self, keys=(), project_ids=()):
+        """Record a write of the open unit: drop the cache keys it affects and mark its regions"""
+        project_ids = [pid for pid in project_ids if pid is not None]
+        if project_ids:
+            # the project rows carry the trigger-maintained totals and generation
+            keys = {*keys, ('projects',)}
+        self._cache.invalidate(*keys)
+        self._pending_write = True
+        self._pending_keys.update(keys)
+        self._pending_regions.update(('project', pid) for pid in project_ids)
+        # the worker / importer sections are exactly what the *_totals summaries list
+        for section in ('worker', 'importer'):
+            if (f'{section}_totals',) in keys:
+                self._pending_regions.add(f'{section}s')
+
+    def _publish_changes(self):
+        """Bump the generations of a committed unit's writes"""
+        if not self._pending_write:
+            return
+        # again after commit: a snapshot opened before it may have re-filled these keys
+        self._cache.invalidate(*self._pending_keys)
+        self._pending_keys.clear()
+        self._generation += 1
+        for region in self._pending_regions:
+            self._region_generations[region] = self._generation
+        self._pending_write = False
+        self._pending_regions.clear()
+
+    def _project_of(self, cur, entity_type, entity_id):
+        """Project id owning a worker/importer/customer ledger (None if unknown)"""
+        if entity_type == 'customer':
+            return entity_id
+        table = 'workers' if entity_type == 'worker' else 'importers'
+        cur.execute(f'SELECT project_id FROM {table} WHERE id=?', (entity_id,))
+        r = cur.fetchone()
+        return r['project_id'] if r else None
+
+    def _touch_entities(self, cur, entities):
+        """Record a write to the ledgers of the given (entity_type, entity_id) pairs"""
+        entities = set(entities)
+        keys = set()
+        project_ids = set()
+        for entity_type, entity_id in entities:
+            keys.add(('entity_balance', entity_type, entity_id))
+            project_id = self._project_of(cur, entity_type, entity_id)
+            project_ids.add(project_id)
+            if entity_type != 'customer':
+                keys.add((f'{entity_type}_totals',))
+                keys.add(('project_summary', project_id))
+        self._changed(keys, project_ids)
+
+    def change_token(self, project_id=None):
+        """Opaque value that changes whenever the data shown for project_id (or, without
+        one, any data) may have changed; equal tokens mean a refresh would be a no-op.
+
+        Writes of this process are tracked per project; writes committed by other
+        connections are detected through PRAGMA data_version (and also drop the
+        summary cache, whose invalidation only sees this process's mutators).
+        """
+        with self._write_lock:
+            version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+            if version != self._data_version:
+                if self._data_version is not None:
+                    self._cache.clear()
+                self._data_version = version
+            if project_id is None:
+                return version, self._generation
+            return version, self._region_generations.get(('project', project_id), 0)
+
+    def changes_since(self, token):
+        """Regions written since change_token() returned token.
+
+        Regions are ('project', project_id) for a project's own data and totals,
+        'workers' / 'importers' for the cross-project worker and importer
+        summaries. Returns None when that cannot be told (no token, or another
+        connection has written since).
+        """
+        if token is None:
+            return None
+        version, generation = token
+        if self.change_token()[0] != version:
+            return None
+        with self._write_lock:
+            return {region for region, g in self._region_generations.items() if g > generation}
+
+    def cache_stats(self):
+        """Hit / miss / invalidation counters of the summary cache"""
+        return self._cache.stats()
+
+    def backup_to(self, path, pages=BACKUP_PAGES, progress=None):
+        """Copy the database to the file path with the SQLite backup API, pages at a time.
+
+        The copy is read through a connection of its own holding one read
+        transaction: it is the snapshot of when the backup started, and (in
+        WAL mode) commits meanwhile neither wait for it nor restart it.
+        progress(done_pages, total_pages) is called after every step; an
+        exception it raises aborts the backup.
+        """
+        if not self.is_file_backed:
+            raise ValueError('لا يمكن نسخ قاعدة بيانات في الذاكرة')
+        src = self._open_reader()
+        dst = sqlite3.connect(path)
+        try:
+            # BEGIN is deferred: the snapshot is taken by the first read
+            src.execute('BEGIN')
+            src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            src.backup(dst, pages=pages, sleep=0,
+                       progress=progress and (lambda status, remaining, total: progress(total - remaining, total)))
+            # a backup is one self-contained file, not a WAL database with side files
+            dst.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            dst.close()
+            src.close()
+
+    # Background execution
+    def submit(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the Database's worker threads and return its Future.
+
+        fn runs inside reader(), so the read methods it calls work on a pooled
+        snapshot and neither wait on nor block the writer (writes still go
+        through transaction()). UI code collects the result with ui.tasks.when_done.
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix='db')
+        return self._executor.submit(self._run_in_reader, fn, args, kwargs)
+
+    def _run_in_reader(self, fn, args, kwargs):
+        with self.reader():
+            return fn(*args, **kwargs)
 
     # Projects
     def add_project(self, name):
-        cur = self.conn.cursor()
-        cur.execute('INSERT INTO projects(name) VALUES(?)', (name,))
-        self.conn.commit()
+        with self.transaction():
+            cur = self.conn.cursor()
+            cur.execute('INSERT INTO projects(name) VALUES(?)', (name,))
+            self._changed([('projects',)], [cur.lastrowid])
         return cur.lastrowid
 
     def edit_project(self, project_id, new_name):
-        cur = self.conn.cursor()
-        cur.execute('UPDATE projects SET name=? WHERE id=?', (new_name, project_id))
-        self.conn.commit()
+        with self.transaction():
+            cur = self.conn.cursor()
+            cur.execute('UPDATE projects SET name=? WHERE id=?', (new_name, project_id))
+            # project names are part of the worker/importer totals
+            self._changed([('projects',), ('worker_totals',), ('importer_totals',)], [project_id])
 
     def delete_project(self, project_id):
-        cur = self.conn.cursor()
-        cur.execute('DELETE FROM projects WHERE id=?', (project_id,))
-        self.conn.commit()
+        with self.transaction():
+            cur = self.conn.cursor()
+            # workers and importers go with the project (ON DELETE CASCADE), and every
+            # ledger with its owner (delete triggers, see migration 8)
+            cur.execute('''SELECT 'worker', id FROM workers WHERE project_id=:pid
+                           UNION ALL SELECT 'importer', id FROM importers WHERE project_id=:pid''',
+                        {'pid': project_id})
+            self._touch_entities(cur, [tuple(r) for r in cur.fetchall()])
+            cur.execute('DELETE FROM projects WHERE id=?', (project_id,))
+            self._changed([('projects',), ('project_summary', project_id),
+                           ('entity_balance', 'customer', project_id),
+                           ('worker_totals',), ('importer_totals',)], [project_id])
 
+    @cached(lambda: ('projects',))
     def get_all_projects(self):
-        cur = self.conn.cursor()
+        cur = self._read_cursor()
         cur.execute('SELECT * FROM projects ORDER BY id DESC')
         return [dict(row) for row in cur.fetchall()]
 
     # Workers / Importers
     def add_worker(self, project_id, name):
-        cur = self.conn.cursor()
-        cur.execute('INSERT INTO workers(project_id, name) VALUES(?,?)', (project_id, name))
-        self.conn.commit()
+        with self.transaction():
+            cur = self.conn.cursor()
+            cur.execute('INSERT INTO workers(project_id, name) VALUES(?,?)', (project_id, name))
+            self._changed([('worker_totals',), ('project_summary', project_id)], [project_id])
         return cur.lastrowid
 
     def add_worker_with_job(self, project_id, name, job=None):
-        cur = self.conn.cursor()
-        cur.execute('INSERT INTO workers(project_id, name, job) VALUES(?,?,?)', (project_id, name, job))
-        self.conn.commit()
+        with self.transaction():
+            cur = self.conn.cursor()
+            cur.execute('INSERT INTO workers(project_id, name, job) VALUES(?,?,?)', (project_id, name, job))
+            self._changed([('worker_totals',), ('project_summary', project_id)], [project_id])
         return cur.lastrowid
 
     def edit_worker(self, worker_id, new_name):
-        cur = self.conn.cursor()
-        cur.execute('UPDATE workers SET name=? WHERE id=?', (new_name, worker_id))
-        self.conn.commit()
+        with self.transaction():
+            cur = self.conn.cursor()
+            cur.execute('UPDATE workers SET name=? WHERE id=?', (new_name, worker_id))
+            self._changed([('worker_totals',)], [self._project_of(cur, 'worker', worker_id)])
 
     def delete_worker(self, worker_id):
-        cur = self.conn.cursor()
-        cur.execute('DELETE FROM workers WHERE id=?', (worker_id,))
-        self.conn.commit()
+        with self.transaction():
+            cur = self.conn.cursor()
+            self._touch_entities(cur, [('worker', worker_id)])
+            cur.execute('DELETE FROM workers WHERE id=?', (worker_id,))
 
     def get_workers_by_project(self, project_id):
-        cur = self.conn.cursor()
+        cur = self._read_cursor()
         cur.execute('SELECT * FROM workers WHERE project_id=?', (project_id,))
         return [dict(r) for r in cur.fetchall()]
 
     def add_importer(self, project_id, name):
         """Add importer with only name (job is now tracked in assignments)"""
-        cur = self.conn.cursor()
-        cur.execute('INSERT INTO importers(project_id, name) VALUES(?,?)', (project_id, name))
-        self.conn.commit()
+        with self.transaction():
+            cur = self.conn.cursor()
+            cur.execute('INSERT INTO importers(project_id, name) VALUES(?,?)', (project_id, name))
+            self._changed([('importer_totals',), ('project_summary', project_id)], [project_id])
         return cur.lastrowid
 
     def add_importer_with_job(self, project_id, name, job=None):
@@ -129,331 +422,561 @@ class Database:
         return self.add_importer(project_id, name)
 
     def edit_importer(self, importer_id, new_name):
-        cur = self.conn.cursor()
-        cur.execute('UPDATE importers SET name=? WHERE id=?', (new_name, importer_id))
-        self.conn.commit()
+        with self.transaction():
+            cur = self.conn.cursor()
+            cur.execute('UPDATE importers SET name=? WHERE id=?', (new_name, importer_id))
+            self._changed([('importer_totals',)], [self._project_of(cur, 'importer', importer_id)])
 
     def delete_importer(self, importer_id):
-        cur = self.conn.cursor()
-        cur.execute('DELETE FROM importers WHERE id=?', (importer_id,))
-        self.conn.commit()
+        with self.transaction():
+            cur = self.conn.cursor()
+            self._touch_entities(cur, [('importer', importer_id)])
+            cur.execute('DELETE FROM importers WHERE id=?', (importer_id,))
 
     def get_importers_by_project(self, project_id):
-        cur = self.conn.cursor()
+        cur = self._read_cursor()
         cur.execute('SELECT * FROM importers WHERE project_id=?', (project_id,))
         return [dict(r) for r in cur.fetchall()]
 
     # Assignments
     def add_assignment(self, entity_type, entity_id, amount, date, description='', good=None):
-        cur = self.conn.cursor()
-        cur.execute('INSERT INTO assignments(entity_type, entity_id, amount, date, description, good) VALUES(?,?,?,?,?,?)',
-                    (entity_type, entity_id, amount, date, description, good))
-        self.conn.commit()
-        aid = cur.lastrowid
-        # recalc affected project(s)
-        self._recalc_projects_for_assignment(entity_type, entity_id)
-        return aid
+        with self.transaction():
+            cur = self.conn.cursor()
+            cur.execute('INSERT INTO assignments(entity_type, entity_id, amount, date, description, good) VALUES(?,?,?,?,?,?)',
+                        (entity_type, entity_id, amount, date, description, good))
+            self._touch_entities(cur, [(entity_type, entity_id)])
+        return cur.lastrowid
+
+    def add_assignments_many(self, rows):
+        """Bulk insert assignments in a single transaction.
+
+        rows: iterable of (entity_type, entity_id, amount, date[, description[, good]])
+        Returns the number of inserted rows.
+        """
+        rows = [self._assignment_params(*r) for r in rows]
+        with self.transaction():
+            cur = self.conn.cursor()
+            cur.executemany('INSERT INTO assignments(entity_type, entity_id, amount, date, description, good) VALUES(?,?,?,?,?,?)',
+                            rows)
+            self._touch_entities(cur, [(r[0], r[1]) for r in rows])
+        return len(rows)
+
+    @staticmethod
+    def _assignment_params(entity_type, entity_id, amount, date, description='', good=None):
+        return (entity_type, entity_id, amount, date, description, good)
 
     def delete_assignment(self, assignment_id):
-        cur = self.conn.cursor()
-        # find related entity to recalc after deletion
-        cur.execute('SELECT entity_type, entity_id FROM assignments WHERE id=?', (assignment_id,))
-        row = cur.fetchone()
-        cur.execute('DELETE FROM assignments WHERE id=?', (assignment_id,))
-        self.conn.commit()
-        if row:
-            self._recalc_projects_for_assignment(row['entity_type'], row['entity_id'])
-
-    def get_assignments(self, entity_type, entity_id):
-        cur = self.conn.cursor()
-        cur.execute('SELECT * FROM assignments WHERE entity_type=? AND entity_id=? ORDER BY id DESC',
-                    (entity_type, entity_id))
+        with self.transaction():
+            cur = self.conn.cursor()
+            cur.execute('SELECT entity_type, entity_id FROM assignments WHERE id=?', (assignment_id,))
+            self._touch_entities(cur, [tuple(r) for r in cur.fetchall()])
+            cur.execute('DELETE FROM assignments WHERE id=?', (assignment_id,))
+
+    def delete_assignments_for(self, entity_type, entity_id):
+        """Delete every assignment (and, by cascade, payment) of one worker/importer/customer"""
+        with self.transaction():
+            cur = self.conn.cursor()
+            cur.execute('DELETE FROM assignments WHERE entity_type=? AND entity_id=?', (entity_type, entity_id))
+            self._touch_entities(cur, [(entity_type, entity_id)])
+
+    def get_assignments(self, entity_type, entity_id, date_from=None, date_to=None):
+        """date_from / date_to: optional inclusive DD-MM-YYYY bounds on the assignment date"""
+        cur = self._read_cursor()
+        date_sql, date_params = self._date_range('date_iso', date_from, date_to)
+        cur.execute(f'SELECT * FROM assignments WHERE entity_type=? AND entity_id=?{date_sql} ORDER BY id DESC',
+                    (entity_type, entity_id, *date_params))
+        return [dict(r) for r in cur.fetchall()]
+
+    def get_assignments_page(self, entity_type, entity_id, after_id=None, limit=100, good=None):
+        """One page of get_assignments (newest first), each row with has_payments.
+
+        Pass the id of the last row of the previous page as after_id to get the
+        next one; a page shorter than limit is the last. good: only the
+        assignments of that good ('' for those without one).
+        """
+        params = [entity_type, entity_id]
+        where = ''
+        if after_id is not None:
+            where += ' AND a.id<?'
+            params.append(after_id)
+        if good is not None:
+            where += " AND IFNULL(a.good, '')=?"
+            params.append(good)
+        cur = self._read_cursor()
+        cur.execute(f'''
+            SELECT a.*, EXISTS(SELECT 1 FROM payments p WHERE p.assignment_id = a.id) AS has_payments
+            FROM assignments a WHERE a.entity_type=? AND a.entity_id=?{where}
+            ORDER BY a.id DESC LIMIT ?
+        ''', (*params, limit))
+        return [dict(r) for r in cur.fetchall()]
+
+    def get_entity_history_page(self, entity_type, entity_ids, after=None, limit=100):
+        """One page of the assignments of several worker/importer records (one person
+        across projects), each with its owning project, in a single joined query.
+
+        Rows are assignment rows plus project_id and project_name (paid_total is the
+        stored per-assignment payments sum), ordered by project name, then newest
+        first. Records without a project are left out. Pass the last row of the
+        previous page as after to get the next one; a short page is the last.
+        """
+        if not entity_ids:
+            return []
+        table = 'workers' if entity_type == 'worker' else 'importers'
+        project_name = "COALESCE(pr.name, 'Unknown (ID: ' || e.project_id || ')')"
+        params = [entity_type, *entity_ids]
+        after_sql = ''
+        if after is not None:
+            after_sql = f' AND ({project_name}, e.project_id, -a.id) > (?, ?, ?)'
+            params += [after['project_name'], after['project_id'], -after['id']]
+        cur = self._read_cursor()
+        cur.execute(f'''
+            SELECT a.*, e.project_id, {project_name} AS project_name
+            FROM {table} e
+            LEFT JOIN projects pr ON pr.id = e.project_id
+            JOIN assignments a ON a.entity_type = ? AND a.entity_id = e.id
+            WHERE e.id IN ({','.join(['?']*len(entity_ids))}) AND e.project_id IS NOT NULL{after_sql}
+            ORDER BY project_name, e.project_id, a.id DESC
+            LIMIT ?
+        ''', (*params, limit))
         return [dict(r) for r in cur.fetchall()]
 
     # Payments
     def add_payment(self, assignment_id, amount, date):
-        cur = self.conn.cursor()
-        # enforce that payments for this assignment do not exceed assignment.amount
-        cur.execute('SELECT amount FROM assignments WHERE id=?', (assignment_id,))
-        ar = cur.fetchone()
-        if not ar:
-            raise ValueError('السجل المرجعي غير موجود')
-        assign_amount = ar['amount']
-        cur.execute('SELECT SUM(amount) as s FROM payments WHERE assignment_id=?', (assignment_id,))
-        paid_sum = cur.fetchone()['s'] or 0
-        if (paid_sum + float(amount)) > float(assign_amount) + 1e-9:
-            raise ValueError('المبلغ المدفوع يتجاوز المبلغ المكلّف')
-        cur.execute('INSERT INTO payments(assignment_id, amount, date) VALUES(?,?,?)', (assignment_id, amount, date))
-        self.conn.commit()
-        # recalc project via lookup
-        cur.execute('SELECT entity_type, entity_id FROM assignments WHERE id=?', (assignment_id,))
-        row = cur.fetchone()
-        if row:
-            self._recalc_projects_for_assignment(row['entity_type'], row['entity_id'])
+        with self.transaction():
+            cur = self.conn.cursor()
+            # enforce that payments for this assignment do not exceed assignment.amount
+            cur.execute('SELECT entity_type, entity_id, amount, paid_total FROM assignments WHERE id=?', (assignment_id,))
+            ar = cur.fetchone()
+            if not ar:
+                raise ValueError('السجل المرجعي غير موجود')
+            if (ar['paid_total'] + float(amount)) > float(ar['amount']) + 1e-9:
+                raise ValueError('المبلغ المدفوع يتجاوز المبلغ المكلّف')
+            cur.execute('INSERT INTO payments(assignment_id, amount, date) VALUES(?,?,?)', (assignment_id, amount, date))
+            self._touch_entities(cur, [(ar['entity_type'], ar['entity_id'])])
         return cur.lastrowid
 
+    def add_payments_many(self, rows):
+        """Bulk insert payments in a single transaction.
+
+        rows: iterable of (assignment_id, amount, date)
+        The over-payment rule is checked per assignment against the whole batch
+        before anything is written; a violation rejects the entire batch.
+        Returns the number of inserted rows.
+        """
+        rows = [(aid, float(amount), date) for aid, amount, date in rows]
+        incoming = {}
+        for aid, amount, _date in rows:
+            incoming[aid] = incoming.get(aid, 0) + amount
+        with self.transaction():
+            cur = self.conn.cursor()
+            ids = list(incoming)
+            found = {}
+            # stay well below SQLite's bound-parameter limit
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                q = f"SELECT id, entity_type, entity_id, amount, paid_total FROM assignments WHERE id IN ({','.join(['?']*len(chunk))})"
+                cur.execute(q, chunk)
+                found.update((r['id'], r) for r in cur.fetchall())
+            for aid, amount in incoming.items():
+                ar = found.get(aid)
+                if not ar:
+                    raise ValueError('السجل المرجعي غير موجود')
+                if (ar['paid_total'] + amount) > float(ar['amount']) + 1e-9:
+                    raise ValueError('المبلغ المدفوع يتجاوز المبلغ المكلّف')
+            cur.executemany('INSERT INTO payments(assignment_id, amount, date) VALUES(?,?,?)', rows)
+            self._touch_entities(cur, [(r['entity_type'], r['entity_id']) for r in found.values()])
+        return len(rows)
+
     def delete_payment(self, payment_id):
-        cur = self.conn.cursor()
-        # find assignment id
-        cur.execute('SELECT assignment_id FROM payments WHERE id=?', (payment_id,))
-        r = cur.fetchone()
-        cur.execute('DELETE FROM payments WHERE id=?', (payment_id,))
-        self.conn.commit()
-        if r:
-            cur.execute('SELECT entity_type, entity_id FROM assignments WHERE id=?', (r['assignment_id'],))
-            row = cur.fetchone()
-            if row:
-                self._recalc_projects_for_assignment(row['entity_type'], row['entity_id'])
-
-    def get_payments(self, assignment_id):
-        cur = self.conn.cursor()
-        cur.execute('SELECT * FROM payments WHERE assignment_id=? ORDER BY id DESC', (assignment_id,))
+        with self.transaction():
+            cur = self.conn.cursor()
+            cur.execute('''SELECT a.entity_type, a.entity_id FROM payments p
+                           JOIN assignments a ON a.id = p.assignment_id WHERE p.id=?''', (payment_id,))
+            self._touch_entities(cur, [tuple(r) for r in cur.fetchall()])
+            cur.execute('DELETE FROM payments WHERE id=?', (payment_id,))
+
+    def get_payments(self, assignment_id, date_from=None, date_to=None):
+        """date_from / date_to: optional inclusive DD-MM-YYYY bounds on the payment date"""
+        cur = self._read_cursor()
+        date_sql, date_params = self._date_range('date_iso', date_from, date_to)
+        cur.execute(f'SELECT * FROM payments WHERE assignment_id=?{date_sql} ORDER BY id DESC',
+                    (assignment_id, *date_params))
         return [dict(r) for r in cur.fetchall()]
 
-    def get_customer_summary(self, project_id):
-        cur = self.conn.cursor()
-        cur.execute('SELECT SUM(amount) as s FROM assignments WHERE entity_type="customer" AND entity_id=?', (project_id,))
-        total = cur.fetchone()['s'] or 0
-        # get payments for those assignments
-        cur.execute('SELECT id FROM assignments WHERE entity_type="customer" AND entity_id=?', (project_id,))
-        aids = [r['id'] for r in cur.fetchall()]
-        paid = 0
-        if aids:
-            q = f"SELECT SUM(amount) as s FROM payments WHERE assignment_id IN ({','.join(['?']*len(aids))})"
-            cur.execute(q, aids)
-            paid = cur.fetchone()['s'] or 0
-        return float(total), float(paid)
+    def get_payments_page(self, assignment_id, after_id=None, limit=100):
+        """One page of get_payments (newest first), see get_assignments_page"""
+        cur = self._read_cursor()
+        if after_id is None:
+            cur.execute('SELECT * FROM payments WHERE assignment_id=? ORDER BY id DESC LIMIT ?', (assignment_id, limit))
+        else:
+            cur.execute('SELECT * FROM payments WHERE assignment_id=? AND id<? ORDER BY id DESC LIMIT ?',
+                        (assignment_id, after_id, limit))
+        return [dict(r) for r in cur.fetchall()]
 
-    # Helpers
-    def _recalc_projects_for_assignment(self, entity_type, entity_id):
-        # find associated project id(s)
-        project_ids = set()
-        cur = self.conn.cursor()
-        if entity_type == 'customer':
-            project_ids.add(int(entity_id))
-        elif entity_type == 'worker':
-            cur.execute('SELECT project_id FROM workers WHERE id=?', (entity_id,))
+    # Streaming reads: constant memory, for exports and reports (run them inside reader())
+    def _iter_records(self, record_type, sql, params, batch_size):
+        cur = self._read_cursor()
+        cur.row_factory = lambda _cur, row: record_type._make(row)
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+
+    def iter_assignments(self, entity_type, entity_id, batch_size=STREAM_BATCH):
+        """Stream AssignmentRecord tuples for one entity, newest first"""
+        return self._iter_records(
+            AssignmentRecord,
+            f"SELECT {', '.join(AssignmentRecord._fields)} FROM assignments WHERE entity_type=? AND entity_id=? ORDER BY id DESC",
+            (entity_type, entity_id), batch_size)
+
+    def iter_payments(self, assignment_id, batch_size=STREAM_BATCH):
+        """Stream PaymentRecord tuples for one assignment, newest first"""
+        return self._iter_records(
+            PaymentRecord,
+            f"SELECT {', '.join(PaymentRecord._fields)} FROM payments WHERE assignment_id=? ORDER BY id DESC",
+            (assignment_id,), batch_size)
+
+    def iter_ledger(self, project_id, batch_size=STREAM_BATCH):
+        """Stream every assignment of a project (customer, workers, importers) joined with its payments.
+
+        Yields one LedgerRecord per payment, or one with payment_* set to None for
+        an unpaid assignment, ordered by entity, assignment and payment.
+        """
+        return self._iter_records(LedgerRecord, '''
+            SELECT e.project_id, e.entity_type, e.entity_id, e.name, e.job,
+                   a.id, a.amount, a.date, a.description, a.good, a.paid_total,
+                   p.id, p.amount, p.date
+            FROM (
+                SELECT 'customer' AS entity_type, id AS entity_id, id AS project_id, name, NULL AS job
+                FROM projects WHERE id=:pid
+                UNION ALL
+                SELECT 'worker', id, project_id, name, job FROM workers WHERE project_id=:pid
+                UNION ALL
+                SELECT 'importer', id, project_id, name, NULL FROM importers WHERE project_id=:pid
+            ) e
+            JOIN assignments a ON a.entity_type = e.entity_type AND a.entity_id = e.entity_id
+            LEFT JOIN payments p ON p.assignment_id = a.id
+            ORDER BY e.entity_type, e.entity_id, a.id, p.id
+        ''', {'pid': project_id}, batch_size)
+
+    def iter_ledger_export_chunks(self, batch_size=STREAM_BATCH):
+        """Stream the whole ledger of every project as lists of plain tuples (see LEDGER_EXPORT_COLUMNS).
+
+        Like iter_ledger, one row per payment, but entities without assignments
+        and assignments without payments get a row too (their missing columns
+        None). Dates are ISO-8601. Ordered by project, newest first.
+        """
+        cur = self._read_cursor()
+        cur.row_factory = None
+        cur.execute('''
+            SELECT pr.id, CAST(pr.name AS TEXT),
+                   e.entity_type, e.entity_id, CAST(e.name AS TEXT), CAST(e.job AS TEXT),
+                   a.id, CAST(a.amount AS REAL), COALESCE(a.date_iso, a.date),
+                   CAST(a.description AS TEXT), CAST(a.good AS TEXT), CAST(a.paid_total AS REAL),
+                   p.id, CAST(p.amount AS REAL), COALESCE(p.date_iso, p.date)
+            FROM projects pr
+            JOIN (
+                SELECT 'customer' AS entity_type, id AS entity_id, id AS project_id, NULL AS name, NULL AS job
+                FROM projects
+                UNION ALL
+                SELECT 'worker', id, project_id, name, job FROM workers
+                UNION ALL
+                SELECT 'importer', id, project_id, name, NULL FROM importers
+            ) e ON e.project_id = pr.id
+            LEFT JOIN assignments a ON a.entity_type = e.entity_type AND a.entity_id = e.entity_id
+            LEFT JOIN payments p ON p.assignment_id = a.id
+            ORDER BY pr.id DESC, e.entity_type, e.entity_id, a.id, p.id
+        ''')
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+
+    def iter_entity_totals(self, entity_type, batch_size=STREAM_BATCH, project_ids=None):
+        """Stream EntityTotalsRecords of every worker/importer that belongs to a project
+        (or to one of project_ids), grouped by project in get_projects_summary() order"""
+        table = 'workers' if entity_type == 'worker' else 'importers'
+        job = 'e.job' if entity_type == 'worker' else 'NULL'
+        params = [entity_type]
+        where = 'e.project_id IS NOT NULL'
+        if project_ids is not None:
+            where = f"e.project_id IN ({','.join(['?']*len(project_ids))})"
+            params.extend(project_ids)
+        return self._iter_records(EntityTotalsRecord, f'''
+            SELECT e.project_id, e.id, e.name, {job},
+                   COALESCE(b.total_assigned, 0), COALESCE(b.total_paid, 0)
+            FROM {table} e
+            LEFT JOIN entity_balances b ON b.entity_type = ? AND b.entity_id = e.id
+            WHERE {where}
+            ORDER BY e.project_id DESC, e.id
+        ''', params, batch_size)
+
+    def get_projects_summary(self, project_ids=None):
+        """Every project (newest first), or those of project_ids, with its generation,
+        workers+importers totals (total_assigned, total_paid) and customer totals
+        (customer_assigned, customer_paid), in one query"""
+        where = ''
+        params = []
+        if project_ids is not None:
+            where = f"WHERE pr.id IN ({','.join(['?']*len(project_ids))})"
+            params = list(project_ids)
+        cur = self._read_cursor()
+        cur.execute(f'''
+            SELECT pr.id, pr.name, pr.generation,
+                   TOTAL(CASE WHEN e.entity_type != 'customer' THEN b.total_assigned END) AS total_assigned,
+                   TOTAL(CASE WHEN e.entity_type != 'customer' THEN b.total_paid END) AS total_paid,
+                   TOTAL(CASE WHEN e.entity_type = 'customer' THEN b.total_assigned END) AS customer_assigned,
+                   TOTAL(CASE WHEN e.entity_type = 'customer' THEN b.total_paid END) AS customer_paid
+            FROM projects pr
+            JOIN (
+                SELECT 'worker' AS entity_type, id AS entity_id, project_id FROM workers
+                UNION ALL
+                SELECT 'importer', id, project_id FROM importers
+                UNION ALL
+                SELECT 'customer', id, id FROM projects
+            ) e ON e.project_id = pr.id
+            LEFT JOIN entity_balances b ON b.entity_type = e.entity_type AND b.entity_id = e.entity_id
+            {where}
+            GROUP BY pr.id
+            ORDER BY pr.id DESC
+        ''', params)
+        return [dict(r) for r in cur.fetchall()]
+
+    def get_customer_summary(self, project_id, date_from=None, date_to=None):
+        return self.get_entity_balance('customer', project_id, date_from, date_to)
+
+    # Balances (maintained by triggers, see db/migrations.py)
+    @cached(lambda entity_type, entity_id, date_from=None, date_to=None:
+            None if date_from or date_to else ('entity_balance', entity_type, entity_id))
+    def get_entity_balance(self, entity_type, entity_id, date_from=None, date_to=None):
+        """Return (total_assigned, total_paid) for one worker/importer/customer.
+
+        With a date range, assignments are filtered by their date and payments
+        by the payment date; without one the stored rollup is read.
+        """
+        if date_from or date_to:
+            return self._period_totals('SELECT ?, ?', (entity_type, entity_id), date_from, date_to)
+        cur = self._read_cursor()
+        cur.execute('SELECT total_assigned, total_paid FROM entity_balances WHERE entity_type=? AND entity_id=?',
+                    (entity_type, entity_id))
+        r = cur.fetchone()
+        if not r:
+            return 0.0, 0.0
+        return float(r['total_assigned']), float(r['total_paid'])
+
+    def get_entities_balance(self, entity_type, entity_ids, date_from=None, date_to=None):
+        """Return combined (total_assigned, total_paid) for several IDs of the same person"""
+        if not entity_ids:
+            return 0.0, 0.0
+        if date_from or date_to:
+            ids_sql = ' UNION ALL '.join(['SELECT ?, ?'] * len(entity_ids))
+            params = [p for eid in entity_ids for p in (entity_type, eid)]
+            return self._period_totals(ids_sql, params, date_from, date_to)
+        cur = self._read_cursor()
+        q = f"SELECT SUM(total_assigned) as a, SUM(total_paid) as p FROM entity_balances WHERE entity_type=? AND entity_id IN ({','.join(['?']*len(entity_ids))})"
+        cur.execute(q, [entity_type, *entity_ids])
+        r = cur.fetchone()
+        return float(r['a'] or 0), float(r['p'] or 0)
+
+    @cached(lambda project_id, date_from=None, date_to=None:
+            None if date_from or date_to else ('project_summary', project_id))
+    def get_workers_importers_summary(self, project_id, date_from=None, date_to=None):
+        """Get total assigned and paid for workers+importers only (excluding customer)"""
+        if date_from or date_to:
+            return self._period_totals(
+                "SELECT 'worker', id FROM workers WHERE project_id=? UNION ALL SELECT 'importer', id FROM importers WHERE project_id=?",
+                (project_id, project_id), date_from, date_to)
+        cur = self._read_cursor()
+        cur.execute('''
+            SELECT SUM(b.total_assigned) as a, SUM(b.total_paid) as p FROM (
+                SELECT 'worker' AS entity_type, id FROM workers WHERE project_id=:pid
+                UNION ALL
+                SELECT 'importer', id FROM importers WHERE project_id=:pid
+            ) e
+            JOIN entity_balances b ON b.entity_type = e.entity_type AND b.entity_id = e.id
+        ''', {'pid': project_id})
+        r = cur.fetchone()
+        return float(r['a'] or 0), float(r['p'] or 0)
+
+    def _period_totals(self, entities_sql, params, date_from, date_to):
+        """(assigned, paid) within a date range for the (entity_type, entity_id) pairs selected by entities_sql"""
+        a_sql, a_params = self._date_range('a.date_iso', date_from, date_to)
+        p_sql, p_params = self._date_range('p.date_iso', date_from, date_to)
+        cur = self._read_cursor()
+        cur.execute(f'''
+            WITH e(entity_type, entity_id) AS ({entities_sql})
+            SELECT
+                (SELECT SUM(a.amount) FROM e
+                 JOIN assignments a ON a.entity_type = e.entity_type AND a.entity_id = e.entity_id
+                 WHERE 1{a_sql}) AS a,
+                (SELECT SUM(p.amount) FROM e
+                 JOIN assignments a ON a.entity_type = e.entity_type AND a.entity_id = e.entity_id
+                 JOIN payments p ON p.assignment_id = a.id
+                 WHERE 1{p_sql}) AS p
+        ''', (*params, *a_params, *p_params))
+        r = cur.fetchone()
+        return float(r['a'] or 0), float(r['p'] or 0)
+
+    @staticmethod
+    def _date_range(column, date_from, date_to):
+        """SQL fragment (starting with ' AND') and params bounding an ISO date column"""
+        sql = ''
+        params = []
+        if date_from:
+            sql += f' AND {column} >= ?'
+            params.append(to_iso_date(date_from))
+        if date_to:
+            sql += f' AND {column} <= ?'
+            params.append(to_iso_date(date_to))
+        return sql, params
+
+    # Project snapshot
+    def load_project_snapshot(self, project_id):
+        """The entities and balances a project window shows, read in a fixed number of queries.
+
+        Returns a dict:
+            project: the project row (None if it no longer exists)
+            workers / importers: rows with total_assigned and total_paid
+            goods: {importer_id: [{'good', 'total_assigned', 'total_paid'}, ...]} by good
+                   ('' for assignments without one)
+            customer: {'total_assigned', 'total_paid'}
+            token: change_token(project_id) the snapshot was taken at
+        The assignments themselves are paged in with get_assignments_page.
+        """
+        token = self.change_token(project_id)
+        with self.reader():
+            cur = self._read_cursor()
+            cur.execute('SELECT * FROM projects WHERE id=?', (project_id,))
             r = cur.fetchone()
-            if r:
-                project_ids.add(r['project_id'])
-        elif entity_type == 'importer':
-            cur.execute('SELECT project_id FROM importers WHERE id=?', (entity_id,))
+            project = dict(r) if r else None
+            entities = {}
+            for entity_type, table in (('worker', 'workers'), ('importer', 'importers')):
+                cur.execute(f'''
+                    SELECT e.*, COALESCE(b.total_assigned, 0) AS total_assigned, COALESCE(b.total_paid, 0) AS total_paid
+                    FROM {table} e
+                    LEFT JOIN entity_balances b ON b.entity_type = ? AND b.entity_id = e.id
+                    WHERE e.project_id=?
+                ''', (entity_type, project_id))
+                entities[entity_type] = [dict(r) for r in cur.fetchall()]
+            cur.execute('''
+                SELECT a.entity_id AS importer_id, IFNULL(a.good, '') AS good,
+                       TOTAL(a.amount) AS total_assigned, TOTAL(a.paid_total) AS total_paid
+                FROM importers i
+                JOIN assignments a ON a.entity_type = 'importer' AND a.entity_id = i.id
+                WHERE i.project_id=?
+                GROUP BY 1, 2
+                ORDER BY 1, 2
+            ''', (project_id,))
+            goods = {}
+            for r in cur.fetchall():
+                goods.setdefault(r['importer_id'], []).append(
+                    {'good': r['good'], 'total_assigned': r['total_assigned'], 'total_paid': r['total_paid']})
+            cur.execute("SELECT total_assigned, total_paid FROM entity_balances WHERE entity_type = 'customer' AND entity_id=?",
+                        (project_id,))
             r = cur.fetchone()
-            if r:
-                project_ids.add(r['project_id'])
-
-        for pid in project_ids:
-            self._recalc_project(pid)
-
-    def _recalc_project(self, project_id):
-        cur = self.conn.cursor()
-        # total assigned: sum assignments for customer with entity_id=project_id
-        cur.execute('SELECT SUM(amount) as s FROM assignments WHERE entity_type="customer" AND entity_id=?', (project_id,))
-        s1 = cur.fetchone()['s'] or 0
-
-        # plus assignments for workers/importers that belong to this project
-        cur.execute('SELECT id FROM workers WHERE project_id=?', (project_id,))
-        worker_ids = [r['id'] for r in cur.fetchall()]
-        cur.execute('SELECT id FROM importers WHERE project_id=?', (project_id,))
-        importer_ids = [r['id'] for r in cur.fetchall()]
-
-        s2 = 0
-        if worker_ids:
-            q = f"SELECT SUM(amount) as s FROM assignments WHERE entity_type='worker' AND entity_id IN ({','.join(['?']*len(worker_ids))})"
-            cur.execute(q, worker_ids)
-            s2 += cur.fetchone()['s'] or 0
-        if importer_ids:
-            q = f"SELECT SUM(amount) as s FROM assignments WHERE entity_type='importer' AND entity_id IN ({','.join(['?']*len(importer_ids))})"
-            cur.execute(q, importer_ids)
-            s2 += cur.fetchone()['s'] or 0
-
-        total_assigned = (s1 or 0) + (s2 or 0)
-
-        # total paid: sum of payments linked to those assignments
-        # collect relevant assignment ids
-        assignment_ids = []
-        cur.execute('SELECT id FROM assignments WHERE entity_type="customer" AND entity_id=?', (project_id,))
-        assignment_ids += [r['id'] for r in cur.fetchall()]
-        if worker_ids:
-            if len(worker_ids) == 1:
-                cur.execute('SELECT id FROM assignments WHERE entity_type="worker" AND entity_id=?', (worker_ids[0],))
-                assignment_ids += [r['id'] for r in cur.fetchall()]
-            else:
-                q = f"SELECT id FROM assignments WHERE entity_type='worker' AND entity_id IN ({','.join(['?']*len(worker_ids))})"
-                cur.execute(q, worker_ids)
-                assignment_ids += [r['id'] for r in cur.fetchall()]
-        if importer_ids:
-            if len(importer_ids) == 1:
-                cur.execute('SELECT id FROM assignments WHERE entity_type="importer" AND entity_id=?', (importer_ids[0],))
-                assignment_ids += [r['id'] for r in cur.fetchall()]
-            else:
-                q = f"SELECT id FROM assignments WHERE entity_type='importer' AND entity_id IN ({','.join(['?']*len(importer_ids))})"
-                cur.execute(q, importer_ids)
-                assignment_ids += [r['id'] for r in cur.fetchall()]
-
-        total_paid = 0
-        if assignment_ids:
-            q = f"SELECT SUM(amount) as s FROM payments WHERE assignment_id IN ({','.join(['?']*len(assignment_ids))})"
-            cur.execute(q, assignment_ids)
-            total_paid = cur.fetchone()['s'] or 0
-
-        cur.execute('UPDATE projects SET total_assigned=?, total_paid=? WHERE id=?', (total_assigned, total_paid, project_id))
-        self.conn.commit()
-    def get_workers_importers_summary(self, project_id):
-        """Get total assigned and paid for workers+importers only (excluding customer)"""
-        cur = self.conn.cursor()
-        
-        # Get worker and importer ids
-        cur.execute('SELECT id FROM workers WHERE project_id=?', (project_id,))
-        worker_ids = [r['id'] for r in cur.fetchall()]
-        cur.execute('SELECT id FROM importers WHERE project_id=?', (project_id,))
-        importer_ids = [r['id'] for r in cur.fetchall()]
-        
-        # Total assigned for workers+importers
-        total_assigned = 0
-        if worker_ids:
-            if len(worker_ids) == 1:
-                cur.execute('SELECT SUM(amount) as s FROM assignments WHERE entity_type="worker" AND entity_id=?', (worker_ids[0],))
-                total_assigned += cur.fetchone()['s'] or 0
-            else:
-                q = f"SELECT SUM(amount) as s FROM assignments WHERE entity_type='worker' AND entity_id IN ({','.join(['?']*len(worker_ids))})"
-                cur.execute(q, worker_ids)
-                total_assigned += cur.fetchone()['s'] or 0
-        
-        if importer_ids:
-            if len(importer_ids) == 1:
-                cur.execute('SELECT SUM(amount) as s FROM assignments WHERE entity_type="importer" AND entity_id=?', (importer_ids[0],))
-                total_assigned += cur.fetchone()['s'] or 0
-            else:
-                q = f"SELECT SUM(amount) as s FROM assignments WHERE entity_type='importer' AND entity_id IN ({','.join(['?']*len(importer_ids))})"
-                cur.execute(q, importer_ids)
-                total_assigned += cur.fetchone()['s'] or 0
-        
-        # Total paid for workers+importers
-        total_paid = 0
-        assignment_ids = []
-        if worker_ids:
-            if len(worker_ids) == 1:
-                cur.execute('SELECT id FROM assignments WHERE entity_type="worker" AND entity_id=?', (worker_ids[0],))
-            else:
-                q = f"SELECT id FROM assignments WHERE entity_type='worker' AND entity_id IN ({','.join(['?']*len(worker_ids))})"
-                cur.execute(q, worker_ids)
-            assignment_ids += [r['id'] for r in cur.fetchall()]
-        
-        if importer_ids:
-            if len(importer_ids) == 1:
-                cur.execute('SELECT id FROM assignments WHERE entity_type="importer" AND entity_id=?', (importer_ids[0],))
-            else:
-                q = f"SELECT id FROM assignments WHERE entity_type='importer' AND entity_id IN ({','.join(['?']*len(importer_ids))})"
-                cur.execute(q, importer_ids)
-            assignment_ids += [r['id'] for r in cur.fetchall()]
-        
-        if assignment_ids:
-            q = f"SELECT SUM(amount) as s FROM payments WHERE assignment_id IN ({','.join(['?']*len(assignment_ids))})"
-            cur.execute(q, assignment_ids)
-            total_paid = cur.fetchone()['s'] or 0
-        
-        return float(total_assigned), float(total_paid)
+            customer = {'total_assigned': float(r['total_assigned']) if r else 0.0,
+                        'total_paid': float(r['total_paid']) if r else 0.0}
+        return {
+            'project': project,
+            'workers': entities['worker'],
+            'importers': entities['importer'],
+            'goods': goods,
+            'customer': customer,
+            'token': token,
+        }
+
+    # Helpers
+    def rebuild_totals(self):
+        """Recompute every stored total (per assignment, per entity and per project) from scratch.
+
+        Triggers keep the totals current on every write; this is only needed to
+        repair a database that was edited outside the application.
+        """
+        with self.transaction():
+            cur = self.conn.cursor()
+            rebuild_ledger_totals(cur)
+            self._cache.clear()
+            cur.execute('SELECT id FROM projects')
+            self._changed([('worker_totals',), ('importer_totals',)], [r['id'] for r in cur.fetchall()])
+
+    def purge_orphaned_ledger(self):
+        """Delete the assignments (and their payments) of workers, importers and projects that no longer exist.
+
+        Since migration 8 a delete takes its ledger along; rows orphaned by older
+        releases stay until this is run. It deletes ledger data, so take a backup
+        first (db.backup.backup_database). Returns (assignments, payments) deleted.
+        """
+        with self.transaction():
+            cur = self.conn.cursor()
+            cur.execute(f'''
+                SELECT COUNT(*) AS assignments,
+                       (SELECT COUNT(*) FROM payments WHERE assignment_id IN (
+                            SELECT id FROM assignments WHERE {ORPHANED_LEDGER_SQL})) AS payments
+                FROM assignments WHERE {ORPHANED_LEDGER_SQL}
+            ''')
+            counts = tuple(cur.fetchone())
+            # the delete triggers keep the totals right; payments go by cascade
+            cur.execute(f'DELETE FROM assignments WHERE {ORPHANED_LEDGER_SQL}')
+            cur.execute(f'DELETE FROM entity_balances WHERE {ORPHANED_LEDGER_SQL}')
+            self._cache.clear()
+            cur.execute('SELECT id FROM projects')
+            self._changed([('worker_totals',), ('importer_totals',)], [r['id'] for r in cur.fetchall()])
+        return counts
 
     def get_unique_worker_names(self):
         """Get all unique worker names across all projects"""
-        cur = self.conn.cursor()
+        cur = self._read_cursor()
         cur.execute('SELECT DISTINCT name FROM workers ORDER BY name')
         return [r['name'] for r in cur.fetchall()]
 
     def get_unique_jobs_for_worker(self, worker_name):
         """Get all unique jobs for a specific worker name across all projects"""
-        cur = self.conn.cursor()
+        cur = self._read_cursor()
         cur.execute('SELECT DISTINCT job FROM workers WHERE name=? ORDER BY job', (worker_name,))
         return [r['job'] for r in cur.fetchall()]
 
     def get_all_jobs(self):
         """Get all unique jobs across all workers"""
-        cur = self.conn.cursor()
+        cur = self._read_cursor()
         cur.execute('SELECT DISTINCT job FROM workers WHERE job IS NOT NULL ORDER BY job')
         return [r['job'] for r in cur.fetchall()]
 
     def get_worker_ids_by_name_and_job(self, name, job):
         """Get all worker IDs with the given name and job (could be in multiple projects)"""
-        cur = self.conn.cursor()
+        cur = self._read_cursor()
         cur.execute('SELECT id FROM workers WHERE name=? AND job=?', (name, job))
         return [r['id'] for r in cur.fetchall()]
 
+    @cached(lambda: ('worker_totals',))
     def get_all_workers_with_totals(self):
         """Get all unique workers (by name+job combination) across all projects with combined totals"""
-        cur = self.conn.cursor()
-        # Get all unique (name, job) combinations
+        cur = self._read_cursor()
+        # One statement: a row per worker record with its own totals, ordered so that
+        # each (name, job) group is contiguous and folded together below
         cur.execute('''
-            SELECT DISTINCT name, job FROM workers
-            ORDER BY name, job
+            SELECT w.id, w.name, w.job, w.project_id,
+                   pr.id AS project_found, pr.name AS project_name,
+                   COALESCE(b.total_assigned, 0) AS assigned, COALESCE(b.total_paid, 0) AS paid
+            FROM workers w
+            LEFT JOIN projects pr ON pr.id = w.project_id
+            LEFT JOIN entity_balances b ON b.entity_type = 'worker' AND b.entity_id = w.id
+            WHERE w.name IS NOT NULL AND w.job IS NOT NULL
+            ORDER BY w.name, w.job, w.id
         ''')
-        
-        worker_groups = cur.fetchall()
-        workers = []
-        
-        for group in worker_groups:
-            name = group['name']
-            job = group['job']
-            
-            # Find all worker IDs with this name+job combination
-            cur.execute('SELECT id, project_id FROM workers WHERE name=? AND job=?', (name, job))
-            worker_records = [dict(r) for r in cur.fetchall()]
-            
-            if not worker_records:
-                continue
-            
-            # Get all projects for this worker
-            projects = []
-            for wr in worker_records:
-                proj_id = wr['project_id']
-                if proj_id:
-                    cur.execute('SELECT name FROM projects WHERE id=?', (proj_id,))
-                    proj_row = cur.fetchone()
-                    if proj_row:
-                        projects.append({'id': proj_id, 'name': proj_row['name']})
-            
-            # Calculate combined totals for all instances of this worker+job
-            total_assigned = 0
-            total_paid = 0
-            
-            for wr in worker_records:
-                w_id = wr['id']
-                # Get assigned total for this worker ID
-                cur.execute('SELECT SUM(amount) as s FROM assignments WHERE entity_type="worker" AND entity_id=?', (w_id,))
-                assigned = cur.fetchone()['s'] or 0
-                total_assigned += assigned
-                
-                # Get paid total for this worker ID
-                cur.execute('SELECT id FROM assignments WHERE entity_type="worker" AND entity_id=?', (w_id,))
-                assign_ids = [r['id'] for r in cur.fetchall()]
-                
-                if assign_ids:
-                    q = f"SELECT SUM(amount) as s FROM payments WHERE assignment_id IN ({','.join(['?']*len(assign_ids))})"
-                    cur.execute(q, assign_ids)
-                    paid = cur.fetchone()['s'] or 0
-                    total_paid += paid
-            
-            workers.append({
-                'name': name,
-                'job': job,
-                'projects': projects,
-                'worker_ids': [wr['id'] for wr in worker_records],
-                'total_assigned': float(total_assigned),
-                'total_paid': float(total_paid),
-                'total_remaining': float(total_assigned - total_paid)
-            })
-        
-        return workers
+        return self._fold_entity_groups(cur, ('name', 'job'), 'worker_ids')
 
     def get_unique_importer_names(self):
         """Get all unique importer names across all projects"""
-        cur = self.conn.cursor()
+        cur = self._read_cursor()
         cur.execute('SELECT DISTINCT name FROM importers ORDER BY name')
         return [r['name'] for r in cur.fetchall()]
 
     def get_unique_goods_for_importer(self, importer_name):
         """Get all unique goods for a specific importer name across all projects"""
-        cur = self.conn.cursor()
+        cur = self._read_cursor()
         cur.execute('''
             SELECT DISTINCT a.good FROM assignments a
             JOIN importers i ON a.entity_id = i.id
@@ -464,7 +987,7 @@ class Database:
 
     def get_all_goods_importers(self):
         """Get all unique goods across all importer assignments"""
-        cur = self.conn.cursor()
+        cur = self._read_cursor()
         cur.execute('''
             SELECT DISTINCT good FROM assignments 
             WHERE entity_type='importer' AND good IS NOT NULL 
@@ -474,7 +997,7 @@ class Database:
 
     def get_importer_id_by_name(self, name, project_id=None):
         """Get importer ID by name (optionally in specific project)"""
-        cur = self.conn.cursor()
+        cur = self._read_cursor()
         if project_id:
             cur.execute('SELECT id FROM importers WHERE name=? AND project_id=?', (name, project_id))
         else:
@@ -483,7 +1006,7 @@ class Database:
 
     def get_importer_ids_by_name(self, name):
         """Get all importer IDs with the given name (could be in multiple projects)"""
-        cur = self.conn.cursor()
+        cur = self._read_cursor()
         cur.execute('SELECT id FROM importers WHERE name=?', (name,))
         return [r['id'] for r in cur.fetchall()]
 
@@ -491,76 +1014,58 @@ class Database:
         """DEPRECATED: Use get_importer_ids_by_name instead. Kept for backwards compatibility."""
         return self.get_importer_ids_by_name(name)
 
+    @cached(lambda: ('importer_totals',))
     def get_all_importers_with_totals(self):
         """Get all unique importers (by name) across all projects with combined totals and their goods"""
-        cur = self.conn.cursor()
-        # Get all unique importer names
+        cur = self._read_cursor()
+        # One statement: importer records (kind 0) followed by the distinct goods of the
+        # same name (kind 1), grouped by name
         cur.execute('''
-            SELECT DISTINCT name FROM importers
-            ORDER BY name
+            SELECT 0 AS kind, i.id AS id, i.name AS name, i.project_id,
+                   pr.id AS project_found, pr.name AS project_name,
+                   COALESCE(b.total_assigned, 0) AS assigned, COALESCE(b.total_paid, 0) AS paid, NULL AS good
+            FROM importers i
+            LEFT JOIN projects pr ON pr.id = i.project_id
+            LEFT JOIN entity_balances b ON b.entity_type = 'importer' AND b.entity_id = i.id
+            WHERE i.name IS NOT NULL
+            UNION ALL
+            SELECT DISTINCT 1, NULL, i.name, NULL, NULL, NULL, 0, 0, a.good
+            FROM assignments a
+            JOIN importers i ON a.entity_id = i.id
+            WHERE a.entity_type='importer' AND a.good IS NOT NULL AND i.name IS NOT NULL
+            ORDER BY name, kind, id, good
         ''')
-        
-        importer_groups = cur.fetchall()
-        importers = []
-        
-        for group in importer_groups:
-            name = group['name']
-            
-            # Find all importer IDs with this name (across all projects)
-            cur.execute('SELECT id, project_id FROM importers WHERE name=?', (name,))
-            importer_records = [dict(r) for r in cur.fetchall()]
-            
-            if not importer_records:
+        return self._fold_entity_groups(cur, ('name',), 'importer_ids', with_goods=True)
+
+    def _fold_entity_groups(self, cur, key_cols, ids_key, with_goods=False):
+        """Fold per-record rows (ordered by key_cols) into one summary dict per group"""
+        groups = []
+        group = None
+        key = None
+        for r in cur:
+            row_key = tuple(r[c] for c in key_cols)
+            if row_key != key:
+                key = row_key
+                group = dict(zip(key_cols, row_key))
+                if with_goods:
+                    group['goods'] = []
+                group.update({'projects': [], ids_key: [], 'total_assigned': 0, 'total_paid': 0})
+                groups.append(group)
+            if with_goods and r['kind'] == 1:
+                group['goods'].append(r['good'])
                 continue
-            
-            # Get all projects for this importer
-            projects = []
-            for ir in importer_records:
-                proj_id = ir['project_id']
-                if proj_id:
-                    cur.execute('SELECT name FROM projects WHERE id=?', (proj_id,))
-                    proj_row = cur.fetchone()
-                    if proj_row:
-                        projects.append({'id': proj_id, 'name': proj_row['name']})
-            
-            # Get all unique goods used by this importer (across all instances/projects)
-            cur.execute('''
-                SELECT DISTINCT good FROM assignments a
-                JOIN importers i ON a.entity_id = i.id
-                WHERE i.name=? AND a.entity_type='importer' AND a.good IS NOT NULL
-                ORDER BY a.good
-            ''', (name,))
-            goods = [r['good'] for r in cur.fetchall()]
-            
-            # Calculate combined totals for all instances of this importer
-            total_assigned = 0
-            total_paid = 0
-            
-            for ir in importer_records:
-                i_id = ir['id']
-                # Get assigned total for this importer ID
-                cur.execute('SELECT SUM(amount) as s FROM assignments WHERE entity_type="importer" AND entity_id=?', (i_id,))
-                assigned = cur.fetchone()['s'] or 0
-                total_assigned += assigned
-                
-                # Get paid total for this importer ID
-                cur.execute('SELECT id FROM assignments WHERE entity_type="importer" AND entity_id=?', (i_id,))
-                assign_ids = [r['id'] for r in cur.fetchall()]
-                
-                if assign_ids:
-                    q = f"SELECT SUM(amount) as s FROM payments WHERE assignment_id IN ({','.join(['?']*len(assign_ids))})"
-                    cur.execute(q, assign_ids)
-                    paid = cur.fetchone()['s'] or 0
-                    total_paid += paid
-            
-            importers.append({
-                'name': name,
-                'goods': goods,
-                'projects': projects,
-                'importer_ids': [ir['id'] for ir in importer_records],
-                'total_assigned': float(total_assigned),
-                'total_paid': float(total_paid),
-                'total_remaining': float(total_assigned - total_paid)
-            })
-        
-        return importers
\ No newline at end of file
+            if r['project_id'] and r['project_found'] is not None:
+                group['projects'].append({'id': r['project_id'], 'name': r['project_name']})
+            group[ids_key].append(r['id'])
+            group['total_assigned'] += r['assigned']
+            group['total_paid'] += r['paid']
+        result = []
+        for g in groups:
+            # goods-only groups have no importer records of their own
+            if not g[ids_key]:
+                continue
+            g['total_assigned'] = float(g['total_assigned'])
+            g['total_paid'] = float(g['total_paid'])
+            g['total_remaining'] = float(g['total_assigned'] - g['total_paid'])
+            result.append(g)
+        return result
@@ -0,0 +1,402 @@
+"""Schema migrations keyed on ``PRAGMA user_version``.
+
+Each entry in ``MIGRATIONS`` upgrades the schema by exactly one version and
+receives a cursor on the open connection. Migrations run in order, each one
+inside its own transaction, and the database's ``user_version`` is bumped
+together with the changes so a crash never leaves a half-applied step.
+"""
+
+
+def _m001_base_schema(cur):
+    """Base tables plus the columns older releases added lazily at startup"""
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS projects (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            total_assigned REAL DEFAULT 0,
+            total_paid REAL DEFAULT 0
+        )''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS workers (
+            id INTEGER PRIMARY KEY,
+            project_id INTEGER,
+            name TEXT,
+            FOREIGN KEY(project_id) REFERENCES projects(id) ON DELETE CASCADE
+        )''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS importers (
+            id INTEGER PRIMARY KEY,
+            project_id INTEGER,
+            name TEXT,
+            FOREIGN KEY(project_id) REFERENCES projects(id) ON DELETE CASCADE
+        )''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS assignments (
+            id INTEGER PRIMARY KEY,
+            entity_type TEXT CHECK(entity_type IN ('worker','importer','customer')),
+            entity_id INTEGER,
+            amount REAL,
+            date TEXT,
+            description TEXT DEFAULT '',
+            good TEXT
+        )''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY,
+            assignment_id INTEGER,
+            amount REAL,
+            date TEXT,
+            FOREIGN KEY(assignment_id) REFERENCES assignments(id) ON DELETE CASCADE
+        )''')
+    # Databases created by older releases may predate these columns
+    cur.execute("PRAGMA table_info(workers)")
+    cols = [r[1] for r in cur.fetchall()]
+    if 'job' not in cols:
+        cur.execute('ALTER TABLE workers ADD COLUMN job TEXT')
+    cur.execute("PRAGMA table_info(assignments)")
+    cols = [r[1] for r in cur.fetchall()]
+    if 'description' not in cols:
+        cur.execute('ALTER TABLE assignments ADD COLUMN description TEXT DEFAULT ""')
+    if 'good' not in cols:
+        cur.execute('ALTER TABLE assignments ADD COLUMN good TEXT')
+
+
+def _m002_ledger_indexes(cur):
+    """Covering indexes for the ledger lookups and the project foreign keys"""
+    # (entity_type, entity_id) lookups and SUM(amount) over them never touch the table
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_assignments_entity ON assignments(entity_type, entity_id, amount)')
+    # payments per assignment and SUM(amount) ... WHERE assignment_id IN (...)
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_payments_assignment ON payments(assignment_id, amount)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_workers_project ON workers(project_id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_importers_project ON importers(project_id)')
+    # name (+job) lookups used to link the same person across projects
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_workers_name_job ON workers(name, job)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_importers_name ON importers(name)')
+
+
+def _project_of(alias):
+    """SQL expression resolving the project that owns assignment row `alias`"""
+    return (f"CASE {alias}.entity_type "
+            f"WHEN 'customer' THEN {alias}.entity_id "
+            f"WHEN 'worker' THEN (SELECT project_id FROM workers WHERE id = {alias}.entity_id) "
+            f"WHEN 'importer' THEN (SELECT project_id FROM importers WHERE id = {alias}.entity_id) END")
+
+
+def rebuild_project_totals(cur):
+    """Recompute projects.total_assigned / total_paid from the ledger in one pass"""
+    cur.execute('UPDATE projects SET total_assigned = 0, total_paid = 0')
+    cur.execute(f'''
+        WITH paid AS (
+            SELECT assignment_id, SUM(amount) AS s FROM payments GROUP BY assignment_id
+        ), per_project AS (
+            SELECT {_project_of('a')} AS project_id,
+                   SUM(IFNULL(a.amount, 0)) AS assigned, SUM(IFNULL(paid.s, 0)) AS paid
+            FROM assignments a LEFT JOIN paid ON paid.assignment_id = a.id
+            GROUP BY 1
+        )
+        UPDATE projects SET total_assigned = per_project.assigned, total_paid = per_project.paid
+        FROM per_project WHERE per_project.project_id = projects.id
+    ''')
+
+
+def _m003_project_total_triggers(cur):
+    """Keep projects.total_assigned / total_paid current by delta on every ledger write"""
+    payment_project = f"(SELECT {_project_of('a')} FROM assignments a WHERE a.id = {{row}}.assignment_id)"
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_assignments_insert AFTER INSERT ON assignments BEGIN
+            UPDATE projects SET total_assigned = total_assigned + IFNULL(NEW.amount, 0)
+            WHERE id = {_project_of('NEW')};
+        END''')
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_assignments_amount AFTER UPDATE OF amount ON assignments BEGIN
+            UPDATE projects SET total_assigned = total_assigned + IFNULL(NEW.amount, 0) - IFNULL(OLD.amount, 0)
+            WHERE id = {_project_of('NEW')};
+        END''')
+    # BEFORE: the ON DELETE CASCADE on payments runs before AFTER triggers, and
+    # by then the payment triggers can no longer resolve the project
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_assignments_delete BEFORE DELETE ON assignments BEGIN
+            UPDATE projects SET
+                total_assigned = total_assigned - IFNULL(OLD.amount, 0),
+                total_paid = total_paid - (SELECT IFNULL(SUM(amount), 0) FROM payments WHERE assignment_id = OLD.id)
+            WHERE id = {_project_of('OLD')};
+        END''')
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_payments_insert AFTER INSERT ON payments BEGIN
+            UPDATE projects SET total_paid = total_paid + IFNULL(NEW.amount, 0)
+            WHERE id = {payment_project.format(row='NEW')};
+        END''')
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_payments_amount AFTER UPDATE OF amount ON payments BEGIN
+            UPDATE projects SET total_paid = total_paid + IFNULL(NEW.amount, 0) - IFNULL(OLD.amount, 0)
+            WHERE id = {payment_project.format(row='NEW')};
+        END''')
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_payments_delete AFTER DELETE ON payments BEGIN
+            UPDATE projects SET total_paid = total_paid - IFNULL(OLD.amount, 0)
+            WHERE id = {payment_project.format(row='OLD')};
+        END''')
+    # A deleted worker/importer no longer counts towards its project, even if
+    # its assignments were left behind
+    for table, entity_type in (('workers', 'worker'), ('importers', 'importer')):
+        cur.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_delete BEFORE DELETE ON {table} BEGIN
+                UPDATE projects SET
+                    total_assigned = total_assigned - (
+                        SELECT IFNULL(SUM(amount), 0) FROM assignments
+                        WHERE entity_type = '{entity_type}' AND entity_id = OLD.id),
+                    total_paid = total_paid - (
+                        SELECT IFNULL(SUM(p.amount), 0) FROM payments p
+                        JOIN assignments a ON a.id = p.assignment_id
+                        WHERE a.entity_type = '{entity_type}' AND a.entity_id = OLD.id)
+                WHERE id = OLD.project_id;
+            END''')
+    # Totals written by older releases were only refreshed on writes
+    rebuild_project_totals(cur)
+
+
+def rebuild_ledger_totals(cur):
+    """Recompute every rollup (assignment paid totals, entity balances, project totals)"""
+    cur.execute('UPDATE assignments SET paid_total = 0')
+    cur.execute('''
+        UPDATE assignments SET paid_total = paid.s
+        FROM (SELECT assignment_id, SUM(amount) AS s FROM payments GROUP BY assignment_id) AS paid
+        WHERE paid.assignment_id = assignments.id
+    ''')
+    cur.execute('DELETE FROM entity_balances')
+    cur.execute('''
+        INSERT INTO entity_balances(entity_type, entity_id, total_assigned, total_paid)
+        SELECT entity_type, entity_id, SUM(IFNULL(amount, 0)), SUM(paid_total) FROM assignments
+        WHERE entity_type IS NOT NULL AND entity_id IS NOT NULL
+        GROUP BY entity_type, entity_id
+    ''')
+    cur.execute('UPDATE projects SET total_assigned = 0, total_paid = 0')
+    cur.execute(f'''
+        UPDATE projects SET total_assigned = per_project.assigned, total_paid = per_project.paid
+        FROM (
+            SELECT {_project_of('b')} AS project_id,
+                   SUM(b.total_assigned) AS assigned, SUM(b.total_paid) AS paid
+            FROM entity_balances b GROUP BY 1
+        ) AS per_project
+        WHERE per_project.project_id = projects.id
+    ''')
+
+
+def _m004_balance_rollups(cur):
+    """Denormalized paid/remaining per assignment and an (entity_type, entity_id) rollup.
+
+    Payments only touch assignments.paid_total; the assignment triggers then
+    propagate every delta to entity_balances and projects, all inside the
+    writing statement's transaction.
+    """
+    cur.execute('ALTER TABLE assignments ADD COLUMN paid_total REAL NOT NULL DEFAULT 0')
+    # VIRTUAL is the only kind of generated column ALTER TABLE can add
+    cur.execute('ALTER TABLE assignments ADD COLUMN remaining REAL '
+                'GENERATED ALWAYS AS (IFNULL(amount, 0) - paid_total) VIRTUAL')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS entity_balances (
+            entity_type TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            total_assigned REAL NOT NULL DEFAULT 0,
+            total_paid REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY(entity_type, entity_id)
+        ) WITHOUT ROWID''')
+
+    for name in ('assignments_insert', 'assignments_amount', 'assignments_delete',
+                 'payments_insert', 'payments_amount', 'payments_delete',
+                 'workers_delete', 'importers_delete'):
+        cur.execute(f'DROP TRIGGER IF EXISTS trg_{name}')
+
+    entity = 'entity_type = {row}.entity_type AND entity_id = {row}.entity_id'
+    cur.execute(f'''
+        CREATE TRIGGER trg_assignments_insert AFTER INSERT ON assignments BEGIN
+            INSERT INTO entity_balances(entity_type, entity_id, total_assigned, total_paid)
+            SELECT NEW.entity_type, NEW.entity_id, IFNULL(NEW.amount, 0), NEW.paid_total
+            WHERE NEW.entity_type IS NOT NULL AND NEW.entity_id IS NOT NULL
+            ON CONFLICT(entity_type, entity_id) DO UPDATE SET
+                total_assigned = total_assigned + excluded.total_assigned,
+                total_paid = total_paid + excluded.total_paid;
+            UPDATE projects SET
+                total_assigned = total_assigned + IFNULL(NEW.amount, 0),
+                total_paid = total_paid + NEW.paid_total
+            WHERE id = {_project_of('NEW')};
+        END''')
+    cur.execute(f'''
+        CREATE TRIGGER trg_assignments_amount AFTER UPDATE OF amount ON assignments BEGIN
+            UPDATE entity_balances SET total_assigned = total_assigned + IFNULL(NEW.amount, 0) - IFNULL(OLD.amount, 0)
+            WHERE {entity.format(row='NEW')};
+            UPDATE projects SET total_assigned = total_assigned + IFNULL(NEW.amount, 0) - IFNULL(OLD.amount, 0)
+            WHERE id = {_project_of('NEW')};
+        END''')
+    cur.execute(f'''
+        CREATE TRIGGER trg_assignments_paid AFTER UPDATE OF paid_total ON assignments BEGIN
+            UPDATE entity_balances SET total_paid = total_paid + NEW.paid_total - OLD.paid_total
+            WHERE {entity.format(row='NEW')};
+            UPDATE projects SET total_paid = total_paid + NEW.paid_total - OLD.paid_total
+            WHERE id = {_project_of('NEW')};
+        END''')
+    # BEFORE: the ON DELETE CASCADE on payments runs before AFTER triggers; the
+    # cascaded payment deletes then find no assignment row and change nothing
+    cur.execute(f'''
+        CREATE TRIGGER trg_assignments_delete BEFORE DELETE ON assignments BEGIN
+            UPDATE entity_balances SET
+                total_assigned = total_assigned - IFNULL(OLD.amount, 0),
+                total_paid = total_paid - OLD.paid_total
+            WHERE {entity.format(row='OLD')};
+            UPDATE projects SET
+                total_assigned = total_assigned - IFNULL(OLD.amount, 0),
+                total_paid = total_paid - OLD.paid_total
+            WHERE id = {_project_of('OLD')};
+        END''')
+    cur.execute('''
+        CREATE TRIGGER trg_payments_insert AFTER INSERT ON payments BEGIN
+            UPDATE assignments SET paid_total = paid_total + IFNULL(NEW.amount, 0) WHERE id = NEW.assignment_id;
+        END''')
+    cur.execute('''
+        CREATE TRIGGER trg_payments_amount AFTER UPDATE OF amount ON payments BEGIN
+            UPDATE assignments SET paid_total = paid_total + IFNULL(NEW.amount, 0) - IFNULL(OLD.amount, 0)
+            WHERE id = NEW.assignment_id;
+        END''')
+    cur.execute('''
+        CREATE TRIGGER trg_payments_delete AFTER DELETE ON payments BEGIN
+            UPDATE assignments SET paid_total = paid_total - IFNULL(OLD.amount, 0) WHERE id = OLD.assignment_id;
+        END''')
+    for table, entity_type in (('workers', 'worker'), ('importers', 'importer')):
+        balance = f"FROM entity_balances WHERE entity_type = '{entity_type}' AND entity_id = OLD.id"
+        cur.execute(f'''
+            CREATE TRIGGER trg_{table}_delete BEFORE DELETE ON {table} BEGIN
+                UPDATE projects SET
+                    total_assigned = total_assigned - IFNULL((SELECT total_assigned {balance}), 0),
+                    total_paid = total_paid - IFNULL((SELECT total_paid {balance}), 0)
+                WHERE id = OLD.project_id;
+            END''')
+    rebuild_ledger_totals(cur)
+
+
+def _iso_date_of(column):
+    """SQL expression turning a DD-MM-YYYY display date into sortable YYYY-MM-DD"""
+    return (f"CASE WHEN {column} GLOB '[0-9][0-9]-[0-9][0-9]-[0-9][0-9][0-9][0-9]' "
+            f"THEN substr({column}, 7, 4) || '-' || substr({column}, 4, 2) || '-' || substr({column}, 1, 2) "
+            f"WHEN {column} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]' THEN {column} END")
+
+
+def _m005_sortable_dates(cur):
+    """ISO-8601 date_iso next to the DD-MM-YYYY display date, indexed for range scans.
+
+    date_iso is a generated column, so every write path keeps it in sync and
+    existing rows need no backfill; the indexes store the computed values.
+    """
+    for table in ('assignments', 'payments'):
+        cur.execute(f'ALTER TABLE {table} ADD COLUMN date_iso TEXT '
+                    f'GENERATED ALWAYS AS ({_iso_date_of("date")}) VIRTUAL')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_assignments_entity_date ON assignments(entity_type, entity_id, date_iso)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_assignments_date ON assignments(date_iso)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_payments_assignment_date ON payments(assignment_id, date_iso)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_payments_date ON payments(date_iso)')
+
+
+def _m006_keyset_indexes(cur):
+    """Indexes ending in the rowid, so id-ordered keyset pages are read straight off the index"""
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_assignments_entity_id ON assignments(entity_type, entity_id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_payments_assignment_id ON payments(assignment_id)')
+
+
+def _bump_generation(project_id):
+    """Trigger statements giving project_id the next project_generation value"""
+    return (f'UPDATE project_generation SET value = value + 1; '
+            f'UPDATE projects SET generation = (SELECT value FROM project_generation) WHERE id = {project_id};')
+
+
+def _m007_project_generations(cur):
+    """projects.generation: changes whenever anything a project's export sheet shows does.
+
+    Values come from a database-wide sequence, so a generation is never seen
+    twice, not even for a project id reused after a delete. Ledger writes
+    reach the project through the total triggers (m004); entity inserts,
+    renames, moves and deletes are caught here.
+    """
+    cur.execute('CREATE TABLE IF NOT EXISTS project_generation (value INTEGER NOT NULL)')
+    cur.execute('INSERT INTO project_generation(value) VALUES (0)')
+    cur.execute('ALTER TABLE projects ADD COLUMN generation INTEGER NOT NULL DEFAULT 0')
+    cur.execute(f'''
+        CREATE TRIGGER trg_projects_generation_insert AFTER INSERT ON projects BEGIN
+            {_bump_generation('NEW.id')}
+        END''')
+    cur.execute(f'''
+        CREATE TRIGGER trg_projects_generation_update AFTER UPDATE OF name, total_assigned, total_paid ON projects BEGIN
+            {_bump_generation('NEW.id')}
+        END''')
+    for table, columns in (('workers', 'project_id, name, job'), ('importers', 'project_id, name')):
+        cur.execute(f'''
+            CREATE TRIGGER trg_{table}_generation_insert AFTER INSERT ON {table} BEGIN
+                {_bump_generation('NEW.project_id')}
+            END''')
+        cur.execute(f'''
+            CREATE TRIGGER trg_{table}_generation_update AFTER UPDATE OF {columns} ON {table} BEGIN
+                {_bump_generation('OLD.project_id')}
+                {_bump_generation('NEW.project_id')}
+            END''')
+        cur.execute(f'''
+            CREATE TRIGGER trg_{table}_generation_delete AFTER DELETE ON {table} BEGIN
+                {_bump_generation('OLD.project_id')}
+            END''')
+
+
+def _m008_ledger_delete_cascades(cur):
+    """Deleting a worker, importer or project deletes its assignments (and so its payments).
+
+    assignments.entity_id has no foreign key, so until now the ledger rows of
+    a deleted entity stayed behind and were picked up again by whatever
+    entity later got the same id. The assignment delete trigger (m004) does
+    the subtracting; it runs while the entity row still exists (BEFORE), so
+    the project is still resolved. The emptied entity_balances row goes too.
+    Rows orphaned before this are left alone; deleting them is an explicit
+    maintenance step (Database.purge_orphaned_ledger).
+    """
+    for table, entity_type in (('workers', 'worker'), ('importers', 'importer'), ('projects', 'customer')):
+        entity = f"entity_type = '{entity_type}' AND entity_id = OLD.id"
+        cur.execute(f'DROP TRIGGER IF EXISTS trg_{table}_delete')
+        cur.execute(f'''
+            CREATE TRIGGER trg_{table}_delete BEFORE DELETE ON {table} BEGIN
+                DELETE FROM assignments WHERE {entity};
+                DELETE FROM entity_balances WHERE {entity};
+            END''')
+
+
+MIGRATIONS = [
+    _m001_base_schema,
+    _m002_ledger_indexes,
+    _m003_project_total_triggers,
+    _m004_balance_rollups,
+    _m005_sortable_dates,
+    _m006_keyset_indexes,
+    _m007_project_generations,
+    _m008_ledger_delete_cascades,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def apply_migrations(conn):
+    """Bring the schema up to SCHEMA_VERSION, returns the number of migrations applied"""
+    version = get_schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f'قاعدة البيانات أحدث من البرنامج (الإصدار {version})')
+    applied = 0
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        cur = conn.cursor()
+        try:
+            cur.execute('BEGIN')
+            MIGRATIONS[target - 1](cur)
+            # PRAGMA does not accept bound parameters; target is always an int
+            cur.execute(f'PRAGMA user_version = {int(target)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied += 1
+    return applied
@@ -0,0 +1,6 @@
+from .excel import export_to_excel, write_workbook
+from .incremental import export_incremental
+from .jobs import ExportCancelled, ExportJob
+from .ledger import export_ledger, parquet_available
+from .parallel import export_parallel, export_per_project
+from .payloads import iter_project_payloads
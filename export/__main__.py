@@ -0,0 +1,54 @@
+"""Headless exports, e.g. for scheduled jobs:
+
+    python -m export excel projects.xlsx
+    python -m export excel-incremental projects.xlsx   (daily: reuses the last run's unchanged projects)
+    python -m export per-project projects/
+    python -m export ledger ledger.csv          (or ledger.parquet, with pyarrow)
+"""
+import argparse
+import os
+import sys
+
+from db.db import Database
+
+from .excel import export_to_excel
+from .incremental import export_incremental
+from .ledger import export_ledger
+from .parallel import export_parallel, export_per_project
+
+EXPORTS = {
+    'excel': export_to_excel,
+    'excel-incremental': export_incremental,
+    'excel-parallel': export_parallel,
+    'per-project': export_per_project,
+    'ledger': export_ledger,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m export', description='Export the projects database without the UI.')
+    parser.add_argument('kind', choices=EXPORTS)
+    parser.add_argument('output', help='file to write (a new directory for per-project)')
+    parser.add_argument('--db', default='data.db', help='SQLite database (default: data.db)')
+    parser.add_argument('--quiet', action='store_true', help='do not report progress')
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.db):
+        parser.error(f'no such database: {args.db}')
+
+    def progress(done, total):
+        print(f'\r{done}/{total}', end='', file=sys.stderr, flush=True)
+
+    db = Database(args.db)
+    try:
+        EXPORTS[args.kind](db, args.output, None if args.quiet else progress)
+    except (ValueError, RuntimeError) as e:
+        parser.exit(1, f'{parser.prog}: error: {e}\n')
+    finally:
+        db.close()
+    if not args.quiet:
+        print(file=sys.stderr)
+    print(args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Streaming Excel export.
+
+Sheets are write-only: rows go straight to disk as they are appended, so
+memory stays flat however many projects and workers are exported. Cell
+styles are registered once per workbook as named styles and shared by name.
+"""
+import os
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, NamedStyle, PatternFill
+
+from .files import atomic_output
+from .payloads import iter_project_payloads
+
+SUMMARY_SHEET = 'ملخص المشاريع'
+
+
+def _style(name, color, size=None, alignment=None):
+    style = NamedStyle(name=name)
+    style.font = Font(bold=True, color='FFFFFF', size=size)
+    style.fill = PatternFill(start_color=color, end_color=color, fill_type='solid')
+    if alignment:
+        style.alignment = alignment
+    return style
+
+
+STYLES = [
+    _style('export_summary_header', '366092', 12, Alignment(horizontal='right', vertical='center')),
+    _style('export_title', '203864', 14),
+    _style('export_workers', '4472C4', 12),
+    _style('export_workers_header', '8FAADC'),
+    _style('export_importers', '70AD47', 12),
+    _style('export_importers_header', 'C6E0B4'),
+    _style('export_customer', 'FFC000', 12),
+]
+
+
+def sheet_title(name):
+    return name[:30] if len(name) <= 30 else name[:27] + '...'
+
+
+def export_to_excel(db, path, progress=None):
+    """Write the projects workbook to path, from one consistent snapshot of db"""
+    with db.reader():
+        summary = db.get_projects_summary()
+        write_workbook(path, summary, iter_project_payloads(db, summary), progress)
+
+
+def write_workbook(path, summary, payloads, progress=None):
+    """Stream the summary sheet, then one sheet per payload (see export.payloads), to path.
+
+    progress(done, total) is called after every project sheet; an exception
+    it raises aborts the export. path is only created once the workbook is
+    complete: it is written to a temporary file next to it and moved in place.
+    """
+    wb = new_workbook()
+    try:
+        write_summary_sheet(wb, summary)
+        total = len(summary)
+        for done, payload in enumerate(payloads, 1):
+            write_project_sheet(wb, payload)
+            if progress:
+                progress(done, total)
+        save_atomic(wb, path)
+    except BaseException:
+        discard_workbook(wb)
+        raise
+
+
+def save_atomic(wb, path):
+    """Save wb to path without ever leaving a partly written file there"""
+    with atomic_output(path) as tmp:
+        wb.save(tmp)
+
+
+def discard_workbook(wb):
+    """Drop an unsaved write-only wb, deleting the temporary files its sheets were streamed to"""
+    for ws in wb.worksheets:
+        writer = ws._writer
+        if writer is None:
+            continue
+        if not ws.closed:
+            ws.close()
+        if os.path.exists(writer.out):
+            writer.cleanup()
+
+
+def new_workbook():
+    wb = Workbook(write_only=True)
+    for style in STYLES:
+        wb.add_named_style(style)
+    return wb
+
+
+def _cell(ws, value, style):
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    return cell
+
+
+def _widths(ws, widths):
+    # column widths must be set before the first row is written
+    for col, width in zip('ABCD', widths):
+        ws.column_dimensions[col].width = width
+
+
+def write_summary_sheet(wb, summary):
+    ws = wb.create_sheet(SUMMARY_SHEET)
+    _widths(ws, (25, 20, 20, 20))
+    # Columns reversed for RTL: D holds the project name
+    headers = ['المبلغ المتبقي', 'المبلغ المدفوع', 'المبلغ المكلف (عمال+موردين)', 'اسم المشروع']
+    ws.append([_cell(ws, h, 'export_summary_header') for h in headers])
+    for p in summary:
+        ws.append([p['total_assigned'] - p['total_paid'], p['total_paid'], p['total_assigned'], p['name']])
+
+
+def write_project_sheet(wb, payload):
+    ws = wb.create_sheet(sheet_title(payload['name']))
+    _widths(ws, (25, 25, 20, 20))
+    rows = _SheetRows(ws)
+
+    rows.section(f'المشروع: {payload["name"]}', 'export_title', 'D')
+    rows.append([])
+
+    rows.section('العمال', 'export_workers', 'D')
+    rows.table(['المبلغ المدفوع', 'المبلغ المكلف', 'المهنة', 'اسم العامل'], 'export_workers_header',
+               payload['workers'], 'لا يوجد عمال')
+    rows.append([])
+
+    rows.section('الموردون', 'export_importers', 'D')
+    rows.table(['المبلغ المدفوع', 'المبلغ المكلف', 'السلعة/الوظيفة', 'اسم المورد'], 'export_importers_header',
+               payload['importers'], 'لا يوجد موردون')
+    rows.append([])
+
+    rows.section('العميل', 'export_customer', 'C')
+    cust_total = payload['customer_assigned']
+    cust_paid = payload['customer_paid']
+    rows.append([None, None, cust_total, 'إجمالي المبلغ المكلف'])
+    rows.append([None, None, cust_paid, 'المبلغ المدفوع'])
+    rows.append([None, None, cust_total - cust_paid, 'المبلغ المتبقي'])
+
+
+class _SheetRows:
+    """Appends rows to a write-only sheet, keeping the row number for merged ranges"""
+    def __init__(self, ws):
+        self.ws = ws
+        self.row = 0
+
+    def append(self, values):
+        self.ws.append(values)
+        self.row += 1
+
+    def section(self, text, style, last_col):
+        self.append([_cell(self.ws, text, style)])
+        self.ws.merged_cells.add(f'A{self.row}:{last_col}{self.row}')
+
+    def table(self, headers, header_style, entities, empty_text):
+        if not entities:
+            self.append([empty_text])
+            return
+        self.append([_cell(self.ws, h, header_style) for h in headers])
+        for name, detail, assigned, paid in entities:
+            self.append([paid, assigned, detail, name])
@@ -0,0 +1,26 @@
+import os
+import shutil
+from contextlib import contextmanager
+
+from utils.files import make_temp_path
+
+
+@contextmanager
+def atomic_output(path, directory=False):
+    """Yield a temporary file (or directory) path next to path, moved to path if the block succeeds.
+
+    Exports write through this so that path never holds a partly written
+    file: on failure (or cancel) the temporary one is removed instead. The
+    result gets the mode of any other new file (see make_temp_path).
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    tmp = make_temp_path(parent, '.export-', '.part', is_dir=directory)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    except BaseException:
+        if directory:
+            shutil.rmtree(tmp, ignore_errors=True)
+        elif os.path.exists(tmp):
+            os.remove(tmp)
+        raise
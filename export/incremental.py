@@ -0,0 +1,108 @@
+"""Incremental Excel export: only the projects changed since the last run are queried again.
+
+The payloads (see export.payloads) of the last export are kept in a cache
+directory next to the output, one JSON file per project, plus an index of
+the summary row each was built from. A cached payload is reused while its
+project's generation (bumped by triggers on every write touching the
+project, see migration 7) and its summary row are unchanged; the summary
+sheet and the payloads of the other projects are rebuilt from the database.
+Payloads are streamed to the workbook one at a time, so memory does not grow
+with the data. The workbook written is the same as export_to_excel's.
+"""
+import json
+import os
+
+from .excel import write_workbook
+from .files import atomic_output
+from .payloads import iter_project_payloads
+
+CACHE_NAME = '.projects_export_cache'
+INDEX_NAME = 'index.json'
+CACHE_VERSION = 2
+
+# Summary fields a cached payload must still have to be reused
+CHECKED_FIELDS = ('generation', 'name', 'total_assigned', 'total_paid', 'customer_assigned', 'customer_paid')
+
+# Up to this many changed projects are looked up by id; past it one scan is cheaper
+MAX_DIRTY_LOOKUP = 500
+
+
+def default_cache_path(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_NAME)
+
+
+def export_incremental(db, path, progress=None, cache_path=None):
+    """Write the projects workbook to path, rebuilding only the payloads of changed projects.
+
+    Returns how many project payloads were rebuilt. The cache index is only
+    updated once the workbook is complete.
+    """
+    cache_path = cache_path or default_cache_path(path)
+    os.makedirs(cache_path, exist_ok=True)
+    cached = load_cache_index(cache_path, db)
+    with db.reader():
+        summary = db.get_projects_summary()
+        dirty = [p for p in summary if not _reusable(cached.get(p['id']), p)]
+        ids = [p['id'] for p in dirty] if len(dirty) <= MAX_DIRTY_LOOKUP else None
+        rebuilt = iter_project_payloads(db, dirty, ids) if dirty else iter(())
+        index = {}
+
+        def merged():
+            for p in summary:
+                entry = cached.get(p['id'])
+                if _reusable(entry, p):
+                    with open(os.path.join(cache_path, entry['file']), encoding='utf-8') as f:
+                        body = json.load(f)
+                    payload = dict(p, workers=body['workers'], importers=body['importers'])
+                    index[p['id']] = entry
+                else:
+                    # rebuilt follows summary order, so it yields exactly this project
+                    payload = next(rebuilt)
+                    index[p['id']] = _save_payload(cache_path, payload)
+                yield payload
+
+        write_workbook(path, summary, merged(), progress)
+    save_cache_index(cache_path, db, index)
+    return len(dirty)
+
+
+def _reusable(entry, project):
+    return entry is not None and all(entry.get(f) == project[f] for f in CHECKED_FIELDS)
+
+
+def _save_payload(cache_path, payload):
+    """Write one payload's file; returns its index entry"""
+    # the generation is never reused, so a file still listed by the current
+    # index is only ever rewritten with the same content
+    name = f"project_{payload['id']}_{payload['generation']}.json"
+    with atomic_output(os.path.join(cache_path, name)) as tmp:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'workers': payload['workers'], 'importers': payload['importers']}, f, ensure_ascii=False)
+    return dict({field: payload[field] for field in CHECKED_FIELDS}, file=name)
+
+
+def load_cache_index(cache_path, db):
+    """Index entries (the checked summary fields and the payload file) by project id;
+    empty if there is no usable cache for db"""
+    try:
+        with open(os.path.join(cache_path, INDEX_NAME), encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if index.get('version') != CACHE_VERSION or index.get('database') != os.path.abspath(db.path):
+        return {}
+    return {int(pid): entry for pid, entry in index['projects'].items()
+            if os.path.exists(os.path.join(cache_path, entry['file']))}
+
+
+def save_cache_index(cache_path, db, entries):
+    """Write the index for entries, then delete the payload files it no longer lists"""
+    index = {'version': CACHE_VERSION, 'database': os.path.abspath(db.path), 'projects': entries}
+    with atomic_output(os.path.join(cache_path, INDEX_NAME)) as tmp:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+    listed = {entry['file'] for entry in entries.values()}
+    for name in os.listdir(cache_path):
+        # also the files of exports that failed or were cancelled
+        if name.startswith('project_') and name not in listed:
+            os.remove(os.path.join(cache_path, name))
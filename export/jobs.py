@@ -0,0 +1,66 @@
+"""Export jobs: an export running on its own thread, reporting to the UI through a queue.
+
+The job reads through its own read-only connection (Database.reader()), so
+the writer and the dashboard loads are never held up by it. Tk must only be
+touched from its own thread, so nothing is called back: the job puts events
+on job.events and the UI drains them (see MainWindow._poll_export):
+
+    ('progress', done, total)   after each project sheet (or step of the export)
+    ('done', path)              the file is complete at path
+    ('cancelled', None)         cancel() stopped the job, nothing was written
+    ('error', exception)        the export failed, nothing was written
+
+Any function taking (db, path, progress) runs as a job, e.g. the other
+exports of this package or db.backup.backup_database.
+"""
+import queue
+import threading
+
+from .excel import export_to_excel
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class ExportJob:
+    def __init__(self, db, path, export=export_to_excel):
+        self.db = db
+        self.path = path
+        self.export = export
+        self.events = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='export', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Ask the job to stop; it does so at the next project sheet.
+
+        A job already past its last sheet completes (and reports 'done').
+        """
+        self._cancel.set()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _progress(self, done, total):
+        if self._cancel.is_set():
+            raise ExportCancelled()
+        self.events.put(('progress', done, total))
+
+    def _run(self):
+        try:
+            self.export(self.db, self.path, self._progress)
+        except ExportCancelled:
+            self.events.put(('cancelled', None))
+        except Exception as e:
+            self.events.put(('error', e))
+        else:
+            self.events.put(('done', self.path))
@@ -0,0 +1,77 @@
+"""Raw ledger export for analytics: one flat, denormalized table of every project's
+entities, assignments and payments (see Database.iter_ledger_export_chunks).
+
+Rows stream from SQLite in chunks of plain tuples straight into the writer,
+as CSV or, when pyarrow is installed, Parquet (chosen by the file extension).
+"""
+import csv
+import importlib.util
+from bisect import bisect_right
+
+from db.db import LEDGER_EXPORT_COLUMNS
+
+from .files import atomic_output
+
+# Rows per chunk; also the Parquet row group size
+LEDGER_BATCH = 20000
+
+LEDGER_FORMATS = ('.csv', '.parquet')
+
+
+def parquet_available():
+    # pyarrow is only imported by a Parquet export: it is large, and this module
+    # is loaded at app start and by every export worker process
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def export_ledger(db, path, progress=None):
+    """Write the ledger of every project to path (.csv or .parquet), from one snapshot of db.
+
+    progress(done, total) is called with the number of projects written so far.
+    """
+    suffix = path[path.rfind('.'):].lower() if '.' in path else ''
+    if suffix not in LEDGER_FORMATS:
+        raise ValueError(f'صيغة غير مدعومة: {suffix or path} (المتاح: {", ".join(LEDGER_FORMATS)})')
+    if suffix == '.parquet' and not parquet_available():
+        raise RuntimeError('التصدير إلى Parquet يتطلب تثبيت pyarrow')
+    write = _write_parquet if suffix == '.parquet' else _write_csv
+    with db.reader():
+        # ascending, so the projects done after a chunk are found by bisection
+        project_ids = sorted(p['id'] for p in db.get_all_projects())
+        chunks = db.iter_ledger_export_chunks(LEDGER_BATCH)
+        with atomic_output(path) as tmp:
+            write(tmp, _reporting(chunks, project_ids, progress))
+
+
+def _reporting(chunks, project_ids, progress):
+    total = len(project_ids)
+    for rows in chunks:
+        yield rows
+        if progress:
+            # rows come newest project first; the last one's project may go on in the next chunk
+            progress(total - bisect_right(project_ids, rows[-1][0]), total)
+    if progress:
+        progress(total, total)
+
+
+def _write_csv(path, chunks):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, _ in LEDGER_EXPORT_COLUMNS])
+        for rows in chunks:
+            writer.writerows(rows)
+
+
+def _write_parquet(path, chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {'integer': pa.int64(), 'real': pa.float64(), 'text': pa.string()}
+    schema = pa.schema([(name, types[kind]) for name, kind in LEDGER_EXPORT_COLUMNS])
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in chunks:
+            # one pass turns the row tuples into columns
+            columns = zip(*rows)
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema))
@@ -0,0 +1,111 @@
+"""Parallel export: the projects are shared out to a pool of worker processes.
+
+Each worker opens the database itself and reads through its own read-only
+connection. Either
+
+- export_parallel: workers build the payloads (see export.payloads) of their
+  share of the projects and send them back, where they are streamed into
+  one workbook in order, or
+- export_per_project: workers also write the workbooks, one per project, so
+  rendering is spread over the cores as well.
+
+Both take the same arguments as export_to_excel, so they can run as an
+ExportJob. Every worker reads its own snapshot: a write landing during the
+export may show in some sheets and not in others.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from db.db import Database
+
+from .excel import export_to_excel, write_workbook
+from .files import atomic_output
+from .payloads import iter_project_payloads
+
+# Projects are handed out in about this many chunks per process, so a slow
+# chunk does not leave the other processes idle at the end
+CHUNKS_PER_PROCESS = 4
+
+
+def project_filename(project):
+    return f'project_{project["id"]}.xlsx'
+
+
+def export_parallel(db, path, progress=None, processes=None):
+    """Write the same workbook as export_to_excel, building the payloads in processes"""
+    if not db.is_file_backed:
+        return export_to_excel(db, path, progress)
+    with db.reader():
+        summary = db.get_projects_summary()
+    with _worker_pool(processes) as (pool, processes):
+        futures = [pool.submit(load_payloads, db.path, chunk)
+                   for chunk in _chunks([p['id'] for p in summary], processes)]
+
+        def payloads():
+            while futures:
+                # dropping each chunk once written keeps only the unwritten ones in memory
+                yield from futures.pop(0).result()
+
+        write_workbook(path, summary, payloads(), progress)
+
+
+def export_per_project(db, directory, progress=None, processes=None):
+    """Write one workbook per project (see project_filename) into the new directory.
+
+    directory only appears once every file is written; until then they go to
+    a temporary directory next to it, which is removed if the export fails.
+    """
+    with db.reader():
+        ids = [p['id'] for p in db.get_projects_summary()]
+    with atomic_output(directory, directory=True) as tmp, _worker_pool(processes) as (pool, processes):
+        futures = [pool.submit(write_project_files, db.path, tmp, chunk)
+                   for chunk in _chunks(ids, processes)]
+        done = 0
+        for future in as_completed(futures):
+            done += future.result()
+            if progress:
+                progress(done, len(ids))
+
+
+@contextmanager
+def _worker_pool(processes=None):
+    processes = processes or os.cpu_count() or 1
+    # spawn, not fork: the UI process runs threads (Tk, the Database executor)
+    pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        yield pool, processes
+    finally:
+        # on failure or cancel, chunks not started yet are dropped
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _chunks(ids, processes):
+    size = max(1, -(-len(ids) // (processes * CHUNKS_PER_PROCESS)))
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+
+# Worker process side
+def load_payloads(db_path, project_ids):
+    """The payloads of project_ids, newest first"""
+    db = Database(db_path, readers=1)
+    try:
+        with db.reader():
+            summary = db.get_projects_summary(project_ids)
+            return list(iter_project_payloads(db, summary, project_ids))
+    finally:
+        db.close()
+
+
+def write_project_files(db_path, directory, project_ids):
+    """Write the workbook of every project of project_ids into directory; returns how many"""
+    db = Database(db_path, readers=1)
+    try:
+        with db.reader():
+            summary = db.get_projects_summary(project_ids)
+            for project, payload in zip(summary, iter_project_payloads(db, summary, project_ids)):
+                write_workbook(os.path.join(directory, project_filename(project)), [project], [payload])
+            return len(summary)
+    finally:
+        db.close()
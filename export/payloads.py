@@ -0,0 +1,35 @@
+"""Per-project export payloads: plain dicts holding everything a project sheet shows.
+
+They are built from a few grouped queries streamed in project order, so
+building them costs the same whatever the number of workers or sheets.
+"""
+from itertools import groupby
+
+
+def iter_project_payloads(db, summary, project_ids=None):
+    """Yield one payload per project of summary (db.get_projects_summary(project_ids), newest first).
+
+    A payload is the summary row plus
+        workers: [(name, job, total_assigned, total_paid)]
+        importers: [(name, goods, total_assigned, total_paid)]
+    Run inside db.reader() so the summary and the payloads see one snapshot.
+    """
+    workers = groupby(db.iter_entity_totals('worker', project_ids=project_ids), key=lambda r: r.project_id)
+    importers = groupby(db.iter_entity_totals('importer', project_ids=project_ids), key=lambda r: r.project_id)
+    next_workers = next(workers, None)
+    next_importers = next(importers, None)
+    for p in summary:
+        payload = dict(p, workers=[], importers=[])
+        # both streams are ordered like summary; skip groups of projects it does not list
+        while next_workers is not None and next_workers[0] > p['id']:
+            next_workers = next(workers, None)
+        if next_workers is not None and next_workers[0] == p['id']:
+            payload['workers'] = [(r.name, r.job or '', r.total_assigned, r.total_paid) for r in next_workers[1]]
+            next_workers = next(workers, None)
+        while next_importers is not None and next_importers[0] > p['id']:
+            next_importers = next(importers, None)
+        if next_importers is not None and next_importers[0] == p['id']:
+            # the goods column has never been filled for importers
+            payload['importers'] = [(r.name, '', r.total_assigned, r.total_paid) for r in next_importers[1]]
+            next_importers = next(importers, None)
+        yield payload
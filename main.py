@@ -1,3 +1,4 @@
+import multiprocessing
 import ttkbootstrap as tb
 from ui.main_window import MainWindow
 from db.db import Database
@@ -6,8 +7,13 @@ from db.db import Database
 def main():
     db = Database('data.db')
     app = MainWindow(db)
-    app.run()
+    try:
+        app.run()
+    finally:
+        db.close()
 
 
 if __name__ == '__main__':
+    # the parallel export starts worker processes, also from a frozen .exe
+    multiprocessing.freeze_support()
     main()
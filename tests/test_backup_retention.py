@@ -0,0 +1,46 @@
+"""Backup retention (db.backup.expired_backups)"""
+import unittest
+from datetime import datetime, timedelta
+
+from db.backup import expired_backups
+
+
+def backup(when):
+    return when, f'data_backup_{when:%Y%m%d_%H%M%S}.db'
+
+
+class ExpiredBackupsTest(unittest.TestCase):
+    def test_newest_per_day_and_week(self):
+        start = datetime(2024, 1, 1, 12)  # a Monday
+        backups = [backup(start + timedelta(days=d, hours=h)) for d in range(30) for h in (0, 3)]
+        expired = expired_backups(backups, keep_daily=7, keep_weekly=4)
+        kept = sorted(set(name for _, name in backups) - set(expired))
+        # newest of each of the last 7 days, and of each of the last 4 ISO weeks
+        # (the two most recent weeks already have theirs among the 7 days)
+        self.assertEqual(kept, sorted([backup(start + timedelta(days=d, hours=3))[1]
+                                       for d in (13, 20, 23, 24, 25, 26, 27, 28, 29)]))
+
+    def test_order_of_input_does_not_matter(self):
+        start = datetime(2024, 1, 1)
+        backups = [backup(start + timedelta(hours=h)) for h in range(5)]
+        self.assertEqual(expired_backups(backups, 1, 1), expired_backups(backups[::-1], 1, 1))
+        self.assertEqual(len(expired_backups(backups, 1, 1)), 4)
+
+    def test_same_second_ties(self):
+        when = datetime(2024, 1, 1, 9)
+        plain = (when, 'data_backup_20240101_090000.db')
+        packed = (when, 'data_backup_20240101_090000.db.gz')
+        # by name, descending
+        self.assertEqual(expired_backups([plain, packed], 1, 1), [plain[1]])
+        # unless the other one was just written
+        self.assertEqual(expired_backups([plain, packed], 1, 1, keep=(plain[1],)), [packed[1]])
+
+    def test_kept_backup_never_expires(self):
+        old = backup(datetime(2020, 1, 1))
+        recent = [backup(datetime(2024, 1, 1) + timedelta(days=d)) for d in range(3)]
+        self.assertEqual(expired_backups([old, *recent], 2, 0), [recent[0][1], old[1]])
+        self.assertEqual(expired_backups([old, *recent], 2, 0, keep=(old[1],)), [recent[0][1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
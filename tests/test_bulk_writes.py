@@ -0,0 +1,57 @@
+"""add_assignments_many / add_payments_many: one unit, all or nothing"""
+import unittest
+
+from db.db import Database
+
+
+class BulkWritesTest(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:')
+        self.project = self.db.add_project('p')
+        self.worker = self.db.add_worker(self.project, 'w')
+        self.a = self.db.add_assignment('worker', self.worker, 50, '01-01-2024')
+        self.b = self.db.add_assignment('worker', self.worker, 20, '01-01-2024')
+
+    def tearDown(self):
+        self.db.close()
+
+    def payment_count(self):
+        return self.db.conn.execute('SELECT COUNT(*) FROM payments').fetchone()[0]
+
+    def test_add_assignments_many(self):
+        self.assertEqual(self.db.add_assignments_many([
+            ('worker', self.worker, 5, '02-01-2024'),
+            ('customer', self.project, 70, '02-01-2024', 'c'),
+            ('worker', self.worker, 7, '03-01-2024', 'd', 'g'),
+        ]), 3)
+        self.assertEqual(self.db.get_entity_balance('worker', self.worker), (82.0, 0.0))
+        self.assertEqual(self.db.get_customer_summary(self.project), (70.0, 0.0))
+
+    def test_add_payments_many(self):
+        self.assertEqual(self.db.add_payments_many([(self.a, 30, '02-01-2024'), (self.a, 20, '03-01-2024'),
+                                                    (self.b, 5, '02-01-2024')]), 3)
+        self.assertEqual(self.db.get_entity_balance('worker', self.worker), (70.0, 55.0))
+
+    def test_overpaying_within_the_batch_rejects_it_whole(self):
+        # each payment fits on its own; together they exceed assignment a
+        with self.assertRaises(ValueError):
+            self.db.add_payments_many([(self.b, 5, '02-01-2024'), (self.a, 30, '02-01-2024'),
+                                       (self.a, 30, '03-01-2024')])
+        self.assertEqual(self.payment_count(), 0)
+        self.assertEqual(self.db.get_entity_balance('worker', self.worker), (70.0, 0.0))
+
+    def test_overpaying_with_existing_payments_rejects_the_batch(self):
+        self.db.add_payment(self.b, 15, '02-01-2024')
+        with self.assertRaises(ValueError):
+            self.db.add_payments_many([(self.a, 10, '03-01-2024'), (self.b, 10, '03-01-2024')])
+        self.assertEqual(self.payment_count(), 1)
+        self.assertEqual(self.db.get_entity_balance('worker', self.worker), (70.0, 15.0))
+
+    def test_unknown_assignment_rejects_the_batch(self):
+        with self.assertRaises(ValueError):
+            self.db.add_payments_many([(self.a, 10, '02-01-2024'), (self.b + 100, 1, '02-01-2024')])
+        self.assertEqual(self.payment_count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""change_token / changes_since: what a refresh has to look at"""
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from db.db import Database
+
+
+class ChangeTokenTest(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:')
+        self.p = self.db.add_project('p')
+        self.q = self.db.add_project('q')
+        self.worker = self.db.add_worker(self.p, 'w')
+        self.importer = self.db.add_importer(self.q, 'i')
+        self.assignment = self.db.add_assignment('worker', self.worker, 50, '01-01-2024')
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_reads_keep_the_token(self):
+        tokens = [self.db.change_token(), self.db.change_token(self.p)]
+        self.db.get_all_projects()
+        self.db.get_all_workers_with_totals()
+        self.db.get_entity_balance('worker', self.worker)
+        self.db.get_assignments('worker', self.worker)
+        with self.db.reader():
+            self.db.get_workers_importers_summary(self.p)
+        self.assertEqual([self.db.change_token(), self.db.change_token(self.p)], tokens)
+        self.assertEqual(self.db.changes_since(tokens[0]), set())
+
+    def test_write_changes_only_its_project_token(self):
+        p_token, q_token = self.db.change_token(self.p), self.db.change_token(self.q)
+        self.db.add_payment(self.assignment, 10, '02-01-2024')
+        self.assertNotEqual(self.db.change_token(self.p), p_token)
+        self.assertEqual(self.db.change_token(self.q), q_token)
+
+    def test_changes_since_regions(self):
+        token = self.db.change_token()
+        self.db.add_payment(self.assignment, 10, '02-01-2024')
+        self.assertEqual(self.db.changes_since(token), {('project', self.p), 'workers'})
+
+        token = self.db.change_token()
+        self.db.add_assignment('importer', self.importer, 5, '01-01-2024')
+        self.db.add_assignment('customer', self.p, 70, '01-01-2024')
+        self.assertEqual(self.db.changes_since(token), {('project', self.p), ('project', self.q), 'importers'})
+
+        token = self.db.change_token()
+        self.db.edit_project(self.q, 'q2')
+        # project names are listed in the worker / importer summaries
+        self.assertEqual(self.db.changes_since(token), {('project', self.q), 'workers', 'importers'})
+
+    def test_rolled_back_unit_changes_nothing(self):
+        token = self.db.change_token()
+        with self.assertRaises(ValueError):
+            with self.db.transaction():
+                self.db.add_payment(self.assignment, 10, '02-01-2024')
+                raise ValueError()
+        self.assertEqual(self.db.change_token(), token)
+        self.assertEqual(self.db.changes_since(token), set())
+
+    def test_unknown_changes(self):
+        self.assertIsNone(self.db.changes_since(None))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'data.db')
+            db = Database(path)
+            try:
+                token = db.change_token()
+                # a write by another connection (another process) is seen, but not where
+                other = sqlite3.connect(path)
+                with other:
+                    other.execute("INSERT INTO projects(name) VALUES('x')")
+                other.close()
+                self.assertNotEqual(db.change_token(), token)
+                self.assertIsNone(db.changes_since(token))
+            finally:
+                db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
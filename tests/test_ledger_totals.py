@@ -0,0 +1,107 @@
+"""The trigger-maintained totals must always equal a rebuild from the ledger"""
+import unittest
+
+from db.db import Database
+
+
+class LedgerTotalsTest(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:')
+
+    def tearDown(self):
+        self.db.close()
+
+    def stored_totals(self):
+        cur = self.db.conn.cursor()
+        cur.execute('SELECT id, total_assigned, total_paid FROM projects ORDER BY id')
+        projects = [tuple(r) for r in cur.fetchall()]
+        cur.execute('SELECT id, paid_total FROM assignments ORDER BY id')
+        assignments = [tuple(r) for r in cur.fetchall()]
+        cur.execute('SELECT * FROM entity_balances ORDER BY entity_type, entity_id')
+        balances = [tuple(r) for r in cur.fetchall()]
+        return projects, assignments, balances
+
+    def assertTotalsMatchRebuild(self):
+        before = self.stored_totals()
+        self.db.rebuild_totals()
+        self.assertEqual(before, self.stored_totals())
+
+    def test_deleted_project_ledger_not_inherited(self):
+        a = self.db.add_project('a')
+        b = self.db.add_project('b')
+        self.db.add_assignment('customer', b, 100, '01-01-2024')
+        worker = self.db.add_worker(b, 'w')
+        assignment = self.db.add_assignment('worker', worker, 50, '01-01-2024')
+        self.db.add_payment(assignment, 20, '02-01-2024')
+        self.db.delete_project(b)
+        c = self.db.add_project('c')
+        self.assertEqual(c, b)  # the rowid is reused
+
+        project = next(p for p in self.db.get_all_projects() if p['id'] == c)
+        self.assertEqual((project['total_assigned'], project['total_paid']), (0, 0))
+        self.assertEqual(self.db.get_customer_summary(c), (0.0, 0.0))
+        self.assertEqual(self.db.conn.execute('SELECT COUNT(*) FROM payments').fetchone()[0], 0)
+        self.assertTotalsMatchRebuild()
+        self.assertEqual(self.db.get_customer_summary(a), (0.0, 0.0))
+
+    def test_deleted_worker_and_importer_ledgers(self):
+        p = self.db.add_project('p')
+        worker = self.db.add_worker(p, 'w')
+        importer = self.db.add_importer(p, 'i')
+        for entity_type, entity_id in (('worker', worker), ('importer', importer), ('customer', p)):
+            assignment = self.db.add_assignment(entity_type, entity_id, 30, '01-01-2024')
+            self.db.add_payment(assignment, 10, '02-01-2024')
+        self.db.delete_worker(worker)
+        self.db.delete_importer(importer)
+
+        # only the customer ledger is left
+        project = self.db.get_all_projects()[0]
+        self.assertEqual((project['total_assigned'], project['total_paid']), (30, 10))
+        self.assertEqual(self.db.get_customer_summary(p), (30.0, 10.0))
+        self.assertEqual(self.db.get_assignments('worker', worker), [])
+        self.assertEqual(self.db.add_worker(p, 'w2'), worker)
+        self.assertEqual(self.db.get_workers_importers_summary(p), (0.0, 0.0))
+        self.assertTotalsMatchRebuild()
+
+    def test_deleted_entity_balances(self):
+        p = self.db.add_project('p')
+        worker = self.db.add_worker(p, 'w')
+        importer = self.db.add_importer(p, 'i')
+        self.db.add_assignment('worker', worker, 40, '01-01-2024')
+        self.db.add_assignment('importer', importer, 60, '01-01-2024')
+        self.db.add_assignment('customer', p, 80, '01-01-2024')
+        self.db.delete_worker(worker)
+        self.db.delete_importer(importer)
+        self.db.delete_project(p)
+        self.assertEqual(self.db.conn.execute('SELECT COUNT(*) FROM entity_balances').fetchone()[0], 0)
+
+        p = self.db.add_project('p2')
+        worker = self.db.add_worker(p, 'w2')
+        self.db.add_assignment('worker', worker, 5, '01-01-2024')
+        self.assertEqual(self.db.get_entity_balance('worker', worker), (5.0, 0.0))
+        self.assertEqual(self.db.get_entity_balance('importer', importer), (0.0, 0.0))
+        self.assertTotalsMatchRebuild()
+
+    def test_purge_orphaned_ledger(self):
+        p = self.db.add_project('p')
+        worker = self.db.add_worker(p, 'w')
+        kept = self.db.add_assignment('worker', worker, 7, '01-01-2024')
+        # ledger rows of entities deleted by an older release
+        with self.db.transaction():
+            for entity_type, entity_id in (('worker', 900), ('importer', 901), ('customer', 902)):
+                cur = self.db.conn.execute('INSERT INTO assignments(entity_type, entity_id, amount, date) VALUES(?,?,?,?)',
+                                           (entity_type, entity_id, 10, '01-01-2024'))
+                self.db.conn.execute('INSERT INTO payments(assignment_id, amount, date) VALUES(?,?,?)',
+                                     (cur.lastrowid, 4, '02-01-2024'))
+        self.assertEqual(self.db.get_entity_balance('worker', 900), (10.0, 4.0))
+
+        self.assertEqual(self.db.purge_orphaned_ledger(), (3, 3))
+        self.assertEqual(self.db.get_entity_balance('worker', 900), (0.0, 0.0))
+        self.assertEqual([a['id'] for a in self.db.get_assignments('worker', worker)], [kept])
+        self.assertEqual(self.db.conn.execute('SELECT COUNT(*) FROM entity_balances').fetchone()[0], 1)
+        self.assertEqual(self.db.purge_orphaned_ledger(), (0, 0))
+        self.assertTotalsMatchRebuild()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Every mutator drops the cached summaries its write affects"""
+import unittest
+
+from db.db import Database
+
+
+class QueryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:')
+        self.p = self.db.add_project('p')
+        self.q = self.db.add_project('q')
+        self.worker = self.db.add_worker_with_job(self.p, 'w', 'j')
+        self.importer = self.db.add_importer(self.p, 'i')
+        self.a = self.db.add_assignment('worker', self.worker, 50, '01-01-2024')
+        self.b = self.db.add_assignment('importer', self.importer, 40, '01-01-2024', good='g')
+        self.payment = self.db.add_payment(self.a, 10, '02-01-2024')
+
+    def tearDown(self):
+        self.db.close()
+
+    def summaries(self):
+        db = self.db
+        values = [db.get_all_projects(), db.get_all_workers_with_totals(), db.get_all_importers_with_totals()]
+        for project in (self.p, self.q):
+            values += [db.get_workers_importers_summary(project), db.get_entity_balance('customer', project)]
+        values += [db.get_entity_balance('worker', self.worker), db.get_entity_balance('importer', self.importer)]
+        return values
+
+    def assertCacheFresh(self, mutate):
+        # fill the cache, write, then compare the cached reads with uncached ones
+        self.summaries()
+        mutate()
+        hits = self.db.cache_stats()['hits']
+        cached = self.summaries()
+        self.db._cache.clear()
+        self.assertEqual(cached, self.summaries())
+        return self.db.cache_stats()['hits'] - hits
+
+    def test_reads_are_cached(self):
+        self.summaries()
+        self.assertEqual(self.assertCacheFresh(lambda: None), len(self.summaries()))
+
+    def test_project_mutators(self):
+        self.assertCacheFresh(lambda: self.db.add_project('r'))
+        self.assertCacheFresh(lambda: self.db.edit_project(self.p, 'p2'))
+        self.assertCacheFresh(lambda: self.db.add_assignment('customer', self.q, 90, '01-01-2024'))
+        self.assertCacheFresh(lambda: self.db.delete_project(self.q))
+        self.assertCacheFresh(lambda: self.db.delete_project(self.p))
+
+    def test_worker_and_importer_mutators(self):
+        self.assertCacheFresh(lambda: self.db.add_worker(self.q, 'w'))
+        self.assertCacheFresh(lambda: self.db.add_worker_with_job(self.q, 'w', 'j'))
+        self.assertCacheFresh(lambda: self.db.edit_worker(self.worker, 'w2'))
+        self.assertCacheFresh(lambda: self.db.add_importer(self.q, 'i'))
+        self.assertCacheFresh(lambda: self.db.edit_importer(self.importer, 'i2'))
+        self.assertCacheFresh(lambda: self.db.delete_worker(self.worker))
+        self.assertCacheFresh(lambda: self.db.delete_importer(self.importer))
+
+    def test_ledger_mutators(self):
+        self.assertCacheFresh(lambda: self.db.add_assignment('worker', self.worker, 5, '03-01-2024'))
+        self.assertCacheFresh(lambda: self.db.add_assignments_many([('importer', self.importer, 6, '03-01-2024'),
+                                                                    ('customer', self.p, 7, '03-01-2024')]))
+        self.assertCacheFresh(lambda: self.db.add_payment(self.b, 4, '03-01-2024'))
+        self.assertCacheFresh(lambda: self.db.add_payments_many([(self.a, 1, '03-01-2024'), (self.b, 2, '03-01-2024')]))
+        self.assertCacheFresh(lambda: self.db.delete_payment(self.payment))
+        self.assertCacheFresh(lambda: self.db.delete_assignment(self.b))
+        self.assertCacheFresh(lambda: self.db.delete_assignments_for('worker', self.worker))
+
+    def test_rolled_back_unit(self):
+        def failing_unit():
+            with self.assertRaises(ValueError):
+                with self.db.transaction():
+                    self.db.add_payment(self.a, 30, '03-01-2024')
+                    # read inside the unit, then undone
+                    self.summaries()
+                    raise ValueError()
+        self.assertCacheFresh(failing_unit)
+        self.assertEqual(self.db.get_entity_balance('worker', self.worker), (50.0, 10.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
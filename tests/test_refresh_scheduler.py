@@ -0,0 +1,78 @@
+"""RefreshScheduler: bursts of requests become one refresh"""
+import unittest
+from unittest import mock
+
+from ui.refresh import ALL, RefreshScheduler
+
+
+class FakeWidget:
+    """Stands in for Tk's after / after_cancel, on a clock the test moves"""
+    def __init__(self):
+        self.now = 0.0
+        self.jobs = {}
+        self._next_job = 0
+
+    def after(self, ms, fn):
+        self._next_job += 1
+        self.jobs[self._next_job] = (self.now + ms / 1000, fn)
+        return self._next_job
+
+    def after_cancel(self, job):
+        del self.jobs[job]
+
+    def advance(self, ms):
+        self.now += ms / 1000
+        for job, (due, fn) in sorted(self.jobs.items(), key=lambda item: item[1][0]):
+            if due <= self.now and job in self.jobs:
+                del self.jobs[job]
+                fn()
+
+
+class RefreshSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.widget = FakeWidget()
+        self.runs = []
+        self.result = None
+        patcher = mock.patch('ui.refresh.time.monotonic', lambda: self.widget.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.scheduler = RefreshScheduler(self.widget, self.refresh, delay_ms=100, max_wait_ms=500)
+
+    def refresh(self, regions):
+        self.runs.append(regions)
+        return self.result
+
+    def test_burst_is_coalesced(self):
+        for region in (('project', 1), 'workers', ('project', 1), ('project', 2)):
+            self.scheduler.request(region)
+            self.widget.advance(50)
+        self.assertEqual(self.runs, [])
+        self.widget.advance(100)
+        self.assertEqual(self.runs, [{('project', 1), ('project', 2), 'workers'}])
+        self.assertEqual(self.scheduler.stats(), {'requested': 4, 'performed': 1, 'suppressed': 3})
+        self.assertEqual(self.widget.jobs, {})
+
+    def test_max_wait(self):
+        # a steady stream of requests still refreshes every max_wait_ms
+        for _ in range(12):
+            self.scheduler.request(ALL)
+            self.widget.advance(90)
+        self.assertEqual(len(self.runs), 2)
+        self.assertEqual(self.scheduler.stats()['suppressed'], 10)
+
+    def test_flush_and_noop(self):
+        self.scheduler.request('workers')
+        self.scheduler.flush()
+        self.assertEqual(self.runs, [{'workers'}])
+        self.assertEqual(self.widget.jobs, {})
+        # nothing pending: flush does nothing
+        self.scheduler.flush()
+        self.result = False
+        self.scheduler.request('importers')
+        self.widget.advance(100)
+        self.assertEqual(self.runs, [{'workers'}, {'importers'}])
+        self.assertEqual(self.scheduler.stats(), {'requested': 2, 'performed': 1, 'suppressed': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""The iter_* readers stream the same rows whatever the batch size"""
+import unittest
+
+from db.db import Database
+
+
+class StreamingTest(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:')
+        self.project = self.db.add_project('p')
+        self.worker = self.db.add_worker(self.project, 'w')
+        self.paid = self.db.add_assignment('worker', self.worker, 30, '01-01-2024', 'a')
+        self.unpaid = self.db.add_assignment('worker', self.worker, 5, '03-01-2024', 'b')
+        self.db.add_payment(self.paid, 10, '02-01-2024')
+        self.db.add_payment(self.paid, 15, '04-01-2024')
+        self.customer = self.db.add_assignment('customer', self.project, 100, '01-01-2024')
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_iter_assignments(self):
+        records = list(self.db.iter_assignments('worker', self.worker, batch_size=1))
+        self.assertEqual([(r.id, r.amount, r.paid_total) for r in records],
+                         [(self.unpaid, 5.0, 0.0), (self.paid, 30.0, 25.0)])
+        self.assertEqual(records, list(self.db.iter_assignments('worker', self.worker)))
+
+    def test_iter_payments(self):
+        records = list(self.db.iter_payments(self.paid, batch_size=1))
+        self.assertEqual([(r.amount, r.date) for r in records], [(15.0, '04-01-2024'), (10.0, '02-01-2024')])
+        self.assertEqual(list(self.db.iter_payments(self.unpaid)), [])
+
+    def test_iter_ledger(self):
+        records = list(self.db.iter_ledger(self.project, batch_size=2))
+        self.assertEqual(records, list(self.db.iter_ledger(self.project)))
+        # one row per payment, one with no payment for each unpaid assignment
+        self.assertEqual([(r.entity_type, r.assignment_id, r.payment_amount) for r in records],
+                         [('customer', self.customer, None),
+                          ('worker', self.paid, 10.0), ('worker', self.paid, 15.0),
+                          ('worker', self.unpaid, None)])
+        self.assertEqual({r.entity_name for r in records if r.entity_type == 'worker'}, {'w'})
+        self.assertEqual(list(self.db.iter_ledger(self.project + 1)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
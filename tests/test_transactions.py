@@ -0,0 +1,67 @@
+"""Database.transaction(): one commit per unit, nested blocks as savepoints"""
+import unittest
+
+from db.db import Database
+
+
+class TransactionTest(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:')
+
+    def tearDown(self):
+        self.db.close()
+
+    def project_names(self):
+        return sorted(r[0] for r in self.db.conn.execute('SELECT name FROM projects'))
+
+    def test_outer_failure_rolls_back_nested_writes(self):
+        with self.assertRaises(ValueError):
+            with self.db.transaction():
+                # the mutator's own block is the first statement of the unit
+                self.db.add_project('a')
+                self.db.add_project('b')
+                raise ValueError()
+        self.assertEqual(self.project_names(), [])
+
+    def test_caught_inner_failure_undoes_only_the_inner_block(self):
+        with self.db.transaction():
+            self.db.add_project('kept')
+            try:
+                with self.db.transaction():
+                    self.db.add_project('undone')
+                    raise ValueError()
+            except ValueError:
+                pass
+            self.db.add_project('after')
+        self.assertEqual(self.project_names(), ['after', 'kept'])
+        # the unit was committed
+        self.assertFalse(self.db.conn.in_transaction)
+
+    def test_failed_mutator_inside_a_unit(self):
+        p = self.db.add_project('p')
+        assignment = self.db.add_assignment('customer', p, 10, '01-01-2024')
+        with self.db.transaction():
+            self.db.add_payment(assignment, 4, '02-01-2024')
+            with self.assertRaises(ValueError):
+                # would overpay the assignment
+                self.db.add_payment(assignment, 7, '02-01-2024')
+            self.db.add_payment(assignment, 6, '03-01-2024')
+        self.assertEqual(self.db.get_customer_summary(p), (10.0, 10.0))
+        self.assertEqual(len(self.db.get_payments(assignment)), 2)
+
+    def test_deeper_nesting(self):
+        with self.db.transaction():
+            with self.db.transaction():
+                self.db.add_project('a')
+                try:
+                    with self.db.transaction():
+                        self.db.add_project('b')
+                        raise ValueError()
+                except ValueError:
+                    pass
+            self.db.add_project('c')
+        self.assertEqual(self.project_names(), ['a', 'c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
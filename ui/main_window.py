@@ -1,15 +1,36 @@
+import bisect
 import os
-import shutil
+import queue
 from datetime import datetime
 import ttkbootstrap as tb
 from ttkbootstrap.constants import RIGHT, LEFT
 from tkinter import messagebox
 from tkinter import simpledialog
 from ui.project_window import ProjectWindow, WorkerDetailWindow
+from ui.refresh import ALL, RefreshScheduler
+from ui.tasks import BackgroundLoader
 import pandas as pd
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
-from openpyxl.utils.dataframe import dataframe_to_rows
+import export
+from export import ExportJob
+from db.backup import backup_database, default_backup_dir
+
+
+# Bind tag carrying the dashboard mouse-wheel handler (bound once, see _setup_canvas_scrolling)
+WHEEL_TAG = 'DashboardWheel'
+
+CARD_STYLES = {'project': 'secondary', 'worker': 'info', 'importer': 'warning'}
+
+# Dashboard grid: a card row is as tall as its tallest card. Card and line
+# heights depend on theme, fonts and scaling, so they are measured (see _measure_cards)
+CARD_COLUMNS = 2
+CARD_MARGIN = 8
+CARD_PADDING = 12
+HEADER_FONT = ('Segoe UI', 12, 'bold')
+
+# How often a running export's progress is picked up (ms)
+EXPORT_POLL_MS = 100
+# Compression of the toolbar backups: None (a plain .db, restored by copying it back), 'gzip' or 'zstd'
+BACKUP_COMPRESSION = None
 
 
 class MainWindow:
@@ -20,6 +41,25 @@ class MainWindow:
         self.app.geometry('900x640')
         self.app.resizable(False, False)
         self.app.option_add('*Font', 'SegoeUI 10')
+        # Dashboard model (see _render_cards): card specs in display order, their
+        # data by key, the rows they are laid out in and each row's y offset
+        self._cards = []
+        self._card_data = {}
+        self._rows = []
+        self._row_tops = [0]
+        self._project_count = 0
+        # Reusable card widgets, only as many as the viewport shows (see _layout_cards)
+        self._card_pool = []
+        self._section_header = None
+        self._layout_pending = None
+        # Last rendered card model by section, and the change_token() it reflects
+        self._sections = None
+        self._sections_token = None
+        # Windows ask for dashboard refreshes through this (see request_refresh)
+        self.refresher = RefreshScheduler(self.app, self._refresh)
+        # The running export or backup, if any, and its result messages (see _start_job)
+        self._export_job = None
+        self._job_messages = None
         self._build_ui()
 
     def _build_ui(self):
@@ -29,14 +69,31 @@ class MainWindow:
         title = tb.Label(top, text='مدير المشاريع والمدفوعات', font=('Segoe UI', 16, 'bold'), anchor='e')
         title.pack(side='right', fill='both', expand=True, padx=(0, 40))
 
+        # Shown while the dashboard is being loaded in the background
+        self.status_label = tb.Label(top, text='', anchor='w', foreground='gray')
+        self.status_label.pack(side='left', padx=6)
+        # The dashboard queries run on the Database executor; the window stays responsive meanwhile
+        self._loader = BackgroundLoader(self.app, self.db, self.status_label)
+
         actions = tb.Frame(top)
         actions.pack(side='right')
 
-        export_btn = tb.Button(actions, text='تصدير إلى Excel', bootstyle='info-outline', command=self.export_to_excel)
-        export_btn.pack(side=LEFT, padx=6)
-
-        backup_btn = tb.Button(actions, text='نسخ احتياطي لقاعدة البيانات', bootstyle='secondary-outline', command=self.backup_db)
-        backup_btn.pack(side=LEFT, padx=6)
+        # Disabled while an export or backup runs (see _start_job)
+        self.job_buttons = [
+            tb.Button(actions, text='تصدير إلى Excel', bootstyle='info-outline', command=self.export_to_excel),
+            tb.Button(actions, text='ملف لكل مشروع', bootstyle='info-outline', command=self.export_per_project),
+            tb.Button(actions, text='تصدير السجل (CSV/Parquet)', bootstyle='info-outline', command=self.export_ledger),
+            tb.Button(actions, text='نسخ احتياطي لقاعدة البيانات', bootstyle='secondary-outline', command=self.backup_db),
+        ]
+        for btn in self.job_buttons:
+            btn.pack(side=LEFT, padx=6)
+
+        # Progress of a running export or backup; only shown while one runs
+        self.export_frame = tb.Frame(top)
+        self.export_progress = tb.Progressbar(self.export_frame, length=160, mode='determinate', bootstyle='info-striped')
+        self.export_progress.pack(side=LEFT, padx=(0, 6))
+        tb.Button(self.export_frame, text='إلغاء', bootstyle='danger-outline',
+                  command=self.cancel_export).pack(side=LEFT)
 
         add_btn = tb.Button(self.app, text='+', bootstyle='success', width=3, command=self.add_project_dialog)
         add_btn.place(relx=0.95, rely=0.02)
@@ -45,34 +102,28 @@ class MainWindow:
         container = tb.Frame(self.app)
         container.pack(fill='both', expand=True, padx=12, pady=(8, 12))
 
-        self.canvas = tb.Canvas(container, bg=self.app.cget('bg'), highlightthickness=0)
-        scrollbar = tb.Scrollbar(container, orient='vertical', command=self.canvas.yview)
-        scrollbar.pack(side='right', fill='y')
+        self.canvas = tb.Canvas(container, bg=self.app.cget('bg'), highlightthickness=0, yscrollincrement=20)
+        self.scrollbar = tb.Scrollbar(container, orient='vertical', command=self.canvas.yview)
+        self.scrollbar.pack(side='right', fill='y')
         self.canvas.pack(side='left', fill='both', expand=True)
-        self.canvas.configure(yscrollcommand=scrollbar.set)
-
-        self.cards_frame = tb.Frame(self.canvas)
-        canvas_window = self.canvas.create_window((0, 0), window=self.cards_frame, anchor='nw')
-
-        def resize_canvas(event):
-            self.canvas.itemconfig(canvas_window, width=event.width)
+        # Cards are a small pool of widgets placed over the rows in view; every
+        # scroll or resize rebinds them to the data rows now visible
+        self.canvas.configure(yscrollcommand=self._on_cards_scrolled)
+        self.canvas.bind('<Configure>', self._on_canvas_configure)
+        self.app.bind('<<ThemeChanged>>', self._on_canvas_configure, add='+')
+        self._measure_cards()
 
-        self.cards_frame.bind('<Configure>', lambda e: self.canvas.configure(scrollregion=self.canvas.bbox('all')))
-        self.canvas.bind('<Configure>', resize_canvas)
-        
-        # Configure grid columns to expand equally
-        self.cards_frame.columnconfigure(0, weight=1)
-        self.cards_frame.columnconfigure(1, weight=1)
-
-        self.cards_frame.bind('<Configure>', lambda e: self.canvas.configure(scrollregion=self.canvas.bbox('all')))
-        
         # Add mouse wheel scrolling support
-        self._setup_canvas_scrolling(self.canvas, self.cards_frame)
+        self._setup_canvas_scrolling(self.canvas)
 
         self.load_projects()
 
-    def _setup_canvas_scrolling(self, canvas, frame):
-        """Enable mouse wheel scrolling on the canvas and all child frames"""
+    def _setup_canvas_scrolling(self, canvas):
+        """Enable mouse wheel scrolling on the canvas and every card.
+
+        The handler is bound once on a bind tag; cards only add the tag to
+        their widgets (see _tag_wheel), so refreshes never rebind anything.
+        """
         def _on_mousewheel(event):
             # Ensure canvas has focus for smooth scrolling
             canvas.focus_set()
@@ -85,204 +136,318 @@ class MainWindow:
                     canvas.yview_scroll(-3, "units")
             except Exception:
                 pass
-        
-        # Bind to canvas
-        canvas.bind("<MouseWheel>", _on_mousewheel)
-        canvas.bind("<Button-4>", _on_mousewheel)
-        canvas.bind("<Button-5>", _on_mousewheel)
-        
-        # Bind to main frame
-        frame.bind("<MouseWheel>", _on_mousewheel)
-        frame.bind("<Button-4>", _on_mousewheel)
-        frame.bind("<Button-5>", _on_mousewheel)
-        
-        # Recursively bind to all child frames
-        def bind_children(parent):
-            for child in parent.winfo_children():
-                if isinstance(child, tb.Frame):
-                    child.bind("<MouseWheel>", _on_mousewheel)
-                    child.bind("<Button-4>", _on_mousewheel)
-                    child.bind("<Button-5>", _on_mousewheel)
-                    bind_children(child)
-        
-        bind_children(frame)
-
-    def load_projects(self):
-        for w in self.cards_frame.winfo_children():
-            w.destroy()
-
-        projects = self.db.get_all_projects()
-        cols = 2
-        r = c = 0
-        
-        # Load projects first
-        for p in projects:
-            frame = tb.Frame(self.cards_frame, padding=12, relief='raised', bootstyle='secondary')
-            frame.grid(row=r, column=c, padx=8, pady=8, sticky='nsew')
-
-            name = tb.Label(frame, text=p['name'], font=('Segoe UI', 12, 'bold'), anchor='e')
-            name.pack(fill='x')
-
-            # Get workers + importers totals only (excluding customer)
+
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.app.bind_class(WHEEL_TAG, sequence, _on_mousewheel)
+        self._tag_wheel(canvas)
+
+    @staticmethod
+    def _tag_wheel(widget):
+        widget.bindtags((WHEEL_TAG,) + widget.bindtags())
+
+    def load_projects(self, force=False):
+        """Refresh the whole dashboard now (windows use request_refresh instead)"""
+        self._refresh({ALL}, force)
+
+    def request_refresh(self, *regions):
+        """Ask for a dashboard refresh; requests arriving close together are coalesced.
+
+        regions narrow what to rebuild (see Database.changes_since); regions
+        written through the Database are found out anyway.
+        """
+        self.refresher.request(*regions)
+
+    def refresh_stats(self):
+        """Requested / performed / suppressed dashboard refresh counters"""
+        return self.refresher.stats()
+
+    def _refresh(self, regions, force=False):
+        # Nothing was written since the last render (e.g. a cancelled dialog)
+        token = self.db.change_token()
+        if self._loader.is_current(token) and not force:
+            return False
+        # Sections outside the dirty regions are reused from the last rendered model
+        base, base_token = self._sections, self._sections_token
+        changed = None if ALL in regions or base is None else self.db.changes_since(base_token)
+        dirty = None if changed is None else changed | regions
+        self._loader.start(token, lambda sections: self._on_cards_loaded(token, sections),
+                           self._collect_cards, dirty, base)
+
+    def _collect_cards(self, dirty=None, base=None):
+        """Card model of the dashboard by section (runs on a background thread: no Tk calls here).
+
+        dirty: regions to rebuild, None for everything; the cards of other
+        regions are taken from base, the previous model.
+        """
+        def is_dirty(region):
+            return dirty is None or region in dirty
+
+        old_projects = {} if dirty is None else {card[0]: card for card in base['projects']}
+        projects = []
+        for p in self.db.get_all_projects():
+            card = old_projects.get(('project', p['id']))
+            projects.append(self._project_card(p) if card is None or is_dirty(('project', p['id'])) else card)
+        sections = {'projects': projects, 'workers': [], 'importers': []}
+        if not is_dirty('workers'):
+            sections['workers'] = base['workers']
+        else:
             try:
-                total, paid = self.db.get_workers_importers_summary(p['id'])
+                sections['workers'] = [self._worker_card(w) for w in self.db.get_all_workers_with_totals()]
             except Exception:
-                total = 0
-                paid = 0
-            remain = total - paid
-
-            lbl_total = tb.Label(frame, text=f'المبلغ الكلي المُكلّف: {total:.2f}', anchor='e')
-            lbl_total.pack(fill='x')
-            lbl_paid = tb.Label(frame, text=f'المبلغ المدفوع: {paid:.2f}', anchor='e')
-            lbl_paid.pack(fill='x')
-            lbl_remain = tb.Label(frame, text=f'المبلغ المتبقي: {remain:.2f}', anchor='e')
-            lbl_remain.pack(fill='x')
-
-            def on_left(e, pid=p['id'], pname=p['name']):
-                ProjectWindow(self.db, pid, self.load_projects, pname)
-
-            def on_right(e, pid=p['id'], title=p['name']):
-                menu = tb.Menu(self.app, tearoff=0)
-                menu.add_command(label='تعديل اسم المشروع', command=lambda: self.edit_project_dialog(pid))
-                menu.add_command(label='حذف المشروع', command=lambda: self.delete_project(pid))
-                menu.tk_popup(e.x_root, e.y_root)
-
-            frame.bind('<Button-1>', on_left)
-            frame.bind('<Button-3>', on_right)
-
-            c += 1
-            if c >= cols:
-                c = 0
-                r += 1
-        
-        # Add separator / section header for workers and importers
-        if projects:  # Only add separator if there are projects
-            r += 1
-        
-        header_frame = tb.Frame(self.cards_frame)
-        header_frame.grid(row=r, column=0, columnspan=cols, sticky='ew', padx=8, pady=(12, 6))
-        
-        section_label = tb.Label(header_frame, text='العاملون والموردون', 
-                                font=('Segoe UI', 12, 'bold'), anchor='e')
-        section_label.pack(side='right', fill='x', expand=True)
-        
-        r += 1
-        c = 0
-        
-        # Load workers
+                pass
+        if not is_dirty('importers'):
+            sections['importers'] = base['importers']
+        else:
+            try:
+                sections['importers'] = [self._importer_card(imp) for imp in self.db.get_all_importers_with_totals()]
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+        return sections
+
+    def _on_cards_loaded(self, token, sections):
+        self._sections = sections
+        self._sections_token = token
+        self._render_cards(sections['projects'] + sections['workers'] + sections['importers'],
+                           len(sections['projects']))
+
+    # Dashboard cards: (key, data, lines) where lines are (text, font, foreground)
+    def _project_card(self, p):
+        # Get workers + importers totals only (excluding customer)
         try:
-            workers = self.db.get_all_workers_with_totals()
-            for w in workers:
-                frame = tb.Frame(self.cards_frame, padding=12, relief='raised', bootstyle='info')
-                frame.grid(row=r, column=c, padx=8, pady=8, sticky='nsew')
-
-                # Name with job type
-                name_text = f"{w['name']}"
-                if w['job']:
-                    name_text += f" ({w['job']})"
-                name = tb.Label(frame, text=name_text, font=('Segoe UI', 11, 'bold'), anchor='e')
-                name.pack(fill='x')
-                
-                # Type label
-                type_label = tb.Label(frame, text='عامل', font=('Segoe UI', 9), anchor='e', foreground='gray')
-                type_label.pack(fill='x')
-
-                # Projects list
-                if w['projects']:
-                    projects_text = ', '.join([p['name'] for p in w['projects']])
-                    proj_label = tb.Label(frame, text=f'المشاريع: {projects_text}', font=('Segoe UI', 8), anchor='e', foreground='gray')
-                    proj_label.pack(fill='x')
-
-                lbl_total = tb.Label(frame, text=f'المبلغ الكلي المُكلّف: {w["total_assigned"]:.2f}', anchor='e')
-                lbl_total.pack(fill='x')
-                lbl_paid = tb.Label(frame, text=f'المبلغ المدفوع: {w["total_paid"]:.2f}', anchor='e')
-                lbl_paid.pack(fill='x')
-                lbl_remain = tb.Label(frame, text=f'المبلغ المتبقي: {w["total_remaining"]:.2f}', anchor='e')
-                lbl_remain.pack(fill='x')
-
-                def on_worker_click(e, worker_ids=w['worker_ids'], wname=w['name']):
-                    WorkerDetailWindow(self.db, 'worker', worker_ids, wname, self.load_projects)
-
-                frame.bind('<Button-1>', on_worker_click)
-
-                c += 1
-                if c >= cols:
-                    c = 0
-                    r += 1
+            total, paid = self.db.get_workers_importers_summary(p['id'])
         except Exception:
-            pass
-        
-        # Load importers
-        try:
-            importers = self.db.get_all_importers_with_totals()
-            for imp in importers:
-                frame = tb.Frame(self.cards_frame, padding=12, relief='raised', bootstyle='warning')
-                frame.grid(row=r, column=c, padx=8, pady=8, sticky='nsew')
-
-                # Name (no job field anymore)
-                name = tb.Label(frame, text=imp['name'], font=('Segoe UI', 11, 'bold'), anchor='e')
-                name.pack(fill='x')
-                
-                # Type label
-                type_label = tb.Label(frame, text='مورد', font=('Segoe UI', 9), anchor='e', foreground='gray')
-                type_label.pack(fill='x')
-
-                # Goods list (replaces job)
-                if imp['goods']:
-                    goods_text = ', '.join(imp['goods'])
-                    goods_label = tb.Label(frame, text=f'السلع: {goods_text}', font=('Segoe UI', 8), anchor='e', foreground='gray')
-                    goods_label.pack(fill='x')
-
-                # Projects list
-                if imp['projects']:
-                    projects_text = ', '.join([p['name'] for p in imp['projects']])
-                    proj_label = tb.Label(frame, text=f'المشاريع: {projects_text}', font=('Segoe UI', 8), anchor='e', foreground='gray')
-                    proj_label.pack(fill='x')
-
-                lbl_total = tb.Label(frame, text=f'المبلغ الكلي المُكلّف: {imp["total_assigned"]:.2f}', anchor='e')
-                lbl_total.pack(fill='x')
-                lbl_paid = tb.Label(frame, text=f'المبلغ المدفوع: {imp["total_paid"]:.2f}', anchor='e')
-                lbl_paid.pack(fill='x')
-                lbl_remain = tb.Label(frame, text=f'المبلغ المتبقي: {imp["total_remaining"]:.2f}', anchor='e')
-                lbl_remain.pack(fill='x')
-
-                def on_importer_click(e, importer_ids=imp['importer_ids'], iname=imp['name']):
-                    WorkerDetailWindow(self.db, 'importer', importer_ids, iname, self.load_projects)
-
-                frame.bind('<Button-1>', on_importer_click)
-
-                c += 1
-                if c >= cols:
-                    c = 0
-                    r += 1
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-        
-        # Configure all rows to expand equally and fill available space
-        for i in range(r + 1):
-            self.cards_frame.rowconfigure(i, weight=1)
-        
-        # Rebind scrolling events to newly created frames for smooth scrolling
-        def _on_mousewheel(event):
-            self.canvas.focus_set()
-            try:
-                if event.num == 5 or event.delta < 0:
-                    self.canvas.yview_scroll(3, "units")
-                elif event.num == 4 or event.delta > 0:
-                    self.canvas.yview_scroll(-3, "units")
-            except Exception:
-                pass
-        
-        def bind_children(parent):
-            for child in parent.winfo_children():
-                if isinstance(child, tb.Frame):
-                    child.bind("<MouseWheel>", _on_mousewheel)
-                    child.bind("<Button-4>", _on_mousewheel)
-                    child.bind("<Button-5>", _on_mousewheel)
-                    bind_children(child)
-        
-        bind_children(self.cards_frame)
+            total = 0
+            paid = 0
+        remain = total - paid
+        lines = [
+            (p['name'], ('Segoe UI', 12, 'bold'), None),
+            (f'المبلغ الكلي المُكلّف: {total:.2f}', None, None),
+            (f'المبلغ المدفوع: {paid:.2f}', None, None),
+            (f'المبلغ المتبقي: {remain:.2f}', None, None),
+        ]
+        return ('project', p['id']), p, lines
+
+    def _worker_card(self, w):
+        # Name with job type
+        name_text = f"{w['name']}"
+        if w['job']:
+            name_text += f" ({w['job']})"
+        lines = [
+            (name_text, ('Segoe UI', 11, 'bold'), None),
+            ('عامل', ('Segoe UI', 9), 'gray'),
+        ]
+        if w['projects']:
+            projects_text = ', '.join([p['name'] for p in w['projects']])
+            lines.append((f'المشاريع: {projects_text}', ('Segoe UI', 8), 'gray'))
+        lines += self._totals_lines(w)
+        return ('worker', w['name'], w['job']), w, lines
+
+    def _importer_card(self, imp):
+        lines = [
+            (imp['name'], ('Segoe UI', 11, 'bold'), None),
+            ('مورد', ('Segoe UI', 9), 'gray'),
+        ]
+        # Goods list (replaces job)
+        if imp['goods']:
+            lines.append((f"السلع: {', '.join(imp['goods'])}", ('Segoe UI', 8), 'gray'))
+        if imp['projects']:
+            projects_text = ', '.join([p['name'] for p in imp['projects']])
+            lines.append((f'المشاريع: {projects_text}', ('Segoe UI', 8), 'gray'))
+        lines += self._totals_lines(imp)
+        return ('importer', imp['name']), imp, lines
+
+    @staticmethod
+    def _totals_lines(entity):
+        return [
+            (f'المبلغ الكلي المُكلّف: {entity["total_assigned"]:.2f}', None, None),
+            (f'المبلغ المدفوع: {entity["total_paid"]:.2f}', None, None),
+            (f'المبلغ المتبقي: {entity["total_remaining"]:.2f}', None, None),
+        ]
+
+    def _render_cards(self, cards, project_count):
+        """Lay out the card model: rows of CARD_COLUMNS cards, projects first,
+        then the workers/importers section header, then the rest.
+
+        Only row offsets are computed here; widgets exist just for the rows in
+        view (see _layout_cards), so cost and memory do not grow with cards.
+        """
+        cols = CARD_COLUMNS
+        self._cards = cards
+        self._card_data = {key: data for key, data, _lines in cards}
+        rows = [list(range(i, min(i + cols, project_count))) for i in range(0, project_count, cols)]
+        # None marks the section header row
+        rows.append(None)
+        rows += [list(range(i, min(i + cols, len(cards)))) for i in range(project_count, len(cards), cols)]
+        tops = [0]
+        for row in rows:
+            if row is None:
+                height = self._line_height(HEADER_FONT)
+            else:
+                height = self._card_chrome + max(sum(self._line_height(font) for _text, font, _fg in cards[i][2])
+                                                 for i in row)
+            tops.append(tops[-1] + height + 2 * CARD_MARGIN)
+        self._project_count = project_count
+        self._rows = rows
+        self._row_tops = tops
+        self.canvas.configure(scrollregion=(0, 0, 1, tops[-1]))
+        self._layout_cards()
+
+    def _metrics_key(self):
+        """What the measured sizes depend on besides the fonts: DPI scaling and the ttk theme"""
+        return self.app.tk.call('tk', 'scaling'), self.app.tk.call('ttk::style', 'theme', 'use')
+
+    def _measure_cards(self):
+        """Measure the height a card adds around its lines (padding, border) on a probe card
+        that is never shown, and forget the line heights measured so far"""
+        probe = tb.Frame(self.canvas, padding=CARD_PADDING, relief='raised', bootstyle=CARD_STYLES['project'])
+        line = tb.Label(probe, text='0', anchor='e')
+        line.pack(fill='x')
+        probe.update_idletasks()
+        self._card_chrome = probe.winfo_reqheight() - line.winfo_reqheight()
+        probe.destroy()
+        # label whose requested height gives a line's height in a font (see _line_height)
+        if getattr(self, '_line_probe', None) is None:
+            self._line_probe = tb.Label(self.canvas, text='0')
+            self._default_line_font = self._line_probe.cget('font')
+        self._line_heights = {}
+        self._measured_for = self._metrics_key()
+
+    def _line_height(self, font):
+        """Height (px) of a card line in font (None: the label default)"""
+        height = self._line_heights.get(font)
+        if height is None:
+            self._line_probe.configure(font=font or self._default_line_font)
+            self._line_probe.update_idletasks()
+            height = self._line_heights[font] = self._line_probe.winfo_reqheight()
+        return height
+
+    def _on_canvas_configure(self, _event=None):
+        # a scaling or theme change alters every measured size: lay the rows out again
+        if self._metrics_key() != self._measured_for:
+            self._measure_cards()
+            self._render_cards(self._cards, self._project_count)
+        else:
+            self._layout_cards()
+
+    def _on_cards_scrolled(self, first, last):
+        self.scrollbar.set(first, last)
+        # coalesce the bursts of scroll callbacks a wheel spin produces
+        if self._layout_pending is None:
+            self._layout_pending = self.app.after_idle(self._layout_cards)
+
+    def _layout_cards(self):
+        """Bind the pooled card widgets to the rows currently in view"""
+        self._layout_pending = None
+        width = self.canvas.winfo_width()
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first = max(bisect.bisect_right(self._row_tops, top) - 1, 0)
+        last = min(bisect.bisect_left(self._row_tops, bottom), len(self._rows))
+        col_width = width / CARD_COLUMNS
+        used = 0
+        header_shown = False
+        for r in range(first, last):
+            row = self._rows[r]
+            y = self._row_tops[r]
+            height = self._row_tops[r + 1] - y
+            if row is None:
+                self._place(self._header_slot(), (CARD_MARGIN, y + CARD_MARGIN,
+                                                  width - 2 * CARD_MARGIN, height - 2 * CARD_MARGIN))
+                header_shown = True
+                continue
+            for c, i in enumerate(row):
+                if used == len(self._card_pool):
+                    self._card_pool.append(self._create_card_slot())
+                slot = self._card_pool[used]
+                used += 1
+                key, _data, lines = self._cards[i]
+                self._bind_card_slot(slot, key, lines)
+                self._place(slot, (c * col_width + CARD_MARGIN, y + CARD_MARGIN,
+                                   col_width - 2 * CARD_MARGIN, height - 2 * CARD_MARGIN))
+        for slot in self._card_pool[used:]:
+            self._place(slot, None)
+        if not header_shown and self._section_header is not None:
+            self._place(self._section_header, None)
+
+    def _place(self, slot, geometry):
+        """Move a pooled widget's canvas window to (x, y, width, height), or hide it"""
+        if slot['geometry'] == geometry:
+            return
+        if geometry is None:
+            self.canvas.itemconfigure(slot['window'], state='hidden')
+        else:
+            x, y, width, height = geometry
+            self.canvas.coords(slot['window'], x, y)
+            self.canvas.itemconfigure(slot['window'], width=width, height=height, state='normal')
+        slot['geometry'] = geometry
+
+    def _header_slot(self):
+        if self._section_header is None:
+            frame = tb.Frame(self.canvas)
+            tb.Label(frame, text='العاملون والموردون',
+                     font=HEADER_FONT, anchor='e').pack(side='right', fill='x', expand=True)
+            self._tag_wheel(frame)
+            window = self.canvas.create_window(0, 0, window=frame, anchor='nw')
+            self._section_header = {'frame': frame, 'window': window, 'geometry': ()}
+        return self._section_header
+
+    def _create_card_slot(self):
+        frame = tb.Frame(self.canvas, padding=CARD_PADDING, relief='raised', bootstyle=CARD_STYLES['project'])
+        self._tag_wheel(frame)
+        window = self.canvas.create_window(0, 0, window=frame, anchor='nw')
+        slot = {'frame': frame, 'window': window, 'geometry': (), 'labels': [], 'defaults': [], 'lines': [],
+                'key': None, 'style': CARD_STYLES['project']}
+        frame.bind('<Button-1>', lambda e: self._on_card_click(slot['key']))
+        frame.bind('<Button-3>', lambda e: self._on_card_menu(slot['key'], e))
+        return slot
+
+    def _bind_card_slot(self, slot, key, lines):
+        """Show one card in a pooled slot, reconfiguring only the labels that differ"""
+        slot['key'] = key
+        style = CARD_STYLES[key[0]]
+        if slot['style'] != style:
+            slot['frame'].configure(bootstyle=style)
+            slot['style'] = style
+        while len(slot['labels']) < len(lines):
+            lbl = tb.Label(slot['frame'], anchor='e')
+            self._tag_wheel(lbl)
+            # lines without a font / colour of their own fall back to these
+            slot['defaults'].append((lbl.cget('font'), lbl.cget('foreground')))
+            slot['labels'].append(lbl)
+        shown = slot['lines']
+        for n, line in enumerate(lines):
+            if n < len(shown) and shown[n] == line:
+                continue
+            text, font, foreground = line
+            default_font, default_foreground = slot['defaults'][n]
+            slot['labels'][n].configure(text=text, font=font or default_font,
+                                        foreground=foreground or default_foreground)
+            if n >= len(shown):
+                slot['labels'][n].pack(fill='x')
+        for lbl in slot['labels'][len(lines):len(shown)]:
+            lbl.pack_forget()
+        slot['lines'] = list(lines)
+
+    def _on_card_click(self, key):
+        data = self._card_data.get(key)
+        if data is None:
+            return
+        if key[0] == 'project':
+            ProjectWindow(self.db, data['id'], self.request_refresh, data['name'])
+        elif key[0] == 'worker':
+            WorkerDetailWindow(self.db, 'worker', data['worker_ids'], data['name'], self.request_refresh)
+        else:
+            WorkerDetailWindow(self.db, 'importer', data['importer_ids'], data['name'], self.request_refresh)
+
+    def _on_card_menu(self, key, e):
+        if key is None or key[0] != 'project':
+            return
+        pid = self._card_data[key]['id']
+        menu = tb.Menu(self.app, tearoff=0)
+        menu.add_command(label='تعديل اسم المشروع', command=lambda: self.edit_project_dialog(pid))
+        menu.add_command(label='حذف المشروع', command=lambda: self.delete_project(pid))
+        menu.tk_popup(e.x_root, e.y_root)
 
     def add_project_dialog(self):
         try:
@@ -294,7 +459,7 @@ class MainWindow:
                     messagebox.showerror('خطأ', 'اسم المشروع موجود بالفعل!')
                     return
                 self.db.add_project(name)
-                self.load_projects()
+                self.request_refresh()
         except Exception:
             messagebox.showerror('خطأ', 'حدث خطأ أثناء الاتصال بقاعدة البيانات.')
 
@@ -308,7 +473,7 @@ class MainWindow:
             name = simpledialog.askstring('تعديل المشروع', 'اسم المشروع:', initialvalue=p['name'])
             if name:
                 self.db.edit_project(project_id, name)
-                self.load_projects()
+                self.request_refresh()
         except Exception:
             messagebox.showerror('خطأ', 'حدث خطأ أثناء الاتصال بقاعدة البيانات.')
 
@@ -316,195 +481,88 @@ class MainWindow:
         if messagebox.askyesno('تأكيد', 'هل تريد حذف المشروع؟'):
             try:
                 self.db.delete_project(project_id)
-                self.load_projects()
+                self.request_refresh()
             except Exception:
                 messagebox.showerror('خطأ', 'حدث خطأ أثناء الاتصال بقاعدة البيانات.')
 
     def export_to_excel(self):
+        """Start exporting to one Excel workbook in the background; progress shows in the toolbar"""
+        fname = f'projects_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
+        # only the projects changed since the last export are queried again
+        self._start_export(fname, export.export_incremental)
+
+    def export_per_project(self):
+        """Start exporting one workbook per project into a new folder, on all CPU cores"""
+        dirname = f'projects_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+        self._start_export(dirname, export.export_per_project)
+
+    def export_ledger(self):
+        """Start exporting the raw ledger for analytics: Parquet if pyarrow is installed, else CSV"""
+        ext = 'parquet' if export.parquet_available() else 'csv'
+        fname = f'ledger_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{ext}'
+        self._start_export(fname, export.export_ledger)
+
+    def _start_export(self, path, run_export):
+        if self._export_job is not None:
+            return
         try:
-            projects = self.db.get_all_projects()
-            if not projects:
-                messagebox.showinfo('تنبيه', 'لا توجد مشاريع للتصدير')
+            has_projects = bool(self.db.get_all_projects())
+        except Exception:
+            messagebox.showerror('خطأ', 'حدث خطأ أثناء الاتصال بقاعدة البيانات.')
+            return
+        if not has_projects:
+            messagebox.showinfo('تنبيه', 'لا توجد مشاريع للتصدير')
+            return
+        self._start_job(path, run_export, 'تم التصدير إلى {}', 'حدث خطأ أثناء التصدير: {}')
+
+    def _start_job(self, path, run, done_message, error_message):
+        """Run run(db, path, progress) as a background ExportJob, shown in the toolbar"""
+        self._export_job = ExportJob(self.db, path, export=run).start()
+        self._job_messages = (done_message, error_message)
+        for btn in self.job_buttons:
+            btn.configure(state='disabled')
+        self.export_progress.configure(value=0, maximum=1)
+        self.export_frame.pack(side='left', padx=6)
+        self.app.after(EXPORT_POLL_MS, self._poll_export)
+
+    def cancel_export(self):
+        if self._export_job is not None:
+            self._export_job.cancel()
+
+    def _poll_export(self):
+        job = self._export_job
+        while True:
+            try:
+                event, *args = job.events.get_nowait()
+            except queue.Empty:
+                self.app.after(EXPORT_POLL_MS, self._poll_export)
                 return
-            
-            wb = Workbook()
-            wb.remove(wb.active)  # Remove default sheet
-            
-            # Create summary sheet
-            ws_summary = wb.create_sheet('ملخص المشاريع', 0)
-            
-            # Header styling
-            header_fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-            header_font = Font(bold=True, color='FFFFFF', size=12)
-            
-            # Summary headers (reversed for RTL)
-            headers = ['اسم المشروع', 'المبلغ المكلف (عمال+موردين)', 'المبلغ المدفوع', 'المبلغ المتبقي']
-            cols = ['D', 'C', 'B', 'A']
-            for col_letter, header_text in zip(cols, headers):
-                cell = ws_summary[f'{col_letter}1']
-                cell.value = header_text
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = Alignment(horizontal='right', vertical='center')
-            
-            # Add summary data (reversed for RTL)
-            row = 2
-            for p in projects:
-                try:
-                    total, paid = self.db.get_workers_importers_summary(p['id'])
-                except Exception:
-                    total, paid = 0, 0
-                remain = total - paid
-                
-                ws_summary[f'D{row}'] = p['name']
-                ws_summary[f'C{row}'] = total
-                ws_summary[f'B{row}'] = paid
-                ws_summary[f'A{row}'] = remain
-                row += 1
-            
-            ws_summary.column_dimensions['A'].width = 25
-            ws_summary.column_dimensions['B'].width = 20
-            ws_summary.column_dimensions['C'].width = 20
-            ws_summary.column_dimensions['D'].width = 20
-            
-            # Create detailed sheet for each project
-            for p in projects:
-                project_id = p['id']
-                project_name = p['name'][:30] if len(p['name']) <= 30 else p['name'][:27] + '...'
-                
-                ws = wb.create_sheet(project_name)
-                
-                # Project title
-                ws['A1'] = f'المشروع: {p["name"]}'
-                ws['A1'].font = Font(bold=True, size=14, color='FFFFFF')
-                ws['A1'].fill = PatternFill(start_color='203864', end_color='203864', fill_type='solid')
-                ws.merge_cells('A1:D1')
-                
-                current_row = 3
-                
-                # ===== WORKERS SECTION =====
-                ws[f'A{current_row}'] = 'العمال'
-                ws[f'A{current_row}'].font = Font(bold=True, size=12, color='FFFFFF')
-                ws[f'A{current_row}'].fill = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
-                ws.merge_cells(f'A{current_row}:D{current_row}')
-                current_row += 1
-                
-                workers = self.db.get_workers_by_project(project_id)
-                if workers:
-                    # Headers (reversed for RTL)
-                    ws[f'D{current_row}'] = 'اسم العامل'
-                    ws[f'C{current_row}'] = 'المهنة'
-                    ws[f'B{current_row}'] = 'المبلغ المكلف'
-                    ws[f'A{current_row}'] = 'المبلغ المدفوع'
-                    for col in ['A', 'B', 'C', 'D']:
-                        ws[f'{col}{current_row}'].font = Font(bold=True, color='FFFFFF')
-                        ws[f'{col}{current_row}'].fill = PatternFill(start_color='8FAADC', end_color='8FAADC', fill_type='solid')
-                    current_row += 1
-                    
-                    for worker in workers:
-                        assigns = self.db.get_assignments('worker', worker['id'])
-                        total_assigned = sum(a['amount'] for a in assigns)
-                        
-                        total_paid = 0
-                        for a in assigns:
-                            pays = self.db.get_payments(a['id'])
-                            total_paid += sum(p['amount'] for p in pays)
-                        
-                        ws[f'D{current_row}'] = worker['name']
-                        ws[f'C{current_row}'] = worker.get('job') or ''
-                        ws[f'B{current_row}'] = total_assigned
-                        ws[f'A{current_row}'] = total_paid
-                        current_row += 1
-                else:
-                    ws[f'A{current_row}'] = 'لا يوجد عمال'
-                    current_row += 1
-                
-                current_row += 1
-                
-                # ===== IMPORTERS SECTION =====
-                ws[f'A{current_row}'] = 'الموردون'
-                ws[f'A{current_row}'].font = Font(bold=True, size=12, color='FFFFFF')
-                ws[f'A{current_row}'].fill = PatternFill(start_color='70AD47', end_color='70AD47', fill_type='solid')
-                ws.merge_cells(f'A{current_row}:D{current_row}')
-                current_row += 1
-                
-                importers = self.db.get_importers_by_project(project_id)
-                if importers:
-                    # Headers (reversed for RTL)
-                    ws[f'D{current_row}'] = 'اسم المورد'
-                    ws[f'C{current_row}'] = 'السلعة/الوظيفة'
-                    ws[f'B{current_row}'] = 'المبلغ المكلف'
-                    ws[f'A{current_row}'] = 'المبلغ المدفوع'
-                    for col in ['A', 'B', 'C', 'D']:
-                        ws[f'{col}{current_row}'].font = Font(bold=True, color='FFFFFF')
-                        ws[f'{col}{current_row}'].fill = PatternFill(start_color='C6E0B4', end_color='C6E0B4', fill_type='solid')
-                    current_row += 1
-                    
-                    for importer in importers:
-                        assigns = self.db.get_assignments('importer', importer['id'])
-                        total_assigned = sum(a['amount'] for a in assigns)
-                        
-                        total_paid = 0
-                        for a in assigns:
-                            pays = self.db.get_payments(a['id'])
-                            total_paid += sum(p['amount'] for p in pays)
-                        
-                        ws[f'D{current_row}'] = importer['name']
-                        ws[f'C{current_row}'] = ', '.join(importer.get('goods', [])) if importer.get('goods') else ''
-                        ws[f'B{current_row}'] = total_assigned
-                        ws[f'A{current_row}'] = total_paid
-                        current_row += 1
-                else:
-                    ws[f'A{current_row}'] = 'لا يوجد موردون'
-                    current_row += 1
-                
-                current_row += 1
-                
-                # ===== CUSTOMER SECTION =====
-                ws[f'A{current_row}'] = 'العميل'
-                ws[f'A{current_row}'].font = Font(bold=True, size=12, color='FFFFFF')
-                ws[f'A{current_row}'].fill = PatternFill(start_color='FFC000', end_color='FFC000', fill_type='solid')
-                ws.merge_cells(f'A{current_row}:C{current_row}')
-                current_row += 1
-                
-                try:
-                    cust_total, cust_paid = self.db.get_customer_summary(project_id)
-                except Exception:
-                    cust_total, cust_paid = 0, 0
-                cust_remain = cust_total - cust_paid
-                
-                ws[f'D{current_row}'] = 'إجمالي المبلغ المكلف'
-                ws[f'C{current_row}'] = cust_total
-                current_row += 1
-                ws[f'D{current_row}'] = 'المبلغ المدفوع'
-                ws[f'C{current_row}'] = cust_paid
-                current_row += 1
-                ws[f'D{current_row}'] = 'المبلغ المتبقي'
-                ws[f'C{current_row}'] = cust_remain
-                current_row += 1
-                
-                # Set column widths
-                ws.column_dimensions['A'].width = 25
-                ws.column_dimensions['B'].width = 25
-                ws.column_dimensions['C'].width = 20
-                ws.column_dimensions['D'].width = 20
-            
-            # Save file
-            fname = f'projects_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-            wb.save(fname)
-            messagebox.showinfo('تم', f'تم التصدير إلى {fname}')
-        except Exception as e:
-            messagebox.showerror('خطأ', f'حدث خطأ أثناء التصدير: {str(e)}')
+            if event == 'progress':
+                done, total = args
+                self.export_progress.configure(value=done, maximum=max(total, 1))
+                continue
+            break
+        self._export_job = None
+        self.export_frame.pack_forget()
+        for btn in self.job_buttons:
+            btn.configure(state='normal')
+        done_message, error_message = self._job_messages
+        if event == 'done':
+            messagebox.showinfo('تم', done_message.format(args[0]))
+        elif event == 'error':
+            messagebox.showerror('خطأ', error_message.format(args[0]))
 
     def backup_db(self):
-        try:
-            src = self.db.path
-            ts = datetime.now().strftime('%Y%m%d_%H%M%S')
-            dst = f'data_backup_{ts}.db'
-            shutil.copyfile(src, dst)
-            messagebox.showinfo('تم', f'تم إنشاء النسخة: {dst}')
-        except Exception:
-            messagebox.showerror('خطأ', 'حدث خطأ أثناء إنشاء النسخة الاحتياطية.')
+        """Back the database up in the background: an online, checked copy; old backups are rotated"""
+        if self._export_job is not None:
+            return
+        self._start_job(default_backup_dir(self.db),
+                        lambda db, directory, progress: backup_database(db, directory, progress, BACKUP_COMPRESSION),
+                        'تم إنشاء النسخة الاحتياطية في {}', 'حدث خطأ أثناء إنشاء النسخة الاحتياطية: {}')
 
     def run(self):
         self.app.mainloop()
+        # Closing the window stops a running export (it leaves no file behind)
+        if self._export_job is not None:
+            self._export_job.cancel()
+            self._export_job.join()
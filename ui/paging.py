@@ -0,0 +1,52 @@
+# Rows fetched per page by the paged listings
+PAGE_SIZE = 100
+
+# Fraction of a tree scrolled through at which its next page is fetched
+PREFETCH_AT = 0.9
+
+
+class TreePager:
+    """Fills a Treeview a page at a time, fetching the next page as the user nears the end.
+
+    fetch_page(after, limit) returns the rows following the cursor after (None:
+    the first page); insert_rows(rows) adds them to the tree; cursor(row) is
+    the cursor of the last row shown (by default its id). The first page is
+    loaded at once. The pager takes over the tree's yscrollcommand.
+    """
+    def __init__(self, tree, fetch_page, insert_rows, cursor=lambda row: row['id'], page_size=PAGE_SIZE):
+        self.tree = tree
+        self.fetch_page = fetch_page
+        self.insert_rows = insert_rows
+        self.cursor = cursor
+        self.page_size = page_size
+        self.after = None
+        self.done = False
+        self._pending = False
+        tree.configure(yscrollcommand=self._on_scroll)
+        self.load_more()
+
+    def load_more(self):
+        """Append the next page, if there is one"""
+        if self.done:
+            return
+        rows = self.fetch_page(self.after, self.page_size)
+        self.insert_rows(rows)
+        if rows:
+            self.after = self.cursor(rows[-1])
+        if len(rows) < self.page_size:
+            self.done = True
+
+    def stop(self):
+        """Fetch no further pages, e.g. once the tree is reloaded with another pager"""
+        self.done = True
+
+    def _on_scroll(self, first, last):
+        # Called by Tk whenever the visible range changes; prefetch when close to the end
+        if self.done or self._pending or float(last) < PREFETCH_AT:
+            return
+        self._pending = True
+        self.tree.after_idle(self._load_pending)
+
+    def _load_pending(self):
+        self._pending = False
+        self.load_more()
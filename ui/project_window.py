@@ -2,6 +2,10 @@ import ttkbootstrap as tb
 from ttkbootstrap.constants import RIGHT, LEFT
 from tkinter import Toplevel, messagebox, simpledialog, Listbox, Scrollbar
 from utils.validators import validate_amount, validate_date
+from ui.paging import PAGE_SIZE, TreePager
+from ui.tasks import BackgroundLoader
+
+# Rows fetched per page in the assignment trees
 
 
 class AutocompleteDialog:
@@ -161,6 +165,11 @@ class ProjectWindow:
         self.win.geometry('900x640')
         self.selected_worker = None
         self.selected_importer = None
+        # TreePager of each assignment tree (see _load_paged)
+        self._pagers = {}
+        # Project snapshot every tab renders from, None until the first load_all completes;
+        # it is always loaded on the Database executor, never on the Tk thread
+        self._model = None
         self._build_ui()
         self.load_all()
 
@@ -222,6 +231,12 @@ class ProjectWindow:
         return result[0]
 
     def _build_ui(self):
+        # Shown while the project is being loaded in the background
+        self.status_label = tb.Label(self.win, text='', anchor='e', foreground='gray')
+        self.status_label.pack(fill='x', padx=8, pady=(6, 0))
+        # The snapshot is read on the Database executor; the window stays responsive meanwhile
+        self._loader = BackgroundLoader(self.win, self.db, self.status_label)
+
         nb = tb.Notebook(self.win)
         nb.pack(fill='both', expand=True, padx=8, pady=8)
 
@@ -244,16 +259,7 @@ class ProjectWindow:
         self.workers_tree.bind('<<TreeviewSelect>>', self.on_worker_select)
 
         # Assignments for selected worker
-        self.assign_tree = tb.Treeview(self.workers_frame, columns=('description', 'amount', 'date'), show='headings', height=6)
-        self.assign_tree.heading('description', text='وصف العمل', anchor='e')
-        self.assign_tree.heading('amount', text='المبلغ', anchor='e')
-        self.assign_tree.heading('date', text='التاريخ', anchor='e')
-        self.assign_tree.column('description', anchor='e', width=150)
-        self.assign_tree.column('amount', anchor='e', width=80)
-        self.assign_tree.column('date', anchor='e', width=80)
-        self.assign_tree.tag_configure('paid', foreground='green')
-        self.assign_tree.pack(fill='both', expand=True, padx=6, pady=6)
-        self.assign_tree.bind('<Button-3>', self.on_assignment_right)
+        self.assign_tree = self._make_assignment_tree(self.workers_frame, height=6)
 
         ops_frame = tb.Frame(self.workers_frame)
         ops_frame.pack(fill='x', pady=6)
@@ -281,16 +287,7 @@ class ProjectWindow:
         self.imp_tree.bind('<<TreeviewSelect>>', self.on_importer_select)
         self.imp_tree.tag_configure('good', foreground='green')
 
-        self.imp_assign_tree = tb.Treeview(self.imp_frame, columns=('description', 'amount', 'date'), show='headings', height=6)
-        self.imp_assign_tree.heading('description', text='وصف العمل', anchor='e')
-        self.imp_assign_tree.heading('amount', text='المبلغ', anchor='e')
-        self.imp_assign_tree.heading('date', text='التاريخ', anchor='e')
-        self.imp_assign_tree.column('description', anchor='e', width=150)
-        self.imp_assign_tree.column('amount', anchor='e', width=80)
-        self.imp_assign_tree.column('date', anchor='e', width=80)
-        self.imp_assign_tree.tag_configure('paid', foreground='green')
-        self.imp_assign_tree.pack(fill='both', expand=True, padx=6, pady=6)
-        self.imp_assign_tree.bind('<Button-3>', self.on_assignment_right)
+        self.imp_assign_tree = self._make_assignment_tree(self.imp_frame, height=6)
 
         ops_imp = tb.Frame(self.imp_frame)
         ops_imp.pack(fill='x', pady=6)
@@ -306,24 +303,44 @@ class ProjectWindow:
         self.cust_summary = tb.Label(self.cust_frame, text='', anchor='e')
         self.cust_summary.pack(fill='x', padx=6, pady=6)
 
-        self.cust_assign_tree = tb.Treeview(self.cust_frame, columns=('description', 'amount', 'date'), show='headings', height=8)
-        self.cust_assign_tree.heading('description', text='وصف العمل', anchor='e')
-        self.cust_assign_tree.heading('amount', text='المبلغ', anchor='e')
-        self.cust_assign_tree.heading('date', text='التاريخ', anchor='e')
-        self.cust_assign_tree.column('description', width=150, anchor='e')
-        self.cust_assign_tree.column('amount', width=80, anchor='e')
-        self.cust_assign_tree.column('date', width=80, anchor='e')
-        self.cust_assign_tree.tag_configure('paid', foreground='green')
-        self.cust_assign_tree.pack(fill='both', expand=True, padx=6, pady=6)
-        self.cust_assign_tree.bind('<Button-3>', self.on_assignment_right)
+        self.cust_assign_tree = self._make_assignment_tree(self.cust_frame, height=8)
 
         bottom = tb.Frame(self.cust_frame)
         bottom.pack(fill='x')
         tb.Button(bottom, text='+ إضافة مبلغ مخصص', bootstyle='primary', command=self.add_assignment_for_customer).pack(side=LEFT, padx=6, pady=6)
         tb.Button(bottom, text='+ إضافة دفعة مدفوعة', bootstyle='success', command=self.add_payment_for_customer).pack(side=LEFT, padx=6, pady=6)
 
+    def _make_assignment_tree(self, parent, height):
+        """Assignment rows with their paid total; payment children are loaded when a row is opened"""
+        tree = tb.Treeview(parent, columns=('description', 'amount', 'paid', 'date'), show='tree headings', height=height)
+        # the tree column only holds the open/close indicator
+        tree.column('#0', width=28, stretch=False)
+        tree.heading('description', text='وصف العمل', anchor='e')
+        tree.heading('amount', text='المبلغ', anchor='e')
+        tree.heading('paid', text='المدفوع', anchor='e')
+        tree.heading('date', text='التاريخ', anchor='e')
+        tree.column('description', anchor='e', width=150)
+        tree.column('amount', anchor='e', width=80)
+        tree.column('paid', anchor='e', width=80)
+        tree.column('date', anchor='e', width=80)
+        tree.tag_configure('paid', foreground='green')
+        tree.pack(fill='both', expand=True, padx=6, pady=6)
+        tree.bind('<Button-3>', self.on_assignment_right)
+        tree.bind('<<TreeviewOpen>>', self.on_assignment_open)
+        return tree
+
     # Loading and handlers
-    def load_all(self):
+    def load_all(self, force=False):
+        # Nothing in this project was written since the last load
+        token = self.db.change_token(self.project_id)
+        if self._loader.is_current(token) and not force:
+            return
+        self._loader.start(token, self._on_model_loaded, self.db.load_project_snapshot, self.project_id)
+
+    def _on_model_loaded(self, model):
+        self._model = model
+        # the token the snapshot was read at
+        self._loader.token = model['token']
         self.load_workers()
         self.load_importers()
         self.load_customer()
@@ -350,7 +367,7 @@ class ProjectWindow:
     def load_workers(self):
         for i in self.workers_tree.get_children():
             self.workers_tree.delete(i)
-        workers = self.db.get_workers_by_project(self.project_id)
+        workers = self._model['workers']
         for w in workers:
             self.workers_tree.insert('', 'end', iid=w['id'], values=(w.get('job') or '', w['name']))
 
@@ -359,77 +376,52 @@ class ProjectWindow:
         for i in self.imp_tree.get_children():
             self.imp_tree.delete(i)
         
-        imps = self.db.get_importers_by_project(self.project_id)
+        model = self._model
+        imps = model['importers']
         
         for it in imps:
             importer_id = it['id']
             importer_name = it['name']
             
-            # Calculate totals for this importer across all goods
-            assigns = self.db.get_assignments('importer', importer_id)
-            total_assigned = sum(a['amount'] for a in assigns)
-            
-            # Calculate total paid for this importer
-            total_paid = 0
-            for a in assigns:
-                payments = self.db.get_payments(a['id'])
-                total_paid += sum(p['amount'] for p in payments)
-            
+            # Totals for this importer across all goods
+            total_assigned, total_paid = it['total_assigned'], it['total_paid']
             total_remaining = total_assigned - total_paid
             
             # Insert importer as parent row with totals in detail column
             summary_text = f'مُخصّص:{total_assigned:.2f}  المدفوع:{total_paid:.2f}  المتبقي:{total_remaining:.2f}'
             parent_id = self.imp_tree.insert('', 'end', iid=f'imp_{importer_id}', values=(summary_text, importer_name), tags=('parent',))
             
-            # Get all unique goods for this importer
-            goods_dict = {}  # good_name -> list of assignments
-            for a in assigns:
-                good_name = a.get('good') or 'بدون تصنيف'
-                if good_name not in goods_dict:
-                    goods_dict[good_name] = []
-                goods_dict[good_name].append(a)
+            # Totals of each good of this importer ('' for assignments without one)
+            goods = [(g['good'] or 'بدون تصنيف', g) for g in model['goods'].get(importer_id, [])]
             
             # Insert goods as child rows
-            for good_name, assignments in sorted(goods_dict.items()):
-                good_assigned = sum(a['amount'] for a in assignments)
-                good_paid = 0
-                for a in assignments:
-                    payments = self.db.get_payments(a['id'])
-                    good_paid += sum(p['amount'] for p in payments)
+            for good_name, g in sorted(goods, key=lambda item: item[0]):
+                good_assigned = g['total_assigned']
+                good_paid = g['total_paid']
                 good_remaining = good_assigned - good_paid
                 
                 good_summary = f'    مُخصّص:{good_assigned:.2f}  المدفوع:{good_paid:.2f}  المتبقي:{good_remaining:.2f}'
                 good_id = self.imp_tree.insert(f'imp_{importer_id}', 'end', values=(good_summary, '    ' + good_name), tags=('good',))
                 
                 # Store good info for later use
-                setattr(self, f'_good_{good_id}', {'importer_id': importer_id, 'good_name': good_name})
+                setattr(self, f'_good_{good_id}', {'importer_id': importer_id, 'good_name': good_name, 'good': g['good']})
         
         # Auto-expand all parent rows
         self.expand_all_rows(self.imp_tree)
 
     def load_customer(self):
         # calculate summary for customer only
-        try:
-            total, paid = self.db.get_customer_summary(self.project_id)
-        except Exception:
-            total = 0
-            paid = 0
+        model = self._model
+        total = model['customer']['total_assigned']
+        paid = model['customer']['total_paid']
         remain = total - paid
         self.cust_summary.config(text=f'إجمالي: {total:.2f}    المدفوع: {paid:.2f}    المتبقي: {remain:.2f}')
 
-        for i in self.cust_assign_tree.get_children():
-            self.cust_assign_tree.delete(i)
-        assigns = self.db.get_assignments('customer', self.project_id)
-        for a in assigns:
-            self.cust_assign_tree.insert('', 'end', iid=f"a{a['id']}", values=(a.get('description') or '', f"{a['amount']:.2f}", a['date']))
-            # add payments as children
-            pays = self.db.get_payments(a['id'])
-            for p in pays:
-                self.cust_assign_tree.insert(f"a{a['id']}", 'end', iid=f"p{p['id']}", values=('', f"{p['amount']:.2f}", p['date']), tags=('paid',))
-        # Auto-expand all parent rows
-        self.expand_all_rows(self.cust_assign_tree)
+        self._load_paged(self.cust_assign_tree, self._db_pager('customer', self.project_id))
 
     def add_worker(self):
+        if self._model is None:
+            return
         try:
             # Get existing worker names for autocomplete
             existing_names = self.db.get_unique_worker_names()
@@ -448,7 +440,7 @@ class ProjectWindow:
                 return
             
             # Check if this worker+job combination already exists in this project
-            workers_in_project = self.db.get_workers_by_project(self.project_id)
+            workers_in_project = self._model['workers']
             
             # Ask for job (required)
             existing_jobs = self.db.get_unique_jobs_for_worker(name)
@@ -490,9 +482,7 @@ class ProjectWindow:
                 # New worker+job combination
                 wid = self.db.add_worker_with_job(self.project_id, name, job)
             
-            self.load_workers()
-            if self.on_update_callback:
-                self.on_update_callback()
+            self.load_all()
         except Exception as e:
             messagebox.showerror('خطأ', f'حدث خطأ أثناء الاتصال بقاعدة البيانات: {str(e)}', parent=self.win)
 
@@ -507,40 +497,31 @@ class ProjectWindow:
 
     def edit_worker(self, worker_id):
         try:
-            cur = self.db.get_workers_by_project(self.project_id)
+            cur = self._model['workers'] if self._model else []
             w = next((x for x in cur if x['id'] == int(worker_id)), None)
             if not w:
                 return
             name = self.ask_string_focused('تعديل العامل', 'الاسم:', initialvalue=w['name'])
             if name:
                 self.db.edit_worker(worker_id, name)
-                self.load_workers()
-                if self.on_update_callback:
-                    self.on_update_callback()
+                self.load_all()
         except Exception:
             messagebox.showerror('خطأ', 'حدث خطأ أثناء الاتصال بقاعدة البيانات.', parent=self.win)
 
     def delete_worker(self, worker_id):
         if messagebox.askyesno('تأكيد', 'حذف العامل؟', parent=self.win):
             try:
-                # Delete all assignments and payments for this worker
-                assigns = self.db.get_assignments('worker', worker_id)
-                for a in assigns:
-                    payments = self.db.get_payments(a['id'])
-                    for p in payments:
-                        self.db.delete_payment(p['id'])
-                    self.db.delete_assignment(a['id'])
-                # Now delete the worker
-                self.db.delete_worker(worker_id)
+                # Delete the worker with all its assignments and payments in one commit
+                with self.db.transaction():
+                    self.db.delete_assignments_for('worker', worker_id)
+                    self.db.delete_worker(worker_id)
                 # Clear selected worker since it's deleted
                 if self.selected_worker == worker_id:
                     self.selected_worker = None
                     # Clear assignments tree
                     for i in self.assign_tree.get_children():
                         self.assign_tree.delete(i)
-                self.load_workers()
-                if self.on_update_callback:
-                    self.on_update_callback()
+                self.load_all()
             except Exception:
                 messagebox.showerror('خطأ', 'حدث خطأ أثناء الاتصال بقاعدة البيانات.', parent=self.win)
 
@@ -555,36 +536,72 @@ class ProjectWindow:
 
     def load_assignments_for(self, entity_type, entity_id):
         tree = self.assign_tree if entity_type == 'worker' else self.imp_assign_tree
-        for i in tree.get_children():
-            tree.delete(i)
-        assigns = self.db.get_assignments(entity_type, entity_id)
-        for a in assigns:
-            tree.insert('', 'end', iid=f"a{a['id']}", values=(a.get('description') or '', f"{a['amount']:.2f}", a['date']))
-            pays = self.db.get_payments(a['id'])
-            for p in pays:
-                tree.insert(f"a{a['id']}", 'end', iid=f"p{p['id']}", values=('', f"{p['amount']:.2f}", p['date']), tags=('paid',))
-        # Auto-expand all parent rows
-        self.expand_all_rows(tree)
+        self._load_paged(tree, self._db_pager(entity_type, entity_id))
+
+    def _db_pager(self, entity_type, entity_id, good=None):
+        """fetch_page (see _load_paged) over one entity's assignments (of one good, if given)"""
+        def fetch_page(after_id, limit):
+            return self.db.get_assignments_page(entity_type, entity_id, after_id, limit, good)
+        return fetch_page
+
+    def _load_paged(self, tree, fetch_page):
+        """Fill an assignment tree with its first page and fetch further pages as the user scrolls.
 
-    def load_assignments_for_good(self, importer_id, good_name):
-        """Load assignments for a specific good from a specific importer"""
-        tree = self.imp_assign_tree
+        fetch_page(after_id, limit) returns the next assignments, newest first.
+        """
+        old = self._pagers.get(str(tree))
+        if old is not None:
+            # it may still have a page scheduled for the entity shown before
+            old.stop()
         for i in tree.get_children():
             tree.delete(i)
-        
-        # Get all assignments for this importer
-        assigns = self.db.get_assignments('importer', importer_id)
-        
-        # Filter by good name
+        self._pagers[str(tree)] = TreePager(tree, fetch_page, lambda rows: self._insert_assignment_rows(tree, rows))
+
+    def _insert_assignment_rows(self, tree, assigns):
+        """Insert assignment rows (closed) with their paid totals.
+
+        A row with payments gets a placeholder child so it can be opened; the
+        payments themselves are fetched by on_assignment_open.
+        """
         for a in assigns:
-            if (a.get('good') or 'بدون تصنيف') == good_name:
-                tree.insert('', 'end', iid=f"a{a['id']}", values=(a.get('description') or '', f"{a['amount']:.2f}", a['date']))
-                pays = self.db.get_payments(a['id'])
-                for p in pays:
-                    tree.insert(f"a{a['id']}", 'end', iid=f"p{p['id']}", values=('', f"{p['amount']:.2f}", p['date']), tags=('paid',))
-        
-        # Auto-expand all parent rows
-        self.expand_all_rows(tree)
+            paid = a['paid_total']
+            iid = f"a{a['id']}"
+            tree.insert('', 'end', iid=iid, values=(a.get('description') or '', f"{a['amount']:.2f}", f'{paid:.2f}', a['date']))
+            if a['has_payments']:
+                tree.insert(iid, 'end', iid=f"x{a['id']}")
+
+    def on_assignment_open(self, event):
+        tree = event.widget
+        iid = tree.focus()
+        if iid.startswith('m'):
+            # The "more payments" row: replaced by the next page
+            tree.delete(iid)
+            self._insert_payment_page(tree, iid[1:])
+            return
+        placeholder = f'x{iid[1:]}'
+        if not iid.startswith('a') or not tree.exists(placeholder):
+            return
+        tree.delete(placeholder)
+        self._insert_payment_page(tree, iid[1:])
+
+    def _insert_payment_page(self, tree, aid):
+        """Add the next page of an assignment's payments under its row.
+
+        A full page is followed by a "more" row that, once opened, loads the next one.
+        """
+        parent = f'a{aid}'
+        shown = tree.get_children(parent)
+        after_id = int(shown[-1][1:]) if shown else None
+        payments = self.db.get_payments_page(int(aid), after_id, PAGE_SIZE)
+        for p in payments:
+            tree.insert(parent, 'end', iid=f"p{p['id']}", values=('', f"{p['amount']:.2f}", '', p['date']), tags=('paid',))
+        if len(payments) == PAGE_SIZE:
+            more = tree.insert(parent, 'end', iid=f'm{aid}', values=('المزيد...', '', '', ''))
+            tree.insert(more, 'end', iid=f'y{aid}')
+
+    def load_assignments_for_good(self, importer_id, good):
+        """Load assignments for a specific good ('' for none) from a specific importer"""
+        self._load_paged(self.imp_assign_tree, self._db_pager('importer', importer_id, good))
 
     def add_assignment_for_worker(self):
         sel = self.workers_tree.selection()
@@ -601,17 +618,15 @@ class ProjectWindow:
             from datetime import datetime
             date_v = datetime.now().strftime('%d-%m-%Y')
             self.db.add_assignment('worker', wid, amt_v, date_v, desc or '')
-            # Reload assignments for this worker immediately
-            self.load_assignments_for('worker', wid)
-            # Also reload customer summary
-            self.load_customer()
-            if self.on_update_callback:
-                self.on_update_callback()
+            # Reloads the worker's assignments and the totals
+            self.load_all()
         except Exception as e:
             messagebox.showerror('خطأ', str(e), parent=self.win)
 
     # Importers handlers
     def add_importer(self):
+        if self._model is None:
+            return
         try:
             # Get existing importer names for autocomplete
             existing_names = self.db.get_unique_importer_names()
@@ -630,7 +645,7 @@ class ProjectWindow:
                 return
             
             # Check if this importer already exists in this project
-            importers_in_project = self.db.get_importers_by_project(self.project_id)
+            importers_in_project = self._model['importers']
             
             if any(i['name'] == name for i in importers_in_project):
                 messagebox.showerror('خطأ', 'هذا المورد موجود بالفعل في هذا المشروع!', parent=self.win)
@@ -656,9 +671,7 @@ class ProjectWindow:
                 # New importer
                 iid = self.db.add_importer(self.project_id, name)
             
-            self.load_importers()
-            if self.on_update_callback:
-                self.on_update_callback()
+            self.load_all()
         except Exception as e:
             messagebox.showerror('خطأ', f'حدث خطأ أثناء الاتصال بقاعدة البيانات: {str(e)}', parent=self.win)
 
@@ -683,16 +696,14 @@ class ProjectWindow:
             # Extract importer_id from tree node ID (format: 'imp_<id>')
             importer_id = int(tree_iid.replace('imp_', ''))
             
-            cur = self.db.get_importers_by_project(self.project_id)
+            cur = self._model['importers'] if self._model else []
             w = next((x for x in cur if x['id'] == importer_id), None)
             if not w:
                 return
             name = self.ask_string_focused('تعديل المورد', 'الاسم:', initialvalue=w['name'])
             if name:
                 self.db.edit_importer(importer_id, name)
-                self.load_importers()
-                if self.on_update_callback:
-                    self.on_update_callback()
+                self.load_all()
         except Exception:
             messagebox.showerror('خطأ', 'حدث خطأ أثناء الاتصال بقاعدة البيانات.', parent=self.win)
 
@@ -702,24 +713,17 @@ class ProjectWindow:
                 # Extract importer_id from tree node ID (format: 'imp_<id>')
                 importer_id = int(tree_iid.replace('imp_', ''))
                 
-                # Delete all assignments and payments for this importer
-                assigns = self.db.get_assignments('importer', importer_id)
-                for a in assigns:
-                    payments = self.db.get_payments(a['id'])
-                    for p in payments:
-                        self.db.delete_payment(p['id'])
-                    self.db.delete_assignment(a['id'])
-                # Now delete the importer
-                self.db.delete_importer(importer_id)
+                # Delete the importer with all its assignments and payments in one commit
+                with self.db.transaction():
+                    self.db.delete_assignments_for('importer', importer_id)
+                    self.db.delete_importer(importer_id)
                 # Clear selected importer since it's deleted
                 if self.selected_importer == importer_id:
                     self.selected_importer = None
                     # Clear assignments tree
                     for i in self.imp_assign_tree.get_children():
                         self.imp_assign_tree.delete(i)
-                self.load_importers()
-                if self.on_update_callback:
-                    self.on_update_callback()
+                self.load_all()
             except Exception:
                 messagebox.showerror('خطأ', 'حدث خطأ أثناء الاتصال بقاعدة البيانات.', parent=self.win)
 
@@ -742,7 +746,7 @@ class ProjectWindow:
             # Need to extract importer_id and good_name from the selected good row
             good_info = getattr(self, f'_good_{iid}', None)
             if good_info:
-                self.load_assignments_for_good(good_info['importer_id'], good_info['good_name'])
+                self.load_assignments_for_good(good_info['importer_id'], good_info['good'])
             else:
                 # Fallback to loading all assignments if we can't find good info
                 parent = self.imp_tree.parent(iid)
@@ -779,7 +783,7 @@ class ProjectWindow:
         try:
             # Ask for good name - suggest existing goods for this importer
             existing_goods = self.db.get_unique_goods_for_importer(
-                next((i['name'] for i in self.db.get_importers_by_project(self.project_id) if i['id'] == importer_id), '')
+                next((i['name'] for i in self._model['importers'] if i['id'] == importer_id), '') if self._model else ''
             )
             
             good_dialog = AutocompleteDialog(
@@ -807,12 +811,7 @@ class ProjectWindow:
             self.db.add_assignment('importer', importer_id, amt_v, date_v, good_name, good=good_name)
             
             # Reload importers to update goods and totals
-            self.load_importers()
-            
-            # Also reload customer summary
-            self.load_customer()
-            if self.on_update_callback:
-                self.on_update_callback()
+            self.load_all()
         except Exception as e:
             messagebox.showerror('خطأ', str(e), parent=self.win)
 
@@ -820,7 +819,8 @@ class ProjectWindow:
     def on_assignment_right(self, event):
         widget = event.widget
         iid = widget.identify_row(event.y)
-        if not iid:
+        # nothing to edit on the "more payments" rows
+        if not iid or iid.startswith('m'):
             return
         menu = tb.Menu(self.win, tearoff=0)
         # Add payment and delete options
@@ -875,16 +875,14 @@ class ProjectWindow:
             from datetime import datetime
             date_v = datetime.now().strftime('%d-%m-%Y')
             self.db.add_assignment('customer', self.project_id, amt_v, date_v, desc or '')
-            self.load_customer()
-            if self.on_update_callback:
-                self.on_update_callback()
+            self.load_all()
         except Exception as e:
             messagebox.showerror('خطأ', str(e), parent=self.win)
 
     def add_payment_for_customer(self):
         try:
             # choose assignment from customer assignments
-            assigns = self.db.get_assignments('customer', self.project_id)
+            assigns = self.db.get_assignments_page('customer', self.project_id, limit=1)
             if not assigns:
                 messagebox.showwarning('تنبيه', 'لا يوجد مبالغ مرجعية')
                 return
@@ -897,7 +895,7 @@ class ProjectWindow:
             from datetime import datetime
             date_v = datetime.now().strftime('%d-%m-%Y')
             self.db.add_payment(aid, amt_v, date_v)
-            self.load_customer()
+            self.load_all()
         except Exception as e:
             messagebox.showerror('خطأ', str(e), parent=self.win)
 
@@ -980,6 +978,8 @@ class WorkerDetailWindow:
         self.win.title(f'تفاصيل ال{"عامل" if entity_type == "worker" else "مورد"}: {entity_name}')
         self.win.geometry('900x600')
         self.win.option_add('*Font', 'SegoeUI 10')
+        # Pages in the assignments as the tree is scrolled (see load_data)
+        self._pager = None
         
         self._build_ui()
         self.load_data()
@@ -994,19 +994,7 @@ class WorkerDetailWindow:
         title.pack(side='right', fill='both', expand=True)
         
         # Get current totals for display (sum across all entity IDs)
-        total_assigned = 0
-        total_paid = 0
-        
-        for entity_id in self.entity_ids:
-            assignments = self.db.get_assignments(self.entity_type, entity_id)
-            total_assigned += sum(a['amount'] for a in assignments)
-            
-            # Calculate total paid for this entity
-            for a in assignments:
-                cur = self.db.conn.cursor()
-                cur.execute('SELECT SUM(amount) as s FROM payments WHERE assignment_id=?', (a['id'],))
-                s = cur.fetchone()['s'] or 0
-                total_paid += s
+        total_assigned, total_paid = self.db.get_entities_balance(self.entity_type, self.entity_ids)
         
         stats = tb.Label(header, text=f'المجموع المُكلّف: {total_assigned:.2f} | المدفوع: {total_paid:.2f} | المتبقي: {total_assigned - total_paid:.2f}',
                         anchor='e', font=('Segoe UI', 9))
@@ -1066,91 +1054,43 @@ class WorkerDetailWindow:
                  command=self.win.destroy).pack(side=LEFT, padx=6)
     
     def load_data(self):
-        """Load all assignments for this worker/importer grouped by project"""
+        """Load the assignments of this worker/importer grouped by project, a page at a time"""
         # Clear tree
         for item in self.tree.get_children():
             self.tree.delete(item)
-        
-        # Collect assignments from all entity IDs (worker/importer can be in multiple projects)
-        all_assignments = []
-        for entity_id in self.entity_ids:
-            assignments = self.db.get_assignments(self.entity_type, entity_id)
-            all_assignments.extend(assignments)
-        
-        # Group by project_id
-        from collections import defaultdict
-        by_project = defaultdict(list)
-        
-        for a in all_assignments:
-            # Get project info for this assignment
-            cur = self.db.conn.cursor()
-            # The assignment doesn't directly have project_id, so we get it from worker/importer
-            # We need to find which entity_id this assignment belongs to
-            entity_id = None
-            for eid in self.entity_ids:
-                assigns = self.db.get_assignments(self.entity_type, eid)
-                if any(assign['id'] == a['id'] for assign in assigns):
-                    entity_id = eid
-                    break
-            
-            if entity_id:
-                if self.entity_type == 'worker':
-                    cur.execute('SELECT project_id FROM workers WHERE id=?', (entity_id,))
-                else:
-                    cur.execute('SELECT project_id FROM importers WHERE id=?', (entity_id,))
-                
-                row = cur.fetchone()
-                project_id = row['project_id'] if row else None
-                
-                if project_id:
-                    # Get project name
-                    proj = next((p for p in self.db.get_all_projects() if p['id'] == project_id), None)
-                    proj_name = proj['name'] if proj else f'Unknown (ID: {project_id})'
-                    by_project[project_id].append({
-                        'project_name': proj_name,
-                        'assignment': a
-                    })
-        
-        # Display by project
-        for project_id in sorted(by_project.keys(), key=lambda x: by_project[x][0]['project_name']):
-            items = by_project[project_id]
-            proj_name = items[0]['project_name']
-            
-            # Add project parent row (expanded by default)
-            parent_iid = self.tree.insert('', 'end', text=proj_name,
-                                         values=('', '', '', proj_name),
-                                         tags=())
-            
-            # Expand parent by default
-            self.tree.item(parent_iid, open=True)
-            
-            # Add assignment rows as children
-            for item in items:
-                a = item['assignment']
-                
-                # Calculate paid amount for this assignment
-                cur = self.db.conn.cursor()
-                cur.execute('SELECT SUM(amount) as s FROM payments WHERE assignment_id=?', (a['id'],))
-                paid = cur.fetchone()['s'] or 0
-                
-                # Add row for assigned amount
-                amount_text = f"{a['amount']:.2f}"
-                
-                assign_iid = self.tree.insert(parent_iid, 'end', iid=str(a['id']),
-                               values=(a['date'], amount_text, a.get('description') or '', ''),
-                               tags=())
-                
-                # Expand assignment row by default to show paid amounts
-                if paid > 0:
-                    self.tree.item(assign_iid, open=True)
-                
-                # Add sub-row for paid amount (in green)
-                if paid > 0:
-                    paid_text = f'{paid:.2f}'
-                    self.tree.insert(str(a['id']), 'end',
-                                   values=(a['date'], paid_text, f'تم دفع: {a.get("description") or ""}', ''),
-                                   tags=('paid',))
-    
+        # Project parent rows inserted so far
+        self._project_rows = {}
+        if self._pager is not None:
+            self._pager.stop()
+        # a page continues after the last row of the previous one
+        self._pager = TreePager(self.tree, self._fetch_page, self._insert_rows, cursor=lambda row: row)
+
+    def _fetch_page(self, last_row, limit):
+        return self.db.get_entity_history_page(self.entity_type, self.entity_ids, last_row, limit)
+
+    def _insert_rows(self, rows):
+        for a in rows:
+            parent_iid = self._project_rows.get(a['project_id'])
+            if parent_iid is None:
+                # Add project parent row (expanded by default)
+                parent_iid = self.tree.insert('', 'end', text=a['project_name'],
+                                              values=('', '', '', a['project_name']), open=True)
+                self._project_rows[a['project_id']] = parent_iid
+
+            # Paid amount for this assignment
+            paid = a['paid_total']
+            amount_text = f"{a['amount']:.2f}"
+            # Expand assignment row by default to show paid amounts
+            assign_iid = self.tree.insert(parent_iid, 'end', iid=str(a['id']),
+                                          values=(a['date'], amount_text, a.get('description') or '', ''),
+                                          open=paid > 0)
+
+            # Add sub-row for paid amount (in green)
+            if paid > 0:
+                self.tree.insert(assign_iid, 'end',
+                                 values=(a['date'], f'{paid:.2f}', f'تم دفع: {a.get("description") or ""}', ''),
+                                 tags=('paid',))
+
     def delete_assignment(self, tree):
         """Delete selected assignment"""
         selection = tree.selection()
@@ -0,0 +1,62 @@
+import time
+
+# A refresh waits this long for further requests to fold in (ms) ...
+REFRESH_DELAY_MS = 150
+# ... but never longer than this after the first one (ms)
+REFRESH_MAX_WAIT_MS = 1000
+
+# Region meaning "everything", for callers that cannot be more specific
+ALL = 'all'
+
+
+class RefreshScheduler:
+    """Debounces refresh requests and coalesces their dirty regions.
+
+    request() may be called any number of times (from several windows);
+    refresh(regions) runs once, on the Tk thread, when no request arrived for
+    delay_ms (or max_wait_ms after the first), with the union of the requested
+    regions. refresh returns False if there turned out to be nothing to do.
+    """
+    def __init__(self, widget, refresh, delay_ms=REFRESH_DELAY_MS, max_wait_ms=REFRESH_MAX_WAIT_MS):
+        self.widget = widget
+        self.refresh = refresh
+        self.delay_ms = delay_ms
+        self.max_wait_ms = max_wait_ms
+        self._dirty = set()
+        self._job = None
+        self._first_request = None
+        self.requested = 0
+        self.performed = 0
+
+    def request(self, *regions):
+        self.requested += 1
+        self._dirty.update(regions)
+        now = time.monotonic()
+        if self._job is None:
+            self._first_request = now
+        else:
+            self.widget.after_cancel(self._job)
+        waited_ms = (now - self._first_request) * 1000
+        delay = max(0, min(self.delay_ms, self.max_wait_ms - waited_ms))
+        self._job = self.widget.after(int(delay), self._flush)
+
+    def flush(self):
+        """Run a pending refresh now"""
+        if self._job is not None:
+            self.widget.after_cancel(self._job)
+            self._flush()
+
+    def _flush(self):
+        self._job = None
+        dirty = self._dirty
+        self._dirty = set()
+        if self.refresh(dirty) is not False:
+            self.performed += 1
+
+    @property
+    def suppressed(self):
+        """Requests that did not cause a refresh of their own (coalesced or no-op)"""
+        return self.requested - self.performed - (1 if self._job is not None else 0)
+
+    def stats(self):
+        return {'requested': self.requested, 'performed': self.performed, 'suppressed': self.suppressed}
@@ -0,0 +1,79 @@
+import traceback
+from tkinter import TclError, messagebox
+
+# How often a pending background result is checked for (ms)
+POLL_MS = 25
+
+LOADING_TEXT = 'جارٍ التحميل...'
+LOAD_ERROR_TEXT = 'حدث خطأ أثناء الاتصال بقاعدة البيانات.'
+
+
+def when_done(widget, future, on_done, on_error=None):
+    """Call on_done(result), or on_error(exception), on the Tk thread once future completes.
+
+    Tk must only be used from its own thread, so instead of a completion
+    callback the future is polled with widget.after. Nothing is delivered
+    (and a not yet started job is cancelled) if widget was destroyed meanwhile.
+    """
+    def poll():
+        try:
+            alive = widget.winfo_exists()
+        except TclError:
+            alive = False
+        if not alive:
+            future.cancel()
+            return
+        if not future.done():
+            widget.after(POLL_MS, poll)
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            if on_error:
+                on_error(e)
+            else:
+                traceback.print_exception(e)
+            return
+        on_done(result)
+
+    widget.after(POLL_MS, poll)
+
+
+class BackgroundLoader:
+    """Loads a window's data on the Database executor, rendering only the latest load.
+
+    token is the db.change_token() of the data shown (or being loaded);
+    is_current(token) tells a refresh it would be a no-op. While a load runs
+    status_label says so; a load started meanwhile supersedes it, and the
+    older result or error is dropped. A failed load is reported and resets
+    token, so the next refresh tries again.
+    """
+    def __init__(self, widget, db, status_label):
+        self.widget = widget
+        self.db = db
+        self.status_label = status_label
+        self.token = None
+        self._seq = 0
+
+    def is_current(self, token):
+        return token == self.token
+
+    def start(self, token, on_done, fn, *args):
+        """Run fn(*args) in the background, then on_done(result) on the Tk thread"""
+        self.token = token
+        self._seq += 1
+        seq = self._seq
+        self.status_label.configure(text=LOADING_TEXT)
+
+        def deliver(result):
+            if seq == self._seq:
+                self.status_label.configure(text='')
+                on_done(result)
+
+        def fail(error):
+            if seq == self._seq:
+                self.status_label.configure(text='')
+                self.token = None
+                messagebox.showerror('خطأ', LOAD_ERROR_TEXT, parent=self.widget)
+
+        when_done(self.widget, self.db.submit(fn, *args), deliver, fail)
@@ -1 +1,2 @@
-from .validators import validate_amount, validate_date
+from .validators import validate_amount, validate_date, to_iso_date
+from .files import make_temp_path
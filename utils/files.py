@@ -0,0 +1,25 @@
+import os
+import secrets
+
+# Attempts at a free name before giving up (names are random, so one nearly always does)
+TEMP_ATTEMPTS = 100
+
+
+def make_temp_path(directory, prefix, suffix, is_dir=False):
+    """Create an empty file (or directory) with a unique name in directory and return its path.
+
+    Unlike tempfile.mkstemp / mkdtemp (always 0600 / 0700) it is created with
+    0666 / 0777 and the kernel applies the umask, so it gets the mode of any
+    other new file once renamed into place.
+    """
+    for _ in range(TEMP_ATTEMPTS):
+        path = os.path.join(directory, f'{prefix}{secrets.token_hex(8)}{suffix}')
+        try:
+            if is_dir:
+                os.mkdir(path, 0o777)
+            else:
+                os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+        except FileExistsError:
+            continue
+        return path
+    raise FileExistsError(f'no free temporary name in {directory}')
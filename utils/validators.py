@@ -15,3 +15,10 @@ def validate_date(value):
         return dt.strftime('%d-%m-%Y')
     except Exception:
         raise ValueError('التاريخ يجب أن يكون بالشكل DD-MM-YYYY')
+
+
+def to_iso_date(value):
+    """Convert a DD-MM-YYYY date (or a date/datetime) to sortable YYYY-MM-DD"""
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%d')
+    return datetime.strptime(validate_date(value), '%d-%m-%Y').strftime('%Y-%m-%d')